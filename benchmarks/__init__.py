@@ -0,0 +1 @@
+"""falcon_epdb benchmark suite."""
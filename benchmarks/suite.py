@@ -0,0 +1,276 @@
+"""Measure the per-request cost of the middleware and its backends.
+
+Each case is run against a small Falcon app both through :class:`falcon.testing.TestClient` and by
+calling the app directly as a raw WSGI callable. ``epdb.serve()`` is stubbed out, so nothing ever
+listens on a port.
+
+Run the suite and compare against the stored baseline::
+
+    poetry run python -m benchmarks.suite
+
+Record a new baseline after an intentional change::
+
+    poetry run python -m benchmarks.suite --save
+"""
+
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import timeit
+from contextlib import contextmanager
+
+import epdb
+import falcon
+from falcon import testing
+
+from falcon_epdb import Base64Backend, EPDBServe, FernetBackend, JWTBackend
+
+try:
+    from cryptography.fernet import Fernet
+except ImportError:  # pragma: no cover
+    Fernet = None
+
+try:
+    import jwt
+except ImportError:  # pragma: no cover
+    jwt = None
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2, where allocations are not measured
+    tracemalloc = None
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+FERNET_KEY = b"mVk0ZaJdN2akNwLRpxmuuUOTLgB75n5kxB6KZvDwEWo="
+OTHER_FERNET_KEY = b"q7pQ0cLk7d8XhQG1bZQbJ9rE7H0o3oYgkJQ5V0b3r3A="
+JWT_KEY = "mVk0ZaJdN2akNwLRpxmuuUOTLgB75n5kxB6KZvDwEWo="
+OTHER_JWT_KEY = "not-the-server-key"
+
+VALID_CONTENT = {"epdb": {}}
+OVERSIZED_CONTENT = {"epdb": {}, "padding": "x" * 64 * 1024}
+
+CASES = ("no-header", "valid", "malformed", "bad-signature", "oversized")
+
+
+class _FormattingHandler(logging.Handler):
+    """A handler that pays the full formatting cost of each record, then discards it."""
+
+    def emit(self, record):
+        self.format(record)
+
+
+def _base64_headers():
+    def encode(content):
+        return "Base64 {}".format(base64.b64encode(json.dumps(content).encode()).decode())
+
+    return {
+        "valid": encode(VALID_CONTENT),
+        "malformed": "Base64 !not-base64!",
+        "bad-signature": None,
+        "oversized": encode(OVERSIZED_CONTENT),
+    }
+
+
+def _fernet_headers():
+    def encode(content, key=FERNET_KEY):
+        return "Fernet {}".format(Fernet(key).encrypt(json.dumps(content).encode()).decode())
+
+    return {
+        "valid": encode(VALID_CONTENT),
+        "malformed": "Fernet !not-a-token!",
+        "bad-signature": encode(VALID_CONTENT, key=OTHER_FERNET_KEY),
+        "oversized": encode(OVERSIZED_CONTENT),
+    }
+
+
+def _jwt_headers():
+    def encode(content, key=JWT_KEY):
+        token = jwt.encode(content, key, algorithm="HS256")
+        return "JWT {}".format(token.decode() if isinstance(token, bytes) else token)
+
+    return {
+        "valid": encode(VALID_CONTENT),
+        "malformed": "JWT !not-a-token!",
+        "bad-signature": encode(VALID_CONTENT, key=OTHER_JWT_KEY),
+        "oversized": encode(OVERSIZED_CONTENT),
+    }
+
+
+def get_backends():
+    """Return a mapping of backend name to a (middleware factory, headers factory) pair.
+
+    The ``bare`` entry runs the app without any middleware, to provide a reference point.
+    """
+    backends = {
+        "bare": (lambda: None, dict),
+        "base64": (lambda: EPDBServe(backend=Base64Backend()), _base64_headers),
+    }
+    if Fernet is not None:
+        backends["fernet"] = (lambda: EPDBServe(backend=FernetBackend(FERNET_KEY)), _fernet_headers)
+    if jwt is not None:
+        backends["jwt"] = (lambda: EPDBServe(backend=JWTBackend(JWT_KEY)), _jwt_headers)
+    return backends
+
+
+def make_app(middleware):
+    """Create a minimal app, optionally wrapped in the given middleware."""
+    app = falcon.API(middleware=[middleware] if middleware is not None else [])
+    app.add_route("/", testing.SimpleTestResource(json={}))
+    return app
+
+
+def make_callables(app, header):
+    """Return a mapping of target name to a zero-argument callable issuing one request."""
+    headers = {"X-EPDB": header} if header is not None else None
+    client = testing.TestClient(app)
+    environ = testing.create_environ(headers=headers)
+
+    def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+        pass
+
+    def simulate_client():
+        client.simulate_get("/", headers=headers)
+
+    def simulate_wsgi():
+        for _ in app(dict(environ), start_response):
+            pass
+
+    return {"client": simulate_client, "wsgi": simulate_wsgi}
+
+
+def measure(func, number, repeat=3):
+    """Return the best ns/op and the peak bytes allocated by a single call of func.
+
+    The peak is :obj:`None` where :mod:`tracemalloc` is unavailable.
+    """
+    func()  # Warm up any lazily-initialized state
+
+    # Suspend any trace function (eg. coverage), as it would dominate the measurement
+    tracer = sys.gettrace()
+    sys.settrace(None)
+    try:
+        best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    finally:
+        sys.settrace(tracer)
+
+    if tracemalloc is None:  # pragma: no cover
+        return {"ns_per_op": int(best * 1e9), "peak_alloc_bytes": None}
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"ns_per_op": int(best * 1e9), "peak_alloc_bytes": peak - before}
+
+
+@contextmanager
+def benchmark_environment():
+    """Stub out ``epdb.serve()`` and route the middleware's logs to a formatting-only handler."""
+    serve = epdb.serve
+    logger = logging.getLogger("falcon_epdb")
+    handler = _FormattingHandler()
+    propagate = logger.propagate
+
+    epdb.serve = lambda **kwargs: None
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.propagate = propagate
+        logger.removeHandler(handler)
+        epdb.serve = serve
+
+
+def run(number=2000, backends=None, targets=("client", "wsgi")):
+    """Run every case and return the results keyed by ``<target>/<backend>/<case>``."""
+    results = {}
+    available = get_backends()
+    with benchmark_environment():
+        for backend_name in backends or sorted(available):
+            middleware_factory, headers_factory = available[backend_name]
+            app = make_app(middleware_factory())
+            headers = headers_factory()
+            for case in CASES:
+                if case != "no-header" and headers.get(case) is None:
+                    continue  # Not applicable to this backend (eg. unsigned Base64)
+                callables = make_callables(app, headers.get(case))
+                for target in targets:
+                    key = "/".join((target, backend_name, case))
+                    results[key] = measure(callables[target], number)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the keys whose ns/op regressed by more than tolerance relative to the baseline."""
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected and result["ns_per_op"] > expected["ns_per_op"] * (1 + tolerance):
+            regressions.append(key)
+    return regressions
+
+
+def report(results, baseline):
+    """Print a table of the results, alongside the baseline where available."""
+    print("{:<34} {:>12} {:>12} {:>14}".format("case", "ns/op", "baseline", "peak bytes"))
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key, {}).get("ns_per_op", "-")
+        print(
+            "{:<34} {:>12} {:>12} {:>14}".format(
+                key,
+                result["ns_per_op"],
+                expected,
+                "-" if result["peak_alloc_bytes"] is None else result["peak_alloc_bytes"],
+            )
+        )
+
+
+def main(argv=None):
+    """Command-line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000, help="requests per timing run")
+    parser.add_argument("--backend", action="append", help="only run the given backend(s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="path to the JSON baseline")
+    parser.add_argument("--save", action="store_true", help="overwrite the baseline")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="allowed slowdown before failing"
+    )
+    args = parser.parse_args(argv)
+
+    results = run(number=args.number, backends=args.backend)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        report(results, {})
+        return 0
+
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except (IOError, ValueError):
+        baseline = {}
+
+    report(results, baseline)
+    regressions = compare(results, baseline, args.tolerance)
+    for key in regressions:
+        print("REGRESSION: {}".format(key), file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
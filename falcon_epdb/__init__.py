@@ -1,24 +1,125 @@
 """Remote debugging support for Falcon apps."""
 
+# pylint: disable=too-many-lines
+
 import base64
+import importlib
 import json
+import os
+import re
+import struct
+import sys
+import tempfile
 from abc import ABCMeta, abstractmethod
+from functools import partial
 from logging import getLogger
-
-import epdb
+from threading import Event, Lock, Thread
 
 try:
-    from cryptography import fernet
+    from time import monotonic
 except ImportError:  # pragma: no cover
-    pass
+    from time import time as monotonic
+
+from falcon_epdb.attach import BackgroundListener, accept_client, is_attached
+from falcon_epdb.cache import HeaderCache
+from falcon_epdb.lazy import import_epdb, import_optional
+from falcon_epdb.ports import PortPool
+from falcon_epdb.timing import ServerTiming, paused_seconds, time_pauses
+from falcon_epdb.watchdog import SessionLimits, watch_sessions
+
+__all__ = [
+    "Action",
+    "ArmSwitch",
+    "Base64Backend",
+    "CompositeBackend",
+    "EPDBBackend",
+    "EPDBException",
+    "EPDBServe",
+    "FailureReporter",
+    "FernetBackend",
+    "HeaderCache",
+    "HeaderThrottle",
+    "JWKSBackend",
+    "JWTBackend",
+    "KeySet",
+    "MemoryAction",
+    "Metrics",
+    "MetricsResource",
+    "PortPool",
+    "ProfileAction",
+    "SampleAction",
+    "SnapshotAction",
+    "SessionManager",
+    "SessionRegistry",
+    "TriggerRule",
+    "TriggerRules",
+]
+
+# The classes exported from the modules that the middleware only needs once configured to use
+# them, which are imported on first access
+_LAZY_EXPORTS = {
+    "Action": "falcon_epdb.actions",
+    "ArmSwitch": "falcon_epdb.control",
+    "FailureReporter": "falcon_epdb.reporting",
+    "HeaderThrottle": "falcon_epdb.throttle",
+    "KeySet": "falcon_epdb.keysets",
+    "MemoryAction": "falcon_epdb.actions",
+    "Metrics": "falcon_epdb.metrics",
+    "MetricsResource": "falcon_epdb.metrics",
+    "ProfileAction": "falcon_epdb.actions",
+    "SampleAction": "falcon_epdb.actions",
+    "SnapshotAction": "falcon_epdb.actions",
+    "SessionManager": "falcon_epdb.sessions",
+    "SessionRegistry": "falcon_epdb.registry",
+    "TriggerRule": "falcon_epdb.rules",
+    "TriggerRules": "falcon_epdb.rules",
+}
 
-try:
-    import jwt
-except ImportError:  # pragma: no cover
-    pass
+logger = getLogger(__name__)
 
 
-logger = getLogger(__name__)
+def __getattr__(name):
+    """Import one of the lazily exported classes on first access.
+
+    :param name: The name of the class
+    :type name: string
+    :raises: AttributeError
+    """
+    try:
+        module = _LAZY_EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = globals()[name] = getattr(importlib.import_module(module), name)
+    return value
+
+
+if sys.version_info < (3, 7):  # pragma: no cover
+    # Module __getattr__ is only called from Python 3.7, so import them up front instead
+    from falcon_epdb.actions import (
+        Action,
+        MemoryAction,
+        ProfileAction,
+        SampleAction,
+        SnapshotAction,
+    )
+    from falcon_epdb.control import ArmSwitch
+    from falcon_epdb.keysets import KeySet
+    from falcon_epdb.metrics import Metrics, MetricsResource
+    from falcon_epdb.registry import SessionRegistry
+    from falcon_epdb.reporting import FailureReporter
+    from falcon_epdb.rules import TriggerRule, TriggerRules
+    from falcon_epdb.sessions import SessionManager
+    from falcon_epdb.throttle import HeaderThrottle
+
+# Where the action started for a request is kept until the response is processed
+_ACTION_CONTEXT_KEY = "falcon_epdb.action"
+_TIMING_CONTEXT_KEY = "falcon_epdb.timing"
+_LIMITS_CONTEXT_KEY = "falcon_epdb.limits"
+_SESSION_CONTEXT_KEY = "falcon_epdb.session"
+
+# JSON strings, which may contain brackets that do not nest, and the brackets that do
+_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+_JSON_BRACKETS = re.compile(r"[][{}]")
 
 
 class EPDBException(Exception):
@@ -27,15 +128,61 @@ class EPDBException(Exception):
     # pylint: disable=too-few-public-methods
 
 
-class EPDBServe(object):
+class _SessionBusy(Exception):
+    """Raised when a flagged request is to be rejected, as another holds the debugger."""
+
+
+class EPDBServe(object):  # pylint: disable=too-many-instance-attributes
     """A middleware to enable remote debuging via an `epdb`_ server.
 
     :param backend: An instance of the class that will validate and decode the ``X-EPDB`` header
     :param exempt_methods: HTTP methods which will be ignored by this middleware
     :param serve_options: Parameters passed-through to :func:`epdb.serve()`
+    :param throttle: Limits how often headers are passed to the backend for processing
+    :param failure_reporter: Aggregates rejected headers into periodic summaries, rather than
+        logging each one with a traceback
+    :param blocking: Whether to block the request while waiting for a client to attach
+    :param arm_timeout: When not :obj:`blocking`, the number of seconds to keep listening for a
+        client, or :obj:`None` to listen indefinitely
+    :param ports: Ports from which each worker process claims its own, in place of the ``port``
+        in :obj:`serve_options`
+    :param registry: Where to record the sessions waiting for a client, for discovery by the
+        ``falcon-epdb`` console script
+    :param actions: The actions which may be requested in the payload in place of an interactive
+        session, keyed by name
+    :param output_dir: The directory in which actions write reports requested as files
+    :param metrics: Where to record counts and timings of the middleware's work
+    :param server_timing: Whether to attribute the latency of flagged requests to the debugger on
+        a ``Server-Timing`` response header, and tag them with an ``X-EPDB-Flagged`` header
+    :param rules: Armed rules which trigger on requests without an ``X-EPDB`` header
+    :param control: A switch which keeps the middleware inert until an operator arms it
+    :param accept_timeout: When :obj:`blocking`, the number of seconds to wait for a client to
+        attach before letting the request continue, or :obj:`None` to wait indefinitely
+    :param session_timeout: The number of seconds after a client attaches at which its session is
+        closed, or :obj:`None` for no limit
+    :param pause_timeout: The total number of seconds a request may spend stopped at the debugger
+        prompt before the session is closed, or :obj:`None` for no limit
+    :param sessions: Admits one flagged request at a time into the debugger, deciding what
+        happens to the others
     :type backend: EPDBBackend
     :type exempt_methods: iterable of strings
     :type serve_options: dictionary
+    :type throttle: HeaderThrottle or None
+    :type failure_reporter: FailureReporter or None
+    :type blocking: bool
+    :type arm_timeout: float or None
+    :type ports: iterable of ints or PortPool
+    :type registry: SessionRegistry or None
+    :type actions: dictionary of :class:`Action` subclasses
+    :type output_dir: string
+    :type metrics: Metrics or None
+    :type server_timing: bool
+    :type rules: TriggerRules or None
+    :type control: ArmSwitch or None
+    :type accept_timeout: float or None
+    :type session_timeout: float or None
+    :type pause_timeout: float or None
+    :type sessions: SessionManager or None
 
     A client may include a special ``X-EPDB`` header containing an appropriately formed payload.
     If they do, the header will be passed to the configured backend for processing. If the
@@ -51,53 +198,466 @@ class EPDBServe(object):
     The encoding and encryption of this payload is determined by the :class:`EPDBBackend`
     provided to the middleware.
 
+    By default, the first valid header blocks its request until a client attaches. If
+    :obj:`blocking` is :obj:`False`, the first valid header instead starts listening for a client
+    on a background thread and the request continues immediately. Once a client has attached,
+    the next request with a valid header drops into the session.
+
+    To debug an app running with several worker processes, provide a range of :obj:`ports`. Each
+    worker claims a free port from the range the first time it receives a valid header. The port
+    it claimed is reported on the ``X-EPDB-Port`` response header.
+
+    With a :obj:`registry`, each worker waiting for a client is recorded along with its port and
+    the request that triggered it, so that ``falcon-epdb list`` and ``falcon-epdb attach`` can
+    find it.
+
+    Rather than starting an interactive session, the payload may request an :class:`Action` to
+    run for the remainder of the request, such as a profile::
+
+        {
+            "epdb": {
+                "profile": {"sort": "cumtime", "limit": 50}
+            }
+        }
+
+    Requests which cannot carry a header, such as webhooks from a third party, can be caught by
+    arming :obj:`rules` that match their method, route and parameters instead.
+
+    With a :obj:`control` switch, the middleware does nothing at all, beyond checking a flag,
+    until an operator arms it. Arming applies to every worker process on the host, for a limited
+    time, and is authenticated by the :obj:`backend`.
+
+    So that a client which never attaches, or never lets go, cannot hold up a worker until it is
+    killed, set an :obj:`accept_timeout` and a :obj:`session_timeout` or :obj:`pause_timeout`.
+    When one is reached, the listener or session is closed, tracing stops, and the request
+    carries on as normal.
+
+    Under threaded or greenlet workers, concurrent flagged requests would each try to serve
+    `epdb`_ on the same port. Provide a :obj:`sessions` manager to admit one at a time, and let
+    the others continue untraced, queue, or fail fast.
+
     .. _epdb: https://pypi.org/project/epdb/
     """
 
-    def __init__(self, backend, exempt_methods=("OPTIONS",), serve_options=None):
+    def __init__(
+        self,
+        backend,
+        exempt_methods=("OPTIONS",),
+        serve_options=None,
+        throttle=None,
+        failure_reporter=None,
+        blocking=True,
+        arm_timeout=300.0,
+        ports=None,
+        registry=None,
+        actions=None,
+        output_dir=None,
+        metrics=None,
+        server_timing=False,
+        rules=None,
+        control=None,
+        accept_timeout=None,
+        session_timeout=None,
+        pause_timeout=None,
+        sessions=None,
+    ):
+        # pylint: disable=too-many-arguments,too-many-locals
         serve_options = serve_options or {}
         self.backend = backend
         self.exempt_methods = exempt_methods
         self.serve_options = serve_options
-
-    def process_request(self, req, resp):  # pylint: disable=unused-argument
+        self.throttle = throttle
+        self.failure_reporter = failure_reporter
+        self.listener = None if blocking else BackgroundListener(timeout=arm_timeout)
+        if ports is not None and not isinstance(ports, PortPool):
+            ports = PortPool(ports)
+        self.port_pool = ports
+        self.registry = registry
+        if actions is None:
+            # pylint: disable=import-outside-toplevel
+            from falcon_epdb.actions import DEFAULT_ACTIONS
+
+            actions = DEFAULT_ACTIONS
+        self.actions = actions
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.metrics = metrics
+        self.server_timing = server_timing
+        self.rules = rules
+        self.control = control
+        if control is not None:
+            control.start(backend)
+        self.accept_timeout = accept_timeout
+        self.session_timeout = session_timeout
+        self.pause_timeout = pause_timeout
+        self.sessions = sessions
+        self._pending_responses = 0
+        self._pending_lock = Lock()
+
+    def process_request(self, req, resp):
         """Check for a well-formed ``X-EPDB`` header and if present activate the `epdb`_ server.
 
         :param req: The Falcon request object
-        :param resp: The Falcon response object (unused)
+        :param resp: The Falcon response object
 
         This will block, waiting for an `epdb`_ client connection, the first time a valid
         header is received. Once the client is connected, subsequent passes will simply activate
-        the connected client and drop it into the `epdb`_ shell.
+        the connected client and drop it into the `epdb`_ shell. If the middleware is not
+        :obj:`blocking`, the connection is instead awaited on a background thread and the
+        request continues undisturbed.
+
+        The header processing is delegated to the configured :class:`EPDBBackend`. Requests that
+        do not carry the header are turned away with a single WSGI environ lookup, before any
+        backend work is done (see :attr:`EPDBBackend.header_environ_key`), unless :obj:`rules`
+        are configured, in which case they are checked against the armed rules. With a
+        :obj:`control` switch, nothing is checked at all until the switch is armed.
+        """
+        control = self.control
+        if control is not None and not control.armed:
+            return
+
+        environ_key = self.backend.header_environ_key
+        if environ_key is not None and environ_key not in req.env:
+            if self.rules is None:
+                return
+            header_data = self._match_rules(req)
+        else:
+            epdb_header = req.env[environ_key] if environ_key is not None else None
+            header_data = self._get_header_data(req, epdb_header)
+
+        if header_data is not None and not self._start_action(req, header_data):
+            self._serve(req, resp)
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        """Finish any action started for the request, returning its report on the response.
 
-        The header processing is delegated to the configured :class:`EPDBBackend`.
+        :param req: The Falcon request object
+        :param resp: The Falcon response object
+        :param resource: The resource object that handled the request (unused)
+        :param req_succeeded: Whether the request was handled without error (unused)
+
+        With :obj:`server_timing`, this also adds the ``Server-Timing`` and ``X-EPDB-Flagged``
+        headers to the responses of flagged requests, and any session limits stop applying to
+        the request's thread. Unless some request needs either, this returns after a single
+        attribute check.
         """
-        if req.method in self.exempt_methods:
+        # pylint: disable=unused-argument
+        if not self._pending_responses:
             return
 
+        action = self._pop_pending(req, _ACTION_CONTEXT_KEY)
+        if action is not None:
+            try:
+                action.finish(resp)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to finish the %s action", action.name)
+
+        self._finish_timing(req, resp)
+
+        limits = self._pop_pending(req, _LIMITS_CONTEXT_KEY)
+        if limits is not None:
+            limits.finish(resp)
+
+        self._release_session(req, resp)
+
+    def _finish_timing(self, req, resp):
+        """Add the request's ``Server-Timing`` headers to the response, if it is being timed."""
+        timing = self._pop_pending(req, _TIMING_CONTEXT_KEY)
+        if timing is not None:
+            timing.finish(resp)
+
+    def _add_pending(self, req, key, value):
+        """Store something for :meth:`process_response` to finish on the request's context."""
+        with self._pending_lock:
+            self._pending_responses += 1
+        req.context[key] = value
+
+    def _pop_pending(self, req, key):
+        """Remove and return something stored by :meth:`_add_pending`, or None."""
+        value = req.context.pop(key, None)
+        if value is not None:
+            with self._pending_lock:
+                self._pending_responses -= 1
+        return value
+
+    def _start_action(self, req, header_data):
+        """Start the action requested by the payload, if any, returning whether there was one."""
+        for name, action_class in self.actions.items():
+            if name in header_data:
+                break
+        else:
+            return False
+
+        try:
+            action = action_class(header_data[name], self.output_dir)
+            action.start()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Attempted, but failed, to start the %s action", name)
+            return True
+
+        self._add_pending(req, _ACTION_CONTEXT_KEY, action)
+        return True
+
+    def _match_rules(self, req):
+        """Return the payload of the armed rule matching the request, or None."""
+        header_data = self.rules.match(req)
+        if header_data is not None:
+            logger.info("Triggered epdb by a rule matching %s %s", req.method, req.path)
+            if self.metrics is not None:
+                self.metrics.inc("falcon_epdb_session_events_total", event="rule")
+            self._start_timing(req)
+        return header_data
+
+    def _start_timing(self, req):
+        """Start attributing the request's latency to the debugger, if enabled."""
+        if not self.server_timing:
+            return None
+        timing = ServerTiming()
+        self._add_pending(req, _TIMING_CONTEXT_KEY, timing)
+        return timing
+
+    def _get_header_data(self, req, epdb_header):
+        """Return the validated payload for the request, or None if it should not be served.
+
+        Any failure is logged (or reported) here, rather than raised.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.inc("falcon_epdb_headers_total")
+
+        if req.method in self.exempt_methods:
+            self._count_failure("exempt")
+            return None
+
+        throttle = self.throttle
+        if throttle is not None and not throttle.admit(req.remote_addr, epdb_header):
+            logger.debug("Dropped X-EPDB header from %s", req.remote_addr)
+            self._count_failure("throttled")
+            return None
+
+        timing = ServerTiming() if self.server_timing else None
+
+        started = monotonic()
         try:
             header_data = self.backend.get_header_data(req)
         except EPDBException as exc:
             # Probably got an invalid header value. Don't start the debugger.
-            logger.exception("Attempted, but failed, to serve epdb: %s", exc)
-            return
+            self._count_failure("rejected")
+            self._reject_header(req, epdb_header, exc)
+            return None
         except Exception:  # pylint: disable=broad-except
+            self._count_failure("error")
+            if throttle is not None:
+                throttle.reject(epdb_header, req.remote_addr)
             logger.exception(
                 "Attempted, but failed, to serve epdb:"
                 " Unexpected error when processing the X-EPDB header"
             )
-            return
-
+            return None
+        finally:
+            elapsed = monotonic() - started
+            if timing is not None:
+                timing.decode = elapsed
+            if metrics is not None:
+                metrics.observe(
+                    "falcon_epdb_decode_seconds", elapsed, backend=type(self.backend).__name__
+                )
+
+        if timing is not None and header_data is not None:
+            # Only the responses of requests with an accepted header are flagged
+            self._add_pending(req, _TIMING_CONTEXT_KEY, timing)
+        return header_data
+
+    def _get_serve_options(self):
+        """Return the options to pass to epdb, including the port to serve on.
+
+        The port is taken from this process's claim on the pool, if there is one, or else from
+        the configured options or epdb's default. Returns None if the pool has no port left for
+        this process.
+        """
+        if self.port_pool is None:
+            port = self.serve_options.get("port", import_epdb().SERVE_PORT)
+        else:
+            port = self.port_pool.claim()
+            if port is None:
+                logger.error("Attempted, but failed, to serve epdb: No free port in the pool")
+                self._count_failure("no_port")
+                return None
+        return dict(self.serve_options, port=port)
+
+    def _serve(self, req, resp):
+        """Drop into the epdb session, or start waiting for a client to attach."""
         try:
-            if header_data is not None:
-                logger.debug("Serving epdb with options: %s", self.serve_options)
-                epdb.serve(**self.serve_options)
+            serve_options = self._get_serve_options()
+            if serve_options is None:
+                return
+
+            if self.port_pool is not None:
+                # The port was picked from the pool, so the client needs to be told which
+                resp.set_header("X-EPDB-Port", str(serve_options["port"]))
+            attached = is_attached()
+            if self.metrics is not None:
+                self.metrics.record_attachment(attached)
+            if attached or (
+                self.listener is None and self.registry is None and self.accept_timeout is None
+            ):
+                if self._admit(req, resp):
+                    self._serve_epdb(req, serve_options)
+            elif self.listener is None:
+                self._wait_then_serve(req, resp, serve_options)
+            elif not self.listener.listening:
+                self._arm(req, serve_options)
+            else:
+                logger.debug("Still waiting for an epdb client to attach; continuing")
+        except _SessionBusy:
+            self._reject_busy(req, resp)
         except Exception:  # pylint: disable=broad-except
             logger.exception(
                 "Attempted, but failed, to serve epdb:"
                 " Unexpected error when starting epdb server"
             )
 
+    def _wait_then_serve(self, req, resp, serve_options):
+        """Admit the request, then block until a client attaches and drop into the session."""
+        if not self._admit(req, resp):
+            return
+        if self._wait_for_client(req, serve_options):
+            self._serve_epdb(req, serve_options)
+        else:
+            self._release_session(req)
+
+    def _admit(self, req, resp):
+        """Take the debugger for the request, returning whether it may be debugged.
+
+        Without a session manager, every request may be. Requests that are not admitted are
+        marked on the response, and :class:`_SessionBusy` is raised if the manager says to
+        reject them.
+        """
+        sessions = self.sessions
+        if sessions is None or _SESSION_CONTEXT_KEY in req.context:
+            return True
+
+        ticket = sessions.admit("{} {}".format(req.method, req.path))
+        if ticket is not None:
+            self._add_pending(req, _SESSION_CONTEXT_KEY, ticket)
+            return True
+
+        self._count_failure("busy")
+        resp.set_header(sessions.busy_header, "1")
+        if sessions.when_busy == "reject":
+            raise _SessionBusy()
+        return False
+
+    def _reject_busy(self, req, resp):
+        """Fail the request with a ``503`` response, as another request holds the debugger.
+
+        :raises: falcon.HTTPServiceUnavailable
+        """
+        import falcon  # pylint: disable=import-outside-toplevel
+
+        # The response middleware is not run for a request failed here on Falcon 1.x
+        self._finish_timing(req, resp)
+        raise falcon.HTTPServiceUnavailable(headers={self.sessions.busy_header: "1"})
+
+    def _release_session(self, req, resp=None):
+        """Let the next flagged request take the debugger, if this one holds it."""
+        if self.sessions is None:
+            return
+        ticket = self._pop_pending(req, _SESSION_CONTEXT_KEY)
+        if ticket is not None:
+            ticket.finish(resp)
+
+    def _serve_epdb(self, req, serve_options):
+        """Call :func:`epdb.serve()`, which blocks until a client attaches if none has."""
+        logger.debug("Serving epdb with options: %s", serve_options)
+        epdb = import_epdb()
+        if self.session_timeout is not None or self.pause_timeout is not None:
+            watch_sessions(epdb)
+            limits = SessionLimits(self.session_timeout, self.pause_timeout)
+            limits.start()
+            self._add_pending(req, _LIMITS_CONTEXT_KEY, limits)
+        metrics = self.metrics
+        timing = req.context.get(_TIMING_CONTEXT_KEY) if self.server_timing else None
+        if metrics is None and timing is None:
+            epdb.serve(**serve_options)
+            return
+
+        if timing is not None:
+            time_pauses(epdb)
+            # The header may have been decoded on another thread, as it is under ASGI
+            timing.measure_pauses()
+        if metrics is not None:
+            metrics.inc("falcon_epdb_session_events_total", event="serve")
+        started, paused_at_start = monotonic(), paused_seconds()
+        try:
+            epdb.serve(**serve_options)
+        finally:
+            if timing is not None:
+                timing.add_wait(started, paused_at_start)
+            if metrics is not None:
+                metrics.observe_since("falcon_epdb_blocked_seconds", started, stage="serve")
+        if metrics is not None:
+            metrics.record_attachment(is_attached())
+
+    def _wait_for_client(self, req, serve_options):
+        """Block until a client attaches, keeping the registry up to date while waiting."""
+        port = serve_options["port"]
+        if self.registry is not None:
+            self.registry.register(port, request="{} {}".format(req.method, req.path))
+        accept_options = dict(serve_options)
+        if self.accept_timeout is not None:
+            accept_options["timeout"] = self.accept_timeout
+        started = monotonic()
+        try:
+            attached = accept_client(**accept_options)
+        finally:
+            if self.registry is not None:
+                self.registry.unregister(port)
+            elapsed = monotonic() - started
+            timing = req.context.get(_TIMING_CONTEXT_KEY) if self.server_timing else None
+            if timing is not None:
+                timing.wait += elapsed
+            if self.metrics is not None:
+                self.metrics.observe("falcon_epdb_blocked_seconds", elapsed, stage="wait")
+        if self.metrics is not None:
+            if attached:
+                self.metrics.record_attachment(True)
+            else:
+                self.metrics.inc("falcon_epdb_session_events_total", event="wait_timeout")
+        return attached
+
+    def _arm(self, req, serve_options):
+        """Start listening for a client in the background."""
+        port = serve_options["port"]
+        on_finish = None
+        if self.registry is not None:
+            self.registry.register(port, request="{} {}".format(req.method, req.path))
+            on_finish = partial(self.registry.unregister, port)
+        try:
+            self.listener.start(on_finish=on_finish, **serve_options)
+        except Exception:
+            if on_finish is not None:
+                on_finish()
+            raise
+        if self.metrics is not None:
+            self.metrics.inc("falcon_epdb_session_events_total", event="arm")
+
+    def _count_failure(self, reason):
+        """Count a header that will not be served."""
+        if self.metrics is not None:
+            self.metrics.inc("falcon_epdb_header_failures_total", reason=reason)
+
+    def _reject_header(self, req, epdb_header, exc):
+        """Record that the backend rejected the header on this request."""
+        if self.throttle is not None:
+            self.throttle.reject(epdb_header, req.remote_addr)
+
+        if self.failure_reporter is not None:
+            self.failure_reporter.record(
+                str(exc), sample="{} {} from {}".format(req.method, req.path, req.remote_addr)
+            )
+        else:
+            logger.exception("Attempted, but failed, to serve epdb: %s", exc)
+
 
 class EPDBBackend(object):
     """The abstract base class defining the header-processing backend interface.
@@ -108,6 +668,34 @@ class EPDBBackend(object):
 
     __metaclass__ = ABCMeta
 
+    #: The WSGI environ key that must be present for :meth:`get_header_data` to find a payload.
+    #: :class:`EPDBServe` checks for this key before calling into the backend at all, so that
+    #: requests without the header cost a single dictionary lookup. Subclasses that override
+    #: :meth:`get_header_data` to look for the payload elsewhere should set this to :obj:`None`
+    #: to disable the check.
+    header_environ_key = "HTTP_X_EPDB"
+
+    #: An optional :class:`HeaderCache` of recently validated payloads
+    cache = None
+
+    #: The scheme token that prefixes the payloads this backend accepts, such as ``Fernet``.
+    #: Backends with a scheme may be registered with a :class:`CompositeBackend`.
+    scheme = None
+
+    #: The longest ``X-EPDB`` header value that is decoded at all, or :obj:`None` for no limit
+    max_header_length = 8192
+
+    #: The largest decoded (and decrypted) JSON payload, in bytes, or :obj:`None` for no limit
+    max_payload_size = 4096
+
+    #: The deepest nesting of objects and arrays in the JSON payload, or :obj:`None` for no limit
+    max_depth = 16
+
+    #: The function parsing the JSON payload, once it is within the limits. It is called with a
+    #: string, and may be replaced with a faster decoder, such as :func:`ujson.loads`, on a
+    #: subclass or an instance. It must raise a :exc:`ValueError` for malformed JSON.
+    json_loads = staticmethod(json.loads)
+
     def get_header_data(self, req):
         """Process a request and return the contents of a conforming payload.
 
@@ -121,13 +709,30 @@ class EPDBBackend(object):
 
         If the request does not appear to be attempting begin a debugging session, this will
         return :obj:`None`.
+
+        If the backend has a :attr:`cache`, a header value that was recently accepted is served
+        from it without being decoded again.
         """
-        epdb_header = req.headers.get("X-EPDB")
-        if epdb_header:
-            logger.debug("Found epdb header")
-            header_content = self.decode_header_value(epdb_header)
-            return self.validate_header_content(header_content)
-        return None
+        epdb_header = req.get_header("X-EPDB")
+        if not epdb_header:
+            return None
+
+        logger.debug("Found epdb header")
+        self._check_length(epdb_header)
+        if self.cache is not None:
+            epdb_data = self.cache.get(epdb_header)
+            if epdb_data is not None:
+                return epdb_data
+
+        header_content = self.decode_header_value(epdb_header)
+        epdb_data = self.validate_header_content(header_content)
+
+        if self.cache is not None:
+            expires = self.get_header_expiry(  # pylint: disable=assignment-from-none
+                epdb_header, header_content
+            )
+            self.cache.set(epdb_header, epdb_data, expires=expires)
+        return epdb_data
 
     @abstractmethod
     def decode_header_value(self, epdb_header):
@@ -142,6 +747,67 @@ class EPDBBackend(object):
         :meth:`validate_header_content`.
         """
 
+    def decode_payload(self, payload):
+        """Process the payload of an ``X-EPDB`` header, once its :attr:`scheme` has been checked.
+
+        :param payload: The ``X-EPDB`` header content following the scheme
+        :type payload: string
+        :returns: The decoded and decrypted header payload
+        :rtype: dictionary
+        :raises: EPDBException
+
+        This is how a :class:`CompositeBackend` hands a backend the payload. By default the
+        header is put back together and passed to :meth:`decode_header_value`; backends with a
+        :attr:`scheme` override this so that the header is not split again.
+        """
+        return self.decode_header_value("{} {}".format(self.scheme, payload))
+
+    def split_header_value(self, epdb_header):
+        """Split the ``X-EPDB`` header content into its scheme and payload.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :type epdb_header: string
+        :returns: The scheme and the payload
+        :rtype: tuple
+        :raises: EPDBException if the header is too long, or has no payload
+        """
+        self._check_length(epdb_header)
+        try:
+            scheme, payload = epdb_header.split(None, 1)
+        except ValueError:
+            raise EPDBException("Invalid X-EPDB value; must have two tokens")
+        return scheme, payload
+
+    def decode_json(self, data):
+        """Parse a decoded JSON payload with :attr:`json_loads`, if it is within the limits.
+
+        :param data: The decoded (and decrypted) payload
+        :type data: bytes
+        :returns: The parsed payload
+        :rtype: dictionary
+        :raises: EPDBException if the payload is too large, too deeply nested, or malformed
+
+        The limits are checked before the payload is parsed, so that junk is rejected cheaply.
+        """
+        try:
+            return self.json_loads(self._check_json(data))
+        except ValueError:
+            raise EPDBException("Invalid X-EPDB value; malformed payload")
+
+    def get_header_expiry(self, epdb_header, header_content):  # pylint: disable=unused-argument
+        """Return the time at which a decoded header value stops being acceptable.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :param header_content: The decoded ``X-EPDB`` header content
+        :type epdb_header: string
+        :type header_content: dictionary
+        :returns: The expiry as seconds since the epoch, or :obj:`None` if it does not expire
+        :rtype: float or None
+
+        This is used to bound how long a validated payload may be served from the :attr:`cache`.
+        """
+        return None
+
     @staticmethod
     def validate_header_content(header_content):
         """Ensure that the decoded ``X-EPDB`` header content is well-formed.
@@ -169,10 +835,36 @@ class EPDBBackend(object):
 
         return header_content["epdb"]
 
+    def _strip_scheme(self, epdb_header):
+        """Return the payload of the header, which must have this backend's scheme."""
+        scheme, payload = self.split_header_value(epdb_header)
+        if scheme != self.scheme:
+            raise EPDBException("Invalid X-EPDB value; scheme must be {}".format(self.scheme))
+        return payload
+
+    def _check_length(self, epdb_header):
+        """Reject a header longer than the limit."""
+        if self.max_header_length is not None and len(epdb_header) > self.max_header_length:
+            raise EPDBException("Invalid X-EPDB value; too long")
+
+    def _check_json(self, data):
+        """Return the JSON payload as a string, if it is within the size and depth limits."""
+        if self.max_payload_size is not None and len(data) > self.max_payload_size:
+            raise EPDBException("Invalid X-EPDB value; payload too large")
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            raise EPDBException("Invalid X-EPDB value; malformed payload")
+        if self.max_depth is not None and _nests_deeper(text, self.max_depth):
+            raise EPDBException("Invalid X-EPDB value; payload nested too deeply")
+        return text
+
 
 class Base64Backend(EPDBBackend):
     """A simple unauthenticated backend for local development."""
 
+    scheme = "Base64"
+
     def decode_header_value(self, epdb_header):
         """Pull the encrypted data out of the header, if present.
 
@@ -184,24 +876,47 @@ class Base64Backend(EPDBBackend):
 
         It expects :obj:`epdb_header` to have the ``Base64`` prefix.
         """
-        try:
-            scheme, payload = epdb_header.split()
-        except ValueError:
-            raise EPDBException("Invalid X-EPDB value; must have two tokens")
+        return self.decode_payload(self._strip_scheme(epdb_header))
 
-        if scheme != "Base64":
-            raise EPDBException("Invalid X-EPDB value; scheme must be Base64")
+    def decode_payload(self, payload):
+        """Decode the payload of a ``Base64`` header.
 
-        decoded_bytes = base64.b64decode(payload.encode())
-        decoded_string = decoded_bytes.decode()
-        return json.loads(decoded_string)
+        :param payload: The ``X-EPDB`` header content following the scheme
+        :type payload: string
+        :returns: The decoded header payload
+        :rtype: dictionary
+        :raises: EPDBException
+        """
+        if len(payload.split()) != 1:
+            raise EPDBException("Invalid X-EPDB value; must have two tokens")
+
+        try:
+            decoded_bytes = base64.b64decode(payload.encode())
+        except (TypeError, ValueError):
+            raise EPDBException("Invalid X-EPDB value; malformed payload")
+        return self.decode_json(decoded_bytes)
 
 
-class FernetBackend(EPDBBackend):
+class FernetBackend(EPDBBackend):  # pylint: disable=too-many-instance-attributes
     """A Python cryptography-based backend that supports a pre-shared key (ie. password) protocol.
 
-    :param key: The fernet key used to encrypt the header content
-    :type key: bytes
+    :param key: The fernet key used to encrypt the header content, or a list of keys, newest
+        first, any of which may have been used
+    :param ttl: The number of seconds after which a token is no longer accepted
+    :param cache: A cache of recently accepted header values
+    :param key_source: Where to reload the keys from while running: the path of a file with one
+        key per line, newest first, or a callable returning a list of keys
+    :param reload_interval: The number of seconds between reloads from the :obj:`key_source`
+    :type key: bytes or list of bytes
+    :type ttl: int or None
+    :type cache: HeaderCache or None
+    :type key_source: string, callable or None
+    :type reload_interval: float
+
+    To rotate the key without a window in which tokens are refused, add the new key at the front
+    of the list, switch the clients to it, and remove the old key once its tokens have expired.
+    With a :obj:`key_source`, each worker picks up the change on a background thread, without a
+    restart; alternatively, call :meth:`set_keys`.
 
     .. note:: To use this backend, one must install the :mod:`cryptography` package. The easiest
         way to do this is to specify the ``[fernet]`` extra when adding the ``falcon-epdb``
@@ -213,11 +928,81 @@ class FernetBackend(EPDBBackend):
             falcon-epdb[fernet]
     """
 
-    def __init__(self, key):
+    scheme = "Fernet"
+
+    def __init__(self, key=None, ttl=None, cache=None, key_source=None, reload_interval=10.0):
+        # pylint: disable=too-many-arguments
+        self._fernet_module = import_optional("cryptography.fernet", "fernet")
+        self.ttl = ttl
+        self.cache = cache
+        self.key_source = key_source
+        self.reload_interval = reload_interval
+        self._keys = None
+        self._stopped = Event()
+
+        if key is None and key_source is None:
+            raise ValueError("Either a key or a key_source is required")
+        self.set_keys(self._load_keys() if key is None else key)
+        if key_source is not None:
+            self._start_thread()
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._start_thread)
+
+    def set_keys(self, keys):
+        """Replace the keys with which tokens are decrypted.
+
+        :param keys: A key, or a list of keys, newest first
+        :type keys: bytes or list of bytes
+        :raises: ValueError if there are no keys, or one is not a valid fernet key
+
+        The keys are parsed before any are replaced, and the replacement is atomic, so requests
+        being handled meanwhile use either the old keys or the new ones. Cached headers are
+        dropped, so that tokens for removed keys are no longer accepted.
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        fernets = [self._fernet_module.Fernet(key) for key in keys]
+        if not fernets:
+            raise ValueError("At least one fernet key is required")
+
+        self.fernet = fernets[0] if len(fernets) == 1 else self._fernet_module.MultiFernet(fernets)
+        self._keys = tuple(keys)
+        if self.cache is not None:
+            self.cache.clear()
+
+    def refresh(self):
+        """Reload the keys from the :obj:`key_source`, if they have changed."""
         try:
-            self.fernet = fernet.Fernet(key)
-        except NameError:
-            raise ImportError("Missing optional [fernet] dependency")
+            keys = self._load_keys()
+            if tuple(keys) != self._keys:
+                self.set_keys(keys)
+                logger.info("Loaded %d fernet keys", len(keys))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to reload the fernet keys; keeping the current ones")
+
+    def stop(self):
+        """Stop reloading the keys."""
+        self._stopped.set()
+
+    def _load_keys(self):
+        """Return the keys from the key source."""
+        if callable(self.key_source):
+            return list(self.key_source())
+        with open(self.key_source, "rb") as key_file:
+            lines = [line.strip() for line in key_file]
+        return [line for line in lines if line and not line.startswith(b"#")]
+
+    def _start_thread(self):
+        """Start the thread which reloads the keys."""
+        self._stopped.clear()
+        thread = Thread(target=self._run, name="falcon-epdb-fernet-keys")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        """Reload the keys until stopped."""
+        while not self._stopped.wait(self.reload_interval):
+            self.refresh()
 
     def decode_header_value(self, epdb_header):
         """Pull the encrypted data out of the header, if present.
@@ -228,26 +1013,52 @@ class FernetBackend(EPDBBackend):
         :rtype: dictionary
         :raises: EPDBException
 
-        It expects :obj:`epdb_header` to have the ``Fernet`` prefix.
+        It expects :obj:`epdb_header` to have the ``Fernet`` prefix. Tokens encrypted with any of
+        the keys are accepted, as long as they are younger than the :obj:`ttl`.
+        """
+        return self.decode_payload(self._strip_scheme(epdb_header))
+
+    def decode_payload(self, payload):
+        """Decrypt the payload of a ``Fernet`` header.
+
+        :param payload: The ``X-EPDB`` header content following the scheme
+        :type payload: string
+        :returns: The decoded and decrypted header payload
+        :rtype: dictionary
+        :raises: EPDBException
         """
         try:
-            scheme, payload = epdb_header.split(None, 1)
-        except ValueError:
-            raise EPDBException("Invalid X-EPDB value; must have two tokens")
+            decrypted_bytes = self.fernet.decrypt(payload.encode(), ttl=self.ttl)
+        except self._fernet_module.InvalidToken:
+            raise EPDBException("Invalid X-EPDB value; invalid or expired token")
+
+        return self.decode_json(decrypted_bytes)
 
-        if scheme != "Fernet":
-            raise EPDBException("Invalid X-EPDB value; scheme must be Fernet")
+    def get_header_expiry(self, epdb_header, header_content):
+        """Return the time at which the token's ``ttl`` elapses, if one is configured.
 
-        decrypted_bytes = self.fernet.decrypt(payload.encode())
-        decrypted_string = decrypted_bytes.decode()
-        return json.loads(decrypted_string)
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :param header_content: The decoded ``X-EPDB`` header content
+        :type epdb_header: string
+        :type header_content: dictionary
+        :returns: The expiry as seconds since the epoch, or :obj:`None` if it does not expire
+        :rtype: float or None
+        """
+        if self.ttl is None:
+            return None
+        _, payload = epdb_header.split(None, 1)
+        # The token has been verified by now; its timestamp follows the version byte
+        token = base64.urlsafe_b64decode(payload.encode())
+        return struct.unpack(">Q", token[1:9])[0] + self.ttl
 
 
 class JWTBackend(EPDBBackend):
     """A JWT-based backend that supports a pre-shared key (ie. password) protocol.
 
     :param key: The JWT key used to encrypt the header content
+    :param cache: A cache of recently accepted header values
     :type key: bytes
+    :type cache: HeaderCache or None
 
     .. note:: To use this backend, one must install the :mod:`PyJWT` package. The easiest
         way to do this is to specify the ``[jwt]`` extra when adding the ``falcon-epdb``
@@ -259,13 +1070,12 @@ class JWTBackend(EPDBBackend):
             falcon-epdb[jwt]
     """
 
-    def __init__(self, key):
-        try:
-            jwt
-        except NameError:
-            raise ImportError("Missing optional [jwt] dependency")
+    scheme = "JWT"
 
+    def __init__(self, key, cache=None):
+        self._jwt = import_optional("jwt", "jwt")
         self.key = key
+        self.cache = cache
 
     def decode_header_value(self, epdb_header):
         """Pull the encrypted data out of the header, if present.
@@ -278,12 +1088,334 @@ class JWTBackend(EPDBBackend):
 
         It expects :obj:`epdb_header` to have the ``JWT`` prefix.
         """
+        return self.decode_payload(self._strip_scheme(epdb_header))
+
+    def decode_payload(self, payload):
+        """Verify and decode the payload of a ``JWT`` header.
+
+        :param payload: The ``X-EPDB`` header content following the scheme
+        :type payload: string
+        :returns: The decoded and verified header payload
+        :rtype: dictionary
+        :raises: EPDBException
+        """
+        self._check_claims(payload)
         try:
-            scheme, payload = epdb_header.split(None, 1)
-        except ValueError:
-            raise EPDBException("Invalid X-EPDB value; must have two tokens")
+            return self._jwt.decode(payload.encode(), self.key, algorithms="HS256")
+        except self._jwt.InvalidTokenError as exc:
+            raise EPDBException("Invalid X-EPDB value; invalid token: {}".format(exc))
+
+    def get_header_expiry(self, epdb_header, header_content):
+        """Return the token's ``exp`` claim, if present.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :param header_content: The decoded ``X-EPDB`` header content
+        :type epdb_header: string
+        :type header_content: dictionary
+        :returns: The expiry as seconds since the epoch, or :obj:`None` if it does not expire
+        :rtype: float or None
+        """
+        return header_content.get("exp")
+
+    def _check_claims(self, payload):
+        """Check that the token's claims are within the size and depth limits, before verifying.
 
-        if scheme != "JWT":
-            raise EPDBException("Invalid X-EPDB value; scheme must be JWT")
+        PyJWT parses the claims itself, so the :attr:`json_loads` hook does not apply to them.
+        """
+        segments = payload.split(".")
+        if len(segments) != 3:
+            return  # Left for PyJWT to reject
+        claims = segments[1]
+        if self.max_payload_size is not None and len(claims) * 3 // 4 > self.max_payload_size:
+            raise EPDBException("Invalid X-EPDB value; payload too large")
+        try:
+            data = base64.urlsafe_b64decode(str(claims) + "=" * (-len(claims) % 4))
+        except (TypeError, ValueError):
+            return
+        self._check_json(data)
+
+
+class JWKSBackend(JWTBackend):
+    """A JWT-based backend that verifies asymmetrically signed tokens against a set of public keys.
+
+    :param keyset: A JSON Web Key Set, as a dictionary, or the path of a file containing one
+    :param algorithms: The signature algorithms to accept, or :obj:`None` for any that suit the
+        token's key
+    :param audience: The ``aud`` claim that tokens must have, if any
+    :param issuer: The ``iss`` claim that tokens must have, if any
+    :param reload_interval: When :obj:`keyset` is a file, the number of seconds between checks
+        for changes to it
+    :param cache: A cache of recently accepted header values
+    :type keyset: dictionary, string or KeySet
+    :type algorithms: iterable of strings or None
+    :type audience: string or None
+    :type issuer: string or None
+    :type reload_interval: float
+    :type cache: HeaderCache or None
+    :raises: ValueError if the key set contains no usable keys
+
+    Tokens are signed with a private key held by whoever issues them (``RS256``, ``ES256`` and
+    ``EdDSA``, among others), so that the servers only need the public keys. Each token's header
+    must name its key with a ``kid``, unless the set has only one key. Keys are rotated by
+    editing the key set file, which is reloaded in the background. Cached headers are dropped
+    when it is, so that tokens signed by removed keys are no longer accepted.
+
+    .. note:: To use this backend, one must install both the :mod:`PyJWT` and
+        :mod:`cryptography` packages, and PyJWT 2.0 or later to accept ``EdDSA`` signatures.
+
+        .. code-block:: text
+            :caption: **requirements.txt**
+
+            falcon-epdb[jwt,fernet]
+    """
 
-        return jwt.decode(payload.encode(), self.key, algorithms="HS256")
+    def __init__(
+        self, keyset, algorithms=None, audience=None, issuer=None, reload_interval=10.0, cache=None
+    ):
+        # pylint: disable=too-many-arguments,super-init-not-called
+        # pylint: disable=import-outside-toplevel,redefined-outer-name
+        from falcon_epdb.keysets import KeySet
+
+        self._jwt = import_optional("jwt", "jwt")
+        if not isinstance(keyset, KeySet):
+            keyset = KeySet(keyset, reload_interval=reload_interval)
+        self.keyset = keyset
+        self.algorithms = None if algorithms is None else frozenset(algorithms)
+        self.audience = audience
+        self.issuer = issuer
+        self.cache = cache
+        keyset.add_listener(self._clear_cache)
+
+    def _clear_cache(self):
+        """Drop the cached headers, which may have been signed by keys no longer in the set."""
+        if self.cache is not None:
+            self.cache.clear()
+
+    def decode_payload(self, payload):
+        """Verify the signature of a ``JWT`` header's payload against the key set, and decode it.
+
+        :param payload: The ``X-EPDB`` header content following the scheme
+        :type payload: string
+        :returns: The decoded and verified header payload
+        :rtype: dictionary
+        :raises: EPDBException
+        """
+        self._check_claims(payload)
+        token = payload.encode()
+        try:
+            token_header = self._jwt.get_unverified_header(token)
+        except self._jwt.InvalidTokenError as exc:
+            raise EPDBException("Invalid X-EPDB value; invalid token: {}".format(exc))
+
+        found = self.keyset.get(token_header.get("kid"))
+        if found is None:
+            raise EPDBException("Invalid X-EPDB value; unknown key")
+        key, algorithms = found
+        algorithm = token_header.get("alg")
+        if algorithm not in algorithms or (
+            self.algorithms is not None and algorithm not in self.algorithms
+        ):
+            raise EPDBException("Invalid X-EPDB value; algorithm not allowed")
+
+        try:
+            return self._jwt.decode(
+                token, key, algorithms=[algorithm], audience=self.audience, issuer=self.issuer
+            )
+        except self._jwt.InvalidTokenError as exc:
+            raise EPDBException("Invalid X-EPDB value; invalid token: {}".format(exc))
+
+
+class CompositeBackend(EPDBBackend):
+    """A backend that hands each header to the backend registered for its scheme.
+
+    :param backends: The backends to accept headers for, each registered under its
+        :attr:`~EPDBBackend.scheme`, or a dictionary of backends by scheme
+    :param disabled: The schemes whose headers are rejected until :meth:`enable` is called
+    :type backends: iterable of EPDBBackend, or dictionary
+    :type disabled: iterable of strings
+    :raises: ValueError if a backend has no scheme, or two have the same one
+
+    The header is split once, and the payload decoded by the backend found for its scheme, so a
+    single middleware can accept, for example, ``Base64`` headers in staging alongside ``Fernet``
+    and ``JWT`` headers in production:
+
+    .. code-block:: python
+
+        backend = CompositeBackend(
+            [Base64Backend(), FernetBackend(key=fernet_key), JWTBackend(key=jwt_key)],
+            disabled=["Base64"],
+        )
+
+    A header value recently accepted by a backend with a :attr:`~EPDBBackend.cache` is served
+    from that cache. Headers that are rejected, including those with an unknown or disabled
+    scheme, are counted in :attr:`failures`.
+    """
+
+    def __init__(self, backends, disabled=()):
+        if isinstance(backends, dict):
+            backends = dict(backends)
+        else:
+            by_scheme = {}
+            for backend in backends:
+                if backend.scheme is None:
+                    raise ValueError("{} has no scheme".format(type(backend).__name__))
+                if backend.scheme in by_scheme:
+                    raise ValueError("Two backends have the {} scheme".format(backend.scheme))
+                by_scheme[backend.scheme] = backend
+            backends = by_scheme
+        disabled = frozenset(disabled)
+        unknown = disabled - set(backends)
+        if unknown:
+            raise ValueError("No backends for the schemes {}".format(", ".join(sorted(unknown))))
+
+        self.backends = backends
+        self._longest_scheme = max([len(scheme) for scheme in backends] or [0])
+        self._enabled = {scheme: scheme not in disabled for scheme in backends}
+        self._failures = {}
+        self._lock = Lock()
+
+    @property
+    def failures(self):
+        """The number of rejected headers, by scheme, with :obj:`None` for unknown schemes.
+
+        :rtype: dictionary
+        """
+        with self._lock:
+            return dict(self._failures)
+
+    def enable(self, scheme):
+        """Accept headers with the scheme.
+
+        :param scheme: The scheme of a registered backend
+        :type scheme: string
+        :raises: KeyError if no backend is registered for the scheme
+        """
+        self._set_enabled(scheme, True)
+
+    def disable(self, scheme):
+        """Reject headers with the scheme, until it is enabled again.
+
+        :param scheme: The scheme of a registered backend
+        :type scheme: string
+        :raises: KeyError if no backend is registered for the scheme
+        """
+        self._set_enabled(scheme, False)
+
+    def is_enabled(self, scheme):
+        """Return whether headers with the scheme are accepted.
+
+        :param scheme: A scheme
+        :type scheme: string
+        :rtype: bool
+        """
+        return self._enabled.get(scheme, False)
+
+    def get_header_data(self, req):
+        """Process a request and return the contents of a conforming payload.
+
+        :param req: The Falcon request object
+        :type req: Request
+        :returns: The paylod content or None
+        :rtype: dictionary or None
+        :raises: EPDBException
+        """
+        epdb_header = req.get_header("X-EPDB")
+        if not epdb_header:
+            return None
+
+        logger.debug("Found epdb header")
+        scheme, payload = self._split(epdb_header)
+        backend = self.backends[scheme]
+        try:
+            cache = backend.cache
+            if cache is not None:
+                epdb_data = cache.get(epdb_header)
+                if epdb_data is not None:
+                    return epdb_data
+
+            header_content = backend.decode_payload(payload)
+            epdb_data = backend.validate_header_content(header_content)
+
+            if cache is not None:
+                expires = backend.get_header_expiry(epdb_header, header_content)
+                cache.set(epdb_header, epdb_data, expires=expires)
+            return epdb_data
+        except Exception:
+            self._count_failure(scheme)
+            raise
+
+    def decode_header_value(self, epdb_header):
+        """Pull the data out of the header, using the backend for its scheme.
+
+        :param epdb_header: The content of the ``X-EPDB`` header.
+        :type epdb_header: string
+        :returns: The decoded header payload
+        :rtype: dictionary
+        :raises: EPDBException
+        """
+        scheme, payload = self._split(epdb_header)
+        try:
+            return self.backends[scheme].decode_payload(payload)
+        except Exception:
+            self._count_failure(scheme)
+            raise
+
+    def get_header_expiry(self, epdb_header, header_content):
+        """Return the expiry of the header, according to the backend for its scheme.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :param header_content: The decoded ``X-EPDB`` header content
+        :type epdb_header: string
+        :type header_content: dictionary
+        :returns: The expiry as seconds since the epoch, or :obj:`None` if it does not expire
+        :rtype: float or None
+        """
+        scheme, _ = self.split_header_value(epdb_header)
+        return self.backends[scheme].get_header_expiry(epdb_header, header_content)
+
+    def _split(self, epdb_header):
+        """Split the header, raising unless its scheme is registered and enabled.
+
+        The scheme is read from the start of the header before the header is checked, so that one
+        too long or without a payload is still counted against a registered scheme.
+        """
+        tokens = epdb_header[: self._longest_scheme + 1].split(None, 1)
+        prefix = tokens[0] if tokens else None
+        try:
+            scheme, payload = self.split_header_value(epdb_header)
+        except EPDBException:
+            self._count_failure(prefix if prefix in self.backends else None)
+            raise
+        if scheme not in self.backends:
+            self._count_failure(None)
+            raise EPDBException("Invalid X-EPDB value; unknown scheme")
+        if not self._enabled[scheme]:
+            self._count_failure(scheme)
+            raise EPDBException("Invalid X-EPDB value; scheme {} is disabled".format(scheme))
+        return scheme, payload
+
+    def _set_enabled(self, scheme, enabled):
+        """Enable or disable a registered scheme."""
+        if scheme not in self.backends:
+            raise KeyError(scheme)
+        self._enabled[scheme] = enabled
+
+    def _count_failure(self, scheme):
+        """Count a rejected header."""
+        with self._lock:
+            self._failures[scheme] = self._failures.get(scheme, 0) + 1
+
+
+def _nests_deeper(text, limit):
+    """Return whether the JSON text nests objects and arrays deeper than the limit."""
+    if text.count("{") + text.count("[") <= limit:
+        return False  # Too few brackets to exceed the limit, however they nest
+    depth = 0
+    for bracket in _JSON_BRACKETS.findall(_JSON_STRING.sub("", text)):
+        if bracket in "{[":
+            depth += 1
+            if depth > limit:
+                return True
+        else:
+            depth -= 1
+    return False
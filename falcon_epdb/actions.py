@@ -0,0 +1,712 @@
+"""Header-triggered alternatives to an interactive `epdb`_ session.
+
+An action runs alongside a single flagged request, from :meth:`EPDBServe.process_request` to
+:meth:`EPDBServe.process_response`, and then reports what it found. It is selected by including
+its name in the ``X-EPDB`` payload, along with its options::
+
+    {
+        "epdb": {
+            "profile": {"sort": "cumtime", "limit": 50}
+        }
+    }
+
+Every action accepts an ``output`` option, which determines how its report is returned:
+
+``body`` (the default)
+    The response body is replaced with the report, as ``text/plain``.
+``header``
+    The report is returned on the action's response header, zlib-compressed and base64-encoded.
+``file``
+    The report is written to a file in the middleware's ``output_dir``, and the path to that file
+    is returned on the action's response header.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+import base64
+import dis
+import json
+import os
+import sys
+import threading
+import time
+import types
+import zlib
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+OUTPUTS = ("body", "header", "file")
+
+
+class Action(object):
+    """The abstract base class for header-triggered actions.
+
+    :param options: The action's options from the ``X-EPDB`` payload
+    :param output_dir: The directory in which reports are written when ``output`` is ``file``
+    :type options: dictionary
+    :type output_dir: string
+    :raises: ValueError
+
+    An inheriting subclass must define :meth:`start`, :meth:`stop` and :meth:`render`, and should
+    set :attr:`name` and :attr:`report_header`.
+    """
+
+    __metaclass__ = ABCMeta
+
+    #: The key under which the action is selected in the ``X-EPDB`` payload
+    name = None
+
+    #: The response header on which the report, or the path to it, is returned
+    report_header = None
+
+    #: The extension given to reports written to a file
+    file_extension = "txt"
+
+    #: Where the report goes if the payload does not say
+    default_output = "body"
+
+    def __init__(self, options, output_dir):
+        if not isinstance(options, dict):
+            raise ValueError("{} options must be a dictionary".format(self.name))
+        self.output = options.get("output", self.default_output)
+        if self.output not in OUTPUTS:
+            raise ValueError("output must be one of {}".format(", ".join(OUTPUTS)))
+        self.options = options
+        self.output_dir = output_dir
+
+    @abstractmethod
+    def start(self):
+        """Begin collecting data; called from :meth:`EPDBServe.process_request`."""
+
+    @abstractmethod
+    def stop(self):
+        """Stop collecting data; called from :meth:`EPDBServe.process_response`."""
+
+    @abstractmethod
+    def render(self):
+        """Return the report as text.
+
+        :rtype: string
+        """
+
+    def write(self, path):
+        """Write the report to a file.
+
+        :param path: The path of the file to write
+        :type path: string
+
+        Subclasses may override this to write a more useful format than :meth:`render` provides.
+        """
+        with open(path, "w") as report_file:
+            report_file.write(self.render())
+
+    def finish(self, resp):
+        """Stop collecting data and return the report on the response.
+
+        :param resp: The Falcon response object
+        :type resp: Response
+        """
+        self.stop()
+
+        if self.output == "file":
+            path = os.path.join(
+                self.output_dir,
+                "falcon-epdb-{}-{}-{}.{}".format(
+                    self.name, os.getpid(), int(time.time() * 1000), self.file_extension
+                ),
+            )
+            self.write(path)
+            resp.set_header(self.report_header, path)
+        elif self.output == "header":
+            report = base64.b64encode(zlib.compress(self.render().encode("utf-8")))
+            resp.set_header(self.report_header, report.decode("ascii"))
+        else:
+            set_text_body(resp, self.render())
+
+
+def set_text_body(resp, text):
+    """Replace the response body with plain text.
+
+    :param resp: The Falcon response object
+    :param text: The new body
+    :type resp: Response
+    :type text: string
+    """
+    resp.media = None
+    if hasattr(resp, "text"):
+        resp.text = None
+    else:
+        resp.body = None
+    resp.data = text.encode("utf-8")
+    resp.content_type = "text/plain; charset=utf-8"
+
+
+class ProfileAction(Action):
+    """Runs the rest of the request under :mod:`cProfile`.
+
+    Options:
+
+    ``sort``
+        The :meth:`pstats.Stats.sort_stats` key to order the report by; ``cumulative`` by default
+    ``limit``
+        The number of rows to include in the report; 50 by default
+
+    When the ``output`` is ``file``, the raw stats are written, rather than the text report, so
+    that they can be loaded with :mod:`pstats` or any tool that reads its format.
+
+    :mod:`cProfile` and :mod:`pstats` are only imported once a profile is requested, as the
+    latter is relatively expensive to import.
+    """
+
+    name = "profile"
+    report_header = "X-EPDB-Profile"
+    file_extension = "pstats"
+
+    def __init__(self, options, output_dir):
+        # pylint: disable=import-outside-toplevel
+        import cProfile
+        import pstats
+
+        super(ProfileAction, self).__init__(options, output_dir)
+        self.sort = options.get("sort", "cumulative")
+        if self.sort not in pstats.Stats.sort_arg_dict_default:
+            raise ValueError("Unknown profile sort key: {}".format(self.sort))
+        self.limit = int(options.get("limit", 50))
+        self.profiler = cProfile.Profile()
+
+    def start(self):
+        """Start profiling the current thread."""
+        self.profiler.enable()
+
+    def stop(self):
+        """Stop profiling."""
+        self.profiler.disable()
+
+    def render(self):
+        """Return the profile as a :mod:`pstats` text report.
+
+        :rtype: string
+        """
+        import pstats  # pylint: disable=import-outside-toplevel
+
+        stream = StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats(self.sort).print_stats(self.limit)
+        return stream.getvalue()
+
+    def write(self, path):
+        """Write the raw :mod:`pstats` data to a file.
+
+        :param path: The path of the file to write
+        :type path: string
+        """
+        self.profiler.dump_stats(path)
+
+
+class SampleAction(Action):
+    """Samples the stack of the request's thread from a background thread.
+
+    Options:
+
+    ``rate``
+        The number of samples to take per second, between 1 and 1000; 100 by default
+
+    The report is in the collapsed-stack format read by flame graph tools such as
+    ``flamegraph.pl``, ``speedscope`` and ``inferno``: one line per distinct stack, with its frames
+    from the outermost to the innermost separated by ``;``, followed by the number of times it was
+    sampled.
+
+    Unlike :class:`ProfileAction`, nothing is traced on the request's thread, so the overhead is
+    limited to the sampler holding the GIL briefly at each sample. Only the thread that ran
+    :meth:`EPDBServe.process_request` is sampled, so other requests are unaffected. The sampler
+    gives up after :attr:`max_duration` seconds in case the response is never processed.
+    """
+
+    name = "sample"
+    report_header = "X-EPDB-Sample"
+    file_extension = "folded"
+
+    #: The longest, in seconds, that the sampler runs for
+    max_duration = 300.0
+
+    def __init__(self, options, output_dir):
+        super(SampleAction, self).__init__(options, output_dir)
+        rate = float(options.get("rate", 100))
+        if not 1 <= rate <= 1000:
+            raise ValueError("sample rate must be between 1 and 1000 per second")
+        self.interval = 1.0 / rate
+        self.counts = defaultdict(int)
+        self.thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Start sampling the current thread."""
+        self.thread_id = threading.current_thread().ident
+        self._sampler = threading.Thread(target=self._run, name="falcon-epdb-sampler")
+        self._sampler.daemon = True
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling, and wait for the sampler to finish."""
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def render(self):
+        """Return the samples as collapsed stacks.
+
+        :rtype: string
+        """
+        return "".join(
+            "{} {}\n".format(stack, count) for stack, count in sorted(self.counts.items())
+        )
+
+    def _run(self):
+        """Sample the stack until stopped."""
+        deadline = time.time() + self.max_duration
+        while not self._stopped.wait(self.interval) and time.time() < deadline:
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                break
+            self.counts[collapse_stack(frame)] += 1
+
+
+class MemoryAction(Action):  # pylint: disable=too-many-instance-attributes
+    """Reports the memory allocated during the rest of the request using :mod:`tracemalloc`.
+
+    Options:
+
+    ``limit``
+        The number of allocation sites to include in each table of the report; 20 by default
+    ``group_by``
+        How allocation sites are grouped: ``lineno`` (the default), ``filename`` or ``traceback``
+    ``frames``
+        The number of frames stored for each allocation, which is only useful with ``traceback``;
+        1 by default
+
+    Snapshots are taken as the request starts and finishes, and the report lists the sites with
+    the largest growth in both size and count, along with the peak traced memory. Tracing is only
+    switched on while at least one request is being traced, so the allocator runs at full speed
+    the rest of the time. If :mod:`tracemalloc` was already tracing, it is left running.
+
+    Note that :mod:`tracemalloc` traces every thread, so allocations made by concurrent requests
+    are included. Requires Python 3.4+.
+    """
+
+    name = "memory"
+    report_header = "X-EPDB-Memory"
+
+    _lock = threading.Lock()
+    _users = 0
+    _started_tracing = False
+
+    def __init__(self, options, output_dir):
+        super(MemoryAction, self).__init__(options, output_dir)
+        try:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            raise ValueError("The memory action requires Python 3.4+")
+        self.tracemalloc = tracemalloc
+        self.limit = int(options.get("limit", 20))
+        self.group_by = options.get("group_by", "lineno")
+        if self.group_by not in ("lineno", "filename", "traceback"):
+            raise ValueError("group_by must be one of lineno, filename, traceback")
+        self.frames = int(options.get("frames", 1))
+        if not 1 <= self.frames <= 100:
+            raise ValueError("frames must be between 1 and 100")
+        self.before = self.after = None
+        self.start_size = self.end_size = self.peak_size = 0
+
+    def start(self):
+        """Start tracing, if necessary, and take the first snapshot."""
+        tracemalloc = self.tracemalloc
+        with MemoryAction._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                MemoryAction._started_tracing = True
+            MemoryAction._users += 1
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        self.before = self._take_snapshot()
+        self.start_size = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        """Take the second snapshot, and stop tracing if no other request needs it."""
+        tracemalloc = self.tracemalloc
+        self.end_size, self.peak_size = tracemalloc.get_traced_memory()
+        self.after = self._take_snapshot()
+        with MemoryAction._lock:
+            MemoryAction._users -= 1
+            if not MemoryAction._users and MemoryAction._started_tracing:
+                tracemalloc.stop()
+                MemoryAction._started_tracing = False
+
+    def render(self):
+        """Return the allocation sites that grew the most, and the peak memory, as text.
+
+        :rtype: string
+        """
+        stats = self.after.compare_to(self.before, self.group_by)
+        lines = [
+            "Traced memory: {} at the start, {} at the end, {} at the peak".format(
+                format_size(self.start_size),
+                format_size(self.end_size),
+                format_size(self.peak_size),
+            ),
+            "",
+            "Top {} allocation sites by size:".format(self.limit),
+        ]
+        lines.extend(str(stat) for stat in stats[: self.limit])
+        lines.extend(["", "Top {} allocation sites by count:".format(self.limit)])
+        stats.sort(key=lambda stat: (stat.count_diff, stat.size_diff), reverse=True)
+        lines.extend(str(stat) for stat in stats[: self.limit])
+        return "\n".join(lines) + "\n"
+
+    def _take_snapshot(self):
+        """Take a snapshot, excluding the allocations made by :mod:`tracemalloc` and this action."""
+        tracemalloc = self.tracemalloc
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        )
+
+
+class SnapshotAction(Action):  # pylint: disable=too-many-instance-attributes
+    """Captures the locals and stack whenever a line is reached, without pausing the request.
+
+    Options:
+
+    ``location``
+        The line to capture at, as ``path:line``, where the path is matched against the end of the
+        source file's path; required
+    ``condition``
+        A Python expression, evaluated in the frame at the line, which must be true for a
+        snapshot to be taken
+    ``depth``
+        How many levels of nested containers to copy; 2 by default
+    ``limit``
+        The greatest number of snapshots to take during the request; 1 by default
+    ``frames``
+        The greatest number of stack frames to record; 20 by default
+
+    Each snapshot is a bounded copy of the frame's locals, in which long strings and containers
+    are truncated and other objects are replaced by their (truncated) ``repr``, along with the
+    stack. The report is written as JSON to a file in the output directory by default.
+
+    Only the code object containing the line is instrumented. On Python 3.12+, line events are
+    enabled on that code object alone using :mod:`sys.monitoring`, and ignored on other threads.
+    Older versions have no per-code line events, so a trace function is set on the request's
+    thread, which ignores every call other than to that code object.
+
+    Note that the condition is evaluated as Python code, so, as with an interactive session,
+    a backend that authenticates its payloads should be used.
+    """
+
+    name = "snapshot"
+    report_header = "X-EPDB-Snapshot"
+    file_extension = "json"
+    default_output = "file"
+
+    #: The greatest number of items of a container, or characters of a string, copied
+    max_items = 20
+    max_string = 200
+
+    def __init__(self, options, output_dir):
+        super(SnapshotAction, self).__init__(options, output_dir)
+        location = options.get("location")
+        try:
+            path, line = str(location).rsplit(":", 1)
+            self.line = int(line)
+        except ValueError:
+            raise ValueError("snapshot location must be of the form path:line")
+        self.location = location
+        self.condition = None
+        if options.get("condition"):
+            try:
+                self.condition = compile(options["condition"], "<snapshot condition>", "eval")
+            except SyntaxError as exc:
+                raise ValueError("Invalid snapshot condition: {}".format(exc))
+        self.depth = int(options.get("depth", 2))
+        self.limit = int(options.get("limit", 1))
+        self.frames = int(options.get("frames", 20))
+
+        self.codes = find_code(path, self.line)
+        if not self.codes:
+            raise ValueError("No loaded code at {}".format(location))
+        self.snapshots = []
+        self.errors = 0
+        self.thread_id = None
+        self._tracer = None
+
+    def start(self):
+        """Start watching for the line on the current thread."""
+        self.thread_id = threading.current_thread().ident
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is not None:
+            self._tracer = _MonitoringTracer(monitoring, self)
+        else:
+            self._tracer = _SettraceTracer(self)
+        self._tracer.start()
+
+    def stop(self):
+        """Stop watching for the line."""
+        if self._tracer is not None:
+            self._tracer.stop()
+            self._tracer = None
+
+    def render(self):
+        """Return the snapshots as JSON.
+
+        :rtype: string
+        """
+        return json.dumps(
+            {"location": self.location, "snapshots": self.snapshots, "errors": self.errors},
+            indent=2,
+            sort_keys=True,
+        )
+
+    def capture(self, frame):
+        """Take a snapshot of the frame if the condition holds, returning whether to keep watching.
+
+        :param frame: The frame that reached the line
+        :type frame: frame
+        :rtype: bool
+        """
+        if len(self.snapshots) >= self.limit:
+            return False
+        try:
+            if self.condition is not None and not eval(  # pylint: disable=eval-used
+                self.condition, frame.f_globals, frame.f_locals
+            ):
+                return True
+            self.snapshots.append(
+                {
+                    "time": time.time(),
+                    "locals": dict(
+                        (name, self.copy(value, self.depth))
+                        for name, value in frame.f_locals.items()
+                    ),
+                    "stack": self._stack(frame),
+                }
+            )
+        except Exception:  # pylint: disable=broad-except
+            self.errors += 1
+        return len(self.snapshots) < self.limit
+
+    def copy(self, value, depth):
+        """Return a bounded, JSON-serializable copy of a value.
+
+        :param value: The value to copy
+        :param depth: The number of levels of nested containers to copy
+        :type depth: int
+        """
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, (list, tuple, set, frozenset)) and depth > 0:
+            return [self.copy(item, depth - 1) for item in list(value)[: self.max_items]]
+        if isinstance(value, dict) and depth > 0:
+            return dict(
+                (
+                    self._truncate(_safe_repr(key) if not isinstance(key, str) else key),
+                    self.copy(item, depth - 1),
+                )
+                for key, item in list(value.items())[: self.max_items]
+            )
+        return self._truncate(value if isinstance(value, str) else _safe_repr(value))
+
+    def _truncate(self, text):
+        """Truncate a string to the greatest length copied."""
+        if len(text) <= self.max_string:
+            return text
+        return text[: self.max_string] + "..."
+
+    def _stack(self, frame):
+        """Return the stack, innermost frame first."""
+        stack = []
+        while frame is not None and len(stack) < self.frames:
+            code = frame.f_code
+            stack.append(
+                {"file": code.co_filename, "line": frame.f_lineno, "function": code.co_name}
+            )
+            frame = frame.f_back
+        return stack
+
+
+class _SettraceTracer(object):
+    """Watches for a snapshot's line with a trace function on the current thread."""
+
+    def __init__(self, action):
+        self.action = action
+        self._previous = None
+
+    def start(self):
+        """Set the trace function, keeping any existing one to restore afterwards."""
+        self._previous = sys.gettrace()
+        sys.settrace(self._trace_call)
+
+    def stop(self):
+        """Restore the previous trace function."""
+        sys.settrace(self._previous)
+
+    def _trace_call(self, frame, event, arg):  # pylint: disable=unused-argument
+        """Trace the lines of calls to the target code objects only."""
+        if event == "call" and frame.f_code in self.action.codes:
+            return self._trace_line
+        return None
+
+    def _trace_line(self, frame, event, arg):  # pylint: disable=unused-argument
+        """Capture a snapshot at the target line."""
+        if event == "line" and frame.f_lineno == self.action.line:
+            if not self.action.capture(frame):
+                return None
+        return self._trace_line
+
+
+class _MonitoringTracer(object):
+    """Watches for a snapshot's line with :mod:`sys.monitoring` events on its code objects."""
+
+    #: The tool ids that may be used, avoiding those reserved for debuggers, coverage,
+    #: profilers and optimizers
+    tool_ids = (3, 4)
+
+    def __init__(self, monitoring, action):
+        self.monitoring = monitoring
+        self.action = action
+        for tool_id in self.tool_ids:
+            if monitoring.get_tool(tool_id) is None:
+                self.tool_id = tool_id
+                break
+        else:
+            raise ValueError("No sys.monitoring tool id is free for the snapshot")
+
+    def start(self):
+        """Enable line events on the target code objects."""
+        monitoring = self.monitoring
+        monitoring.use_tool_id(self.tool_id, "falcon-epdb snapshot")
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, self._line)
+        for code in self.action.codes:
+            monitoring.set_local_events(self.tool_id, code, monitoring.events.LINE)
+
+    def stop(self):
+        """Disable the line events, and release the tool id."""
+        monitoring = self.monitoring
+        for code in self.action.codes:
+            monitoring.set_local_events(self.tool_id, code, 0)
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, None)
+        monitoring.free_tool_id(self.tool_id)
+
+    def _line(self, code, line):  # pylint: disable=unused-argument
+        """Capture a snapshot at the target line, on the request's thread."""
+        # Lines are not DISABLEd, as that would persist for later snapshots of other lines
+        if line != self.action.line or threading.current_thread().ident != self.action.thread_id:
+            return None
+        # The frame of the monitored code is the caller of this callback
+        frame = sys._getframe(1)  # pylint: disable=protected-access
+        if not self.action.capture(frame):
+            self.monitoring.set_local_events(self.tool_id, code, 0)
+        return None
+
+
+def find_code(path, line):
+    """Return the loaded code objects whose source includes the line.
+
+    :param path: The path of the source file, or the end of it
+    :param line: The line number
+    :type path: string
+    :type line: int
+    :rtype: set of code objects
+
+    The functions and classes of each module loaded from the file are searched, along with the
+    code objects nested within them, such as inner functions and comprehensions.
+    """
+    suffix = os.sep + os.path.normpath(path).lstrip(os.sep)
+    codes = set()
+    for module in list(sys.modules.values()):
+        filename = getattr(module, "__file__", None)
+        if not filename:
+            continue
+        # Compiled modules are matched by their source
+        filename = os.path.normpath(os.path.abspath(os.path.splitext(filename)[0] + ".py"))
+        if filename != os.path.normpath(path) and not filename.endswith(suffix):
+            continue
+        for code in _module_code(module):
+            if line in set(lineno for _, lineno in dis.findlinestarts(code)):
+                codes.add(code)
+    return codes
+
+
+def _module_code(module):
+    """Return the code objects of the functions and classes defined in a module."""
+    codes = []
+    seen = set()
+    pending = list(vars(module).values())
+    while pending:
+        value = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        if isinstance(value, type) and value.__module__ == module.__name__:
+            pending.extend(vars(value).values())
+        elif isinstance(value, (staticmethod, classmethod)):
+            pending.append(value.__func__)
+        elif isinstance(value, property):
+            pending.extend((value.fget, value.fset, value.fdel))
+        elif isinstance(value, types.FunctionType) and value.__module__ == module.__name__:
+            pending.append(getattr(value, "__wrapped__", None))
+            pending.append(value.__code__)
+        elif isinstance(value, types.CodeType):
+            # Nested code, such as inner functions and comprehensions, is a constant of its parent
+            codes.append(value)
+            pending.extend(value.co_consts)
+    return codes
+
+
+def _safe_repr(value):
+    """Return the repr of a value, or a placeholder if it cannot be represented."""
+    try:
+        return repr(value)
+    except Exception:  # pylint: disable=broad-except
+        return "<unrepresentable {}>".format(type(value).__name__)
+
+
+def format_size(size):
+    """Return a number of bytes in a readable unit.
+
+    :param size: The number of bytes
+    :type size: int
+    :rtype: string
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} GiB".format(size)
+
+
+def collapse_stack(frame):
+    """Return the stack ending at the frame in the collapsed-stack format.
+
+    :param frame: The innermost frame of the stack
+    :type frame: frame
+    :rtype: string
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            "{} ({}:{})".format(code.co_name, code.co_filename, frame.f_lineno).replace(";", ":")
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+#: The actions available by default, keyed by their name in the ``X-EPDB`` payload
+DEFAULT_ACTIONS = {
+    action.name: action for action in (ProfileAction, SampleAction, MemoryAction, SnapshotAction)
+}
@@ -0,0 +1,115 @@
+"""Remote debugging support for Falcon ASGI apps.
+
+This module requires Python 3.5 or later, and is not imported by :mod:`falcon_epdb` itself.
+"""
+
+import asyncio
+
+from falcon_epdb import EPDBServe, _SessionBusy, logger
+from falcon_epdb.attach import is_attached
+
+
+class AsyncEPDBServe(EPDBServe):
+    """A middleware to enable remote debugging of Falcon ASGI apps via an `epdb`_ server.
+
+    :param backend: An instance of the class that will validate and decode the ``X-EPDB`` header
+    :param executor: The executor used to run blocking work, or :obj:`None` for the event loop's
+        default executor
+    :type backend: EPDBBackend
+    :type executor: concurrent.futures.Executor or None
+
+    Any other parameters are as for :class:`EPDBServe`, which this otherwise behaves like.
+
+    Decoding the header (which may involve cryptographic work) and waiting for a client to attach
+    are run in the :obj:`executor`, so that only the task handling the flagged request waits on
+    them; the event loop continues to serve other requests. Once a client is attached, the trace
+    is started on the event loop's thread, as that is where the code being debugged runs. While
+    the debugger is stopped at its prompt, the event loop is paused along with it.
+
+    With a ``sessions`` manager, admission to the debugger is also decided in the executor, so
+    that requests queueing for the session do not block the event loop.
+
+    Similarly, actions run on the event loop's thread, so a profile of a flagged request also
+    includes any other tasks that ran on the loop in the meantime.
+
+    .. _epdb: https://pypi.org/project/epdb/
+    """
+
+    def __init__(self, backend, executor=None, **kwargs):
+        super().__init__(backend, **kwargs)
+        self.executor = executor
+
+    async def process_request_async(self, req, resp):
+        """Check for a well-formed ``X-EPDB`` header and if present activate the `epdb`_ server.
+
+        :param req: The Falcon request object
+        :param resp: The Falcon response object
+
+        This is the coroutine counterpart of :meth:`EPDBServe.process_request`, which Falcon uses
+        in place of the latter when serving an ASGI app.
+        """
+        # pylint: disable=too-many-return-statements,too-many-branches
+        if self.control is not None and not self.control.armed:
+            return
+
+        epdb_header = None
+        if self.backend.header_environ_key is not None:
+            epdb_header = req.get_header("X-EPDB")
+
+        loop = None
+        if epdb_header or self.backend.header_environ_key is None:
+            loop = asyncio.get_event_loop()
+            header_data = await loop.run_in_executor(
+                self.executor, self._get_header_data, req, epdb_header
+            )
+        elif self.rules is not None:
+            header_data = self._match_rules(req)
+        else:
+            return
+        if header_data is None or self._start_action(req, header_data):
+            return
+
+        if self.listener is None and self.sessions is not None:
+            # Queueing for the session must not block the event loop
+            loop = loop or asyncio.get_event_loop()
+            try:
+                admitted = await loop.run_in_executor(self.executor, self._admit, req, resp)
+            except _SessionBusy:
+                self._reject_busy(req, resp)
+            if not admitted:
+                return
+
+        if self.listener is None and not is_attached():
+            loop = loop or asyncio.get_event_loop()
+            serve_options = self._get_serve_options()
+            if serve_options is None:
+                self._release_session(req)
+                return
+            try:
+                attached = await loop.run_in_executor(
+                    self.executor, self._wait_for_client, req, serve_options
+                )
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    "Attempted, but failed, to serve epdb:"
+                    " Unexpected error when starting epdb server"
+                )
+                self._release_session(req)
+                return
+            if not attached:
+                self._release_session(req)
+                return
+
+        self._serve(req, resp)
+
+    async def process_response_async(self, req, resp, resource, req_succeeded):
+        """Finish any action started for the request, returning its report on the response.
+
+        :param req: The Falcon request object
+        :param resp: The Falcon response object
+        :param resource: The resource object that handled the request (unused)
+        :param req_succeeded: Whether the request was handled without error (unused)
+
+        This is the coroutine counterpart of :meth:`EPDBServe.process_response`.
+        """
+        self.process_response(req, resp, resource, req_succeeded)
@@ -0,0 +1,131 @@
+"""Support for accepting `epdb`_ client connections without blocking a request.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+import sys
+from logging import getLogger
+from threading import Lock, Thread
+
+from falcon_epdb.lazy import import_epdb
+
+logger = getLogger(__name__)
+
+
+def is_attached():
+    """Return whether an `epdb`_ client is currently attached to this process.
+
+    :rtype: bool
+    """
+    epdb = sys.modules.get("epdb")
+    if epdb is None:
+        # Nothing can have attached if epdb has not even been imported
+        return False
+    return epdb.Epdb._server is not None  # pylint: disable=protected-access
+
+
+def accept_client(port=None, timeout=None):
+    """Block until an `epdb`_ client attaches, then hand the connection over to `epdb`_.
+
+    :param port: The port to listen on, or :obj:`None` for epdb's default
+    :param timeout: The number of seconds to wait for a client before giving up, or :obj:`None`
+        to wait indefinitely
+    :type port: int or None
+    :type timeout: float or None
+    :returns: Whether a client attached
+    :rtype: bool
+
+    This does the waiting part of :func:`epdb.serve()` without starting the trace, so that it may
+    be run on a thread other than the one to be debugged.
+    """
+    if port is None:
+        port = import_epdb().SERVE_PORT
+    return _accept(_listen(port, timeout), port)
+
+
+def _listen(port, timeout):
+    """Bind a new epdb server to the port."""
+    epdb_server = import_epdb().epdb_server
+    server = epdb_server.InvertedTelnetServer(("", port))
+    server.socket.settimeout(timeout)
+    return server
+
+
+def _accept(server, port):
+    """Wait for a client on a bound server, then hand the connection over to epdb."""
+    server.handle_request()
+    if server.closed:
+        # Timed out, or the connection failed, before a client could be served
+        server.server_close()
+        logger.info("No epdb client attached on port %s; stopped listening", port)
+        return False
+
+    # pylint: disable=protected-access
+    epdb = import_epdb()
+    epdb.Epdb._server = server
+    epdb.Epdb._port = port
+    logger.info("An epdb client attached on port %s", port)
+    return True
+
+
+class BackgroundListener(object):
+    """Listens for an `epdb`_ client connection on a background thread.
+
+    :param timeout: The number of seconds to wait for a client before giving up, or :obj:`None`
+        to wait indefinitely
+    :type timeout: float or None
+
+    Once a client attaches, the connection is handed over to `epdb`_ exactly as though
+    :func:`epdb.serve()` had accepted it, so that the next call to :func:`epdb.serve()` drops
+    straight into the session.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.port = None
+        self._thread = None
+        self._lock = Lock()
+
+    @property
+    def listening(self):
+        """Whether the listener is currently waiting for a client.
+
+        :rtype: bool
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, port=None, on_finish=None):
+        """Start listening, unless already doing so.
+
+        :param port: The port to listen on, or :obj:`None` for epdb's default
+        :param on_finish: Called, on the listening thread, once it stops waiting for a client
+        :type port: int or None
+        :type on_finish: callable or None
+        :returns: Whether a new listener was started
+        :rtype: bool
+
+        The port is bound on the calling thread, so that any failure to do so is raised here.
+        """
+        with self._lock:
+            if self.listening:
+                return False
+
+            if port is None:
+                port = import_epdb().SERVE_PORT
+            server = _listen(port, self.timeout)
+            self.port = port
+            self._thread = Thread(
+                target=self._run, args=(server, port, on_finish), name="falcon-epdb-listener"
+            )
+            self._thread.daemon = True
+            self._thread.start()
+            logger.info("Listening for an epdb client on port %s", port)
+            return True
+
+    @staticmethod
+    def _run(server, port, on_finish):
+        try:
+            _accept(server, port)
+        finally:
+            if on_finish is not None:
+                on_finish()
@@ -0,0 +1,88 @@
+"""Bounded caches used to avoid repeating work for recently seen ``X-EPDB`` headers."""
+
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+def header_digest(epdb_header):
+    """Return a fixed-size digest of a raw header value, suitable for use as a cache key.
+
+    :param epdb_header: The content of the ``X-EPDB`` header
+    :type epdb_header: string
+    :rtype: bytes
+    """
+    return hashlib.sha256(epdb_header.encode()).digest()
+
+
+class HeaderCache(object):
+    """A thread-safe, memory-bounded cache of validated ``X-EPDB`` header payloads.
+
+    :param maxsize: The maximum number of entries to hold before evicting the least recently used
+    :param ttl: The maximum number of seconds an entry may be served from the cache
+    :type maxsize: int
+    :type ttl: float
+
+    Entries are keyed by a digest of the raw header value, so the cache never holds on to the
+    header itself. An entry is dropped once either its own :obj:`ttl` elapses or the token it was
+    decoded from expires, whichever comes first.
+
+    Pass an instance to the ``cache`` parameter of :class:`FernetBackend` or :class:`JWTBackend`
+    to skip the signature verification and decryption of a header that was recently accepted.
+    """
+
+    def __init__(self, maxsize=128, ttl=300.0):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        """Return the number of entries, including any that have expired but not been evicted."""
+        return len(self._entries)
+
+    def get(self, epdb_header):
+        """Return the cached payload for a header value, or :obj:`None` if absent or expired.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :type epdb_header: string
+        :rtype: dictionary or None
+        """
+        key = header_digest(epdb_header)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.time():
+                return None
+            # Re-insert to mark this as the most recently used entry
+            self._entries[key] = entry
+            return value
+
+    def set(self, epdb_header, value, expires=None):
+        """Cache the validated payload for a header value.
+
+        :param epdb_header: The content of the ``X-EPDB`` header
+        :param value: The validated payload
+        :param expires: The (epoch) time at which the token itself expires, if it does
+        :type epdb_header: string
+        :type value: dictionary
+        :type expires: float or None
+        """
+        key = header_digest(epdb_header)
+        expires_by_ttl = time.time() + self.ttl
+        expires = expires_by_ttl if expires is None else min(expires, expires_by_ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
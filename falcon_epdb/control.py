@@ -0,0 +1,163 @@
+"""An out-of-band switch arming the middleware in every worker process on a host.
+
+While disarmed, :class:`EPDBServe` returns from each request after checking a single flag, without
+looking for the ``X-EPDB`` header. An operator arms it by writing an arm command to a state file
+shared by the workers, typically with the ``falcon-epdb`` console script::
+
+    $ falcon-epdb arm --ttl 600 --token "Fernet gAAAAA..."
+    $ falcon-epdb disarm
+
+The token is formatted as for the ``X-EPDB`` header, and each worker authenticates it with its
+own backend before arming itself.
+"""
+
+import errno
+import json
+import os
+import tempfile
+import time
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+logger = getLogger(__name__)
+
+
+class ArmSwitch(object):  # pylint: disable=too-many-instance-attributes
+    """Arms and disarms :class:`EPDBServe` from outside the app, with a time limit.
+
+    :param path: The state file shared by the worker processes
+    :param poll_interval: The number of seconds between checks of the state file
+    :type path: string
+    :type poll_interval: float
+
+    Pass an instance to the ``control`` parameter of :class:`EPDBServe`. Each process checks the
+    state file on a background thread, and arms itself while the file holds a command whose token
+    its backend accepts and whose time limit has not passed. Tokens which expire (see the
+    ``FernetBackend`` ``ttl`` and the JWT ``exp`` claim) also limit the arming, and stop an old
+    command from being replayed.
+
+    The background thread is started by the middleware, and restarted in child processes of a
+    pre-fork server on Python 3.7+.
+    """
+
+    def __init__(self, path=None, poll_interval=1.0):
+        self.path = path or os.path.join(tempfile.gettempdir(), "falcon-epdb-control.json")
+        self.poll_interval = poll_interval
+
+        #: Whether debugging is armed in this process
+        self.armed = False
+
+        #: The time, as seconds since the epoch, at which the current arming ends
+        self.armed_until = None
+
+        self.backend = None
+        self._loaded = None
+        self._lock = Lock()
+        self._stopped = Event()
+
+    def arm(self, token, ttl):
+        """Write an arm command for every process sharing the state file.
+
+        :param token: A value in the format of an ``X-EPDB`` header, accepted by the backend
+        :param ttl: The number of seconds for which to arm debugging
+        :type token: string
+        :type ttl: float
+        """
+        directory = os.path.dirname(self.path) or "."
+        command = {"token": token, "until": time.time() + ttl}
+        # Write-then-rename, so that readers never see a partial command
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as command_file:
+            json.dump(command, command_file)
+        os.rename(temp_path, self.path)
+
+    def disarm(self):
+        """Remove the arm command, disarming every process sharing the state file."""
+        try:
+            os.remove(self.path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def start(self, backend):
+        """Start checking the state file on a background thread.
+
+        :param backend: The backend with which to authenticate arm commands
+        :type backend: EPDBBackend
+        """
+        self.backend = backend
+        self.refresh()
+        self._start_thread()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stopped.set()
+
+    def refresh(self):
+        """Read the state file, arming or disarming this process accordingly."""
+        with self._lock:
+            until = self._read_until()
+            armed = until is not None and until > time.time()
+            if armed and not self.armed:
+                logger.info("epdb armed until %s", time.ctime(until))
+            elif self.armed and not armed:
+                logger.info("epdb disarmed")
+            self.armed_until = until if armed else None
+            self.armed = armed
+
+    def _read_until(self):
+        """Return the time at which the current arm command ends, or None if there is none.
+
+        The command is only authenticated again when the state file changes.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._loaded = None
+            return None
+
+        stamp = (stat.st_mtime, stat.st_ino, stat.st_size)
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == stamp:
+            return loaded[1]
+
+        until = self._authenticate()
+        self._loaded = (stamp, until)
+        return until
+
+    def _authenticate(self):
+        """Read and authenticate the arm command, returning when it ends, or None if invalid."""
+        try:
+            with open(self.path) as command_file:
+                command = json.load(command_file)
+            token = command["token"]
+            until = float(command["until"])
+            header_content = self.backend.decode_header_value(token)
+            self.backend.validate_header_content(header_content)
+            expiry = self.backend.get_header_expiry(token, header_content)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Ignoring an invalid epdb arm command in %s", self.path)
+            return None
+        return until if expiry is None else min(until, expiry)
+
+    def _after_fork(self):
+        """Replace the lock, which another thread may have held at the fork, and restart."""
+        self._lock = Lock()
+        self._start_thread()
+
+    def _start_thread(self):
+        """Start the thread which polls the state file."""
+        self._stopped.clear()
+        thread = Thread(target=self._run, name="falcon-epdb-control")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        """Poll the state file until stopped."""
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to check the epdb arm command")
@@ -0,0 +1,218 @@
+"""Public key sets, in the JSON Web Key Set format, for verifying asymmetrically signed tokens.
+
+Each key is parsed once, when the set is loaded, and indexed by its ``kid``, so that verifying a
+token costs a dictionary lookup and a signature check. A set loaded from a file is reloaded on a
+background thread when the file changes; request threads keep using the previous keys until the
+new ones are ready, and never wait for a reload.
+
+.. note:: Parsing the keys requires the :mod:`cryptography` package, and verifying ``EdDSA``
+    signatures requires PyJWT 2.0 or later.
+"""
+
+import base64
+import json
+import os
+from logging import getLogger
+from threading import Event, Thread
+
+from falcon_epdb.lazy import import_optional
+
+logger = getLogger(__name__)
+
+#: The signature algorithms that may be used with each type of key. Symmetric algorithms, and
+#: ``none``, are never accepted.
+KEY_ALGORITHMS = {
+    "RSA": ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512"),
+    "P-256": ("ES256",),
+    "P-384": ("ES384",),
+    "P-521": ("ES512",),
+    "Ed25519": ("EdDSA",),
+}
+
+
+class KeySet(object):
+    """Public keys indexed by their ``kid``, loaded from a JWKS document or file.
+
+    :param keyset: A JWKS document, as a dictionary with a ``keys`` list, or the path of a file
+        containing one
+    :param reload_interval: The number of seconds between checks of the file for changes
+    :type keyset: dictionary or string
+    :type reload_interval: float
+    :raises: ValueError if the initial set contains no usable keys
+
+    Keys which cannot be parsed, or are not public signing keys, are skipped with a warning. If a
+    reloaded file cannot be read at all, the previous keys are kept, but if it is read and has no
+    usable keys, every token is rejected until it does. Callbacks added with
+    :meth:`add_listener` are called once new keys are in use.
+    """
+
+    def __init__(self, keyset, reload_interval=10.0):
+        import_optional("cryptography", "jwt,fernet")
+        self.path = keyset if not isinstance(keyset, dict) else None
+        self.reload_interval = reload_interval
+        self._stamp = None
+        self._stopped = Event()
+        self._listeners = []
+
+        #: The parsed keys, as ``(key, algorithms)``, by ``kid``. Replaced, never mutated.
+        self.keys = {}
+
+        if self.path is None:
+            self.keys = parse_keyset(keyset)
+        else:
+            self.refresh()
+        if not self.keys:
+            raise ValueError("The key set contains no usable keys")
+
+        if self.path is not None:
+            self._start_thread()
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._start_thread)
+
+    def __len__(self):
+        """Return the number of usable keys."""
+        return len(self.keys)
+
+    def get(self, kid):
+        """Return the key with the ``kid``, and the algorithms it may be used with.
+
+        :param kid: The ``kid`` from a token's header, or :obj:`None` if it had none
+        :type kid: string or None
+        :returns: The key and its algorithms, or :obj:`None` if there is no such key. A token
+            without a ``kid`` may only be verified by a set of one key.
+        :rtype: tuple or None
+        """
+        keys = self.keys
+        if kid is None:
+            if len(keys) == 1:
+                return next(iter(keys.values()))
+            return None
+        return keys.get(kid)
+
+    def add_listener(self, callback):
+        """Call the callback, without arguments, whenever the keys are reloaded.
+
+        :param callback: A function to call from the thread that reloaded the keys
+        :type callback: callable
+        """
+        self._listeners.append(callback)
+
+    def refresh(self):
+        """Reload the file, if it has changed since it was last loaded."""
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime, stat.st_ino, stat.st_size)
+            if stamp == self._stamp:
+                return
+            with open(self.path) as keyset_file:
+                keys = parse_keyset(json.load(keyset_file))
+        except (OSError, IOError, ValueError):
+            logger.exception("Failed to load the key set from %s", self.path)
+            return
+        self._stamp = stamp
+        self.keys = keys
+        if keys:
+            logger.info("Loaded %d keys from %s", len(keys), self.path)
+        else:
+            logger.warning("The key set in %s has no usable keys; rejecting every token", self.path)
+        for callback in self._listeners:
+            callback()
+
+    def stop(self):
+        """Stop checking the file for changes."""
+        self._stopped.set()
+
+    def _start_thread(self):
+        """Start the thread which reloads the file."""
+        self._stopped.clear()
+        thread = Thread(target=self._run, name="falcon-epdb-keyset")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        """Reload the file when it changes, until stopped."""
+        while not self._stopped.wait(self.reload_interval):
+            self.refresh()
+
+
+def parse_keyset(keyset):
+    """Parse the usable public keys of a JWKS document.
+
+    :param keyset: A JWKS document, with a ``keys`` list
+    :type keyset: dictionary
+    :returns: The parsed keys, as ``(key, algorithms)``, by ``kid``
+    :rtype: dictionary
+    :raises: ValueError if the document is malformed
+    """
+    if not isinstance(keyset, dict) or not isinstance(keyset.get("keys"), list):
+        raise ValueError("A key set must be a dictionary with a list of keys")
+
+    keys = {}
+    for number, jwk in enumerate(keyset["keys"]):
+        kid = jwk.get("kid") if isinstance(jwk, dict) else None
+        try:
+            keys[kid] = parse_jwk(jwk)
+        except (KeyError, TypeError, ValueError) as exc:
+            logger.warning("Skipping key %s of the key set: %s", kid or number, exc)
+    if None in keys and len(keys) > 1:
+        logger.warning("Skipping a key without a kid, as the key set has several keys")
+        del keys[None]
+    return keys
+
+
+def parse_jwk(jwk):
+    """Parse a public key in the JSON Web Key format.
+
+    :param jwk: The key
+    :type jwk: dictionary
+    :returns: The :mod:`cryptography` public key, and the algorithms it may be used with
+    :rtype: tuple
+    :raises: ValueError if the key is not a supported public signing key
+    """
+    if jwk.get("use", "sig") != "sig":
+        raise ValueError("not a signing key")
+    if "d" in jwk:
+        raise ValueError("private keys must not be distributed")
+
+    kty = jwk["kty"]
+    # pylint: disable=import-outside-toplevel
+    if kty == "RSA":
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        numbers = rsa.RSAPublicNumbers(_decode_int(jwk["e"]), _decode_int(jwk["n"]))
+        key, algorithms = numbers.public_key(default_backend()), KEY_ALGORITHMS["RSA"]
+    elif kty == "EC":
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.asymmetric import ec
+
+        curves = {"P-256": ec.SECP256R1, "P-384": ec.SECP384R1, "P-521": ec.SECP521R1}
+        if jwk["crv"] not in curves:
+            raise ValueError("unsupported curve {}".format(jwk["crv"]))
+        numbers = ec.EllipticCurvePublicNumbers(
+            _decode_int(jwk["x"]), _decode_int(jwk["y"]), curves[jwk["crv"]]()
+        )
+        key, algorithms = numbers.public_key(default_backend()), KEY_ALGORITHMS[jwk["crv"]]
+    elif kty == "OKP" and jwk.get("crv") == "Ed25519":
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+
+        key = ed25519.Ed25519PublicKey.from_public_bytes(_decode_bytes(jwk["x"]))
+        algorithms = KEY_ALGORITHMS["Ed25519"]
+    else:
+        raise ValueError("unsupported key type {}".format(kty))
+
+    if "alg" in jwk:
+        if jwk["alg"] not in algorithms:
+            raise ValueError("algorithm {} does not suit the key".format(jwk["alg"]))
+        algorithms = (jwk["alg"],)
+    return key, algorithms
+
+
+def _decode_bytes(value):
+    """Decode an unpadded base64url value."""
+    return base64.urlsafe_b64decode(str(value) + "=" * (-len(value) % 4))
+
+
+def _decode_int(value):
+    """Decode an unpadded base64url big-endian integer."""
+    return int(base64.b16encode(_decode_bytes(value)), 16)
@@ -0,0 +1,31 @@
+"""Deferred imports of the heavier and optional dependencies.
+
+Importing :mod:`falcon_epdb` should cost an app next to nothing at startup, so these modules are
+only imported once a backend is constructed or a debugging session actually starts.
+"""
+
+import importlib
+
+
+def import_epdb():
+    """Import and return the :mod:`epdb` module.
+
+    :rtype: module
+    """
+    return importlib.import_module("epdb")
+
+
+def import_optional(name, extra):
+    """Import and return a module provided by one of this package's extras.
+
+    :param name: The name of the module
+    :param extra: The name of the extra that provides it
+    :type name: string
+    :type extra: string
+    :rtype: module
+    :raises: ImportError
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        raise ImportError("Missing optional [{}] dependency".format(extra))
@@ -0,0 +1,414 @@
+"""In-process metrics for the middleware, and a resource exposing them to Prometheus.
+
+The metrics recorded by :class:`EPDBServe` when given a :class:`Metrics` instance are:
+
+``falcon_epdb_headers_total``
+    The number of ``X-EPDB`` headers received
+``falcon_epdb_header_failures_total{reason}``
+    The number of headers that were not served, by ``reason``: ``exempt``, ``throttled``,
+    ``rejected`` (by the backend), ``error``, ``no_port`` or ``busy`` (another request held the
+    session)
+``falcon_epdb_decode_seconds{backend}``
+    A histogram of the time each backend spent decoding and validating headers
+``falcon_epdb_blocked_seconds{stage}``
+    A histogram of the time requests were blocked, either waiting for a client to attach
+    (``wait``) or in :func:`epdb.serve()` (``serve``)
+``falcon_epdb_session_events_total{event}``
+    The number of ``serve`` calls, of times the middleware started listening for a client in the
+    background (``arm``), of requests matching a trigger rule (``rule``), and of clients that
+    were found to have attached (``attach``) or detached (``detach``), or that did not attach in
+    time (``wait_timeout``)
+"""
+
+import atexit
+import errno
+import json
+import os
+import tempfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Event, Lock, Thread
+
+from falcon_epdb.actions import set_text_body
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+logger = getLogger(__name__)
+
+#: The upper bounds of the buckets of the ``falcon_epdb_decode_seconds`` histogram
+DECODE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+#: The upper bounds of the buckets of the ``falcon_epdb_blocked_seconds`` histogram
+BLOCKED_BUCKETS = (0.01, 0.1, 1.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+#: The type, help text and, for histograms, bucket bounds of each metric, keyed by name
+DEFINITIONS = {
+    "falcon_epdb_headers_total": ("counter", "X-EPDB headers received.", None),
+    "falcon_epdb_header_failures_total": (
+        "counter",
+        "X-EPDB headers that were not served, by reason.",
+        None,
+    ),
+    "falcon_epdb_decode_seconds": (
+        "histogram",
+        "Time spent by the backend decoding and validating X-EPDB headers.",
+        DECODE_BUCKETS,
+    ),
+    "falcon_epdb_blocked_seconds": (
+        "histogram",
+        "Time requests were blocked waiting for an epdb client, or in epdb.serve.",
+        BLOCKED_BUCKETS,
+    ),
+    "falcon_epdb_session_events_total": ("counter", "epdb session events, by event.", None),
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# The files, in the shared path, holding the totals of the processes that have exited, and
+# serializing the updates to them
+_AGGREGATE_FILENAME = "aggregate.json"
+_AGGREGATE_LOCK_FILENAME = ".aggregate.lock"
+
+
+class Metrics(object):
+    """Counters and fixed-bucket histograms describing the middleware's work.
+
+    :param path: A directory shared by the worker processes of a pre-fork server, in which each
+        process saves its metrics so that they can be aggregated, or :obj:`None` to only report
+        the metrics of the current process
+    :param flush_interval: The number of seconds between saves to :obj:`path`
+    :type path: string or None
+    :type flush_interval: float
+
+    Pass an instance to the ``metrics`` parameter of :class:`EPDBServe`, and expose it with a
+    :class:`MetricsResource`. Recording a value takes a single lock for a dictionary update.
+
+    With a :obj:`path`, each process saves its own metrics to a file named after its pid, from a
+    background thread every :obj:`flush_interval` and on exit, so that requests never wait on the
+    file. :meth:`render` sums the files of the processes that are still running. The counters
+    and histograms of processes that have exited are folded into a file of their totals, and
+    their own files removed, so that the totals never go down.
+    """
+
+    def __init__(self, path=None, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._counters = {}
+        self._histograms = {}
+        self._lock = Lock()
+        self._attached = False
+        self._stopped = Event()
+        if path is not None:
+            atexit.register(self.flush)
+            self._start_thread()
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=self._after_fork)
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter.
+
+        :param name: The name of the counter
+        :param amount: The amount to add
+        :param labels: The counter's labels
+        :type name: string
+        :type amount: int
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram.
+
+        :param name: The name of the histogram
+        :param value: The value to record
+        :param labels: The histogram's labels
+        :type name: string
+        :type value: float
+        """
+        buckets = DEFINITIONS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+            histogram[0][bisect_left(buckets, value)] += 1
+            histogram[1] += value
+
+    def observe_since(self, name, started, **labels):
+        """Record the time elapsed since :obj:`started` in a histogram.
+
+        :param name: The name of the histogram
+        :param started: A value previously returned by :func:`time.monotonic`
+        :param labels: The histogram's labels
+        :type name: string
+        :type started: float
+        """
+        self.observe(name, monotonic() - started, **labels)
+
+    def record_attachment(self, attached):
+        """Count an ``attach`` or ``detach`` event if the client's presence has changed.
+
+        :param attached: Whether a client is attached now
+        :type attached: bool
+        """
+        with self._lock:
+            changed = attached != self._attached
+            self._attached = attached
+        if changed:
+            self.inc("falcon_epdb_session_events_total", event="attach" if attached else "detach")
+
+    def snapshot(self):
+        """Return this process's metrics in a JSON-serializable form.
+
+        :rtype: dictionary
+        """
+        with self._lock:
+            return {
+                "counters": [
+                    [name, list(labels), value] for (name, labels), value in self._counters.items()
+                ],
+                "histograms": [
+                    [name, list(labels), list(counts), total]
+                    for (name, labels), (counts, total) in self._histograms.items()
+                ],
+            }
+
+    def collect(self):
+        """Return the snapshots of every process sharing the :obj:`path`, or this one's.
+
+        The snapshots of processes that have exited are first folded into a single snapshot of
+        their totals, which is returned along with those of the running processes.
+
+        :rtype: list of dictionaries
+        """
+        if self.path is None:
+            return [self.snapshot()]
+
+        self.flush()
+        running = []
+        exited = []
+        for filename in os.listdir(self.path):
+            name, extension = os.path.splitext(filename)
+            if extension != ".json" or filename == _AGGREGATE_FILENAME:
+                continue
+            snapshot_path = os.path.join(self.path, filename)
+            if name.isdigit() and not _is_running(int(name)):
+                exited.append(snapshot_path)
+            else:
+                running.append(snapshot_path)
+        if exited:
+            self._fold(exited)
+        running.append(os.path.join(self.path, _AGGREGATE_FILENAME))
+        return [snapshot for snapshot in map(_load, running) if snapshot is not None]
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format.
+
+        :rtype: string
+        """
+        counters, histograms = _merge(self.collect())
+        lines = []
+        for name in sorted(DEFINITIONS):
+            metric_type, help_text, buckets = DEFINITIONS[name]
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            if metric_type == "counter":
+                for labels, value in sorted(counters.get(name, {}).items()):
+                    lines.append(_sample(name, labels, value))
+                continue
+            for labels, (counts, total) in sorted(histograms.get(name, {}).items()):
+                lines.extend(_histogram_samples(name, buckets, labels, counts, total))
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Save this process's metrics to the shared :obj:`path`, if there is one."""
+        if self.path is None:
+            return
+        try:
+            os.makedirs(self.path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        _save(self.snapshot(), os.path.join(self.path, "{}.json".format(os.getpid())))
+
+    def stop(self):
+        """Stop saving the metrics in the background."""
+        self._stopped.set()
+
+    def _fold(self, exited):
+        """Add the snapshots of processes that have exited to the totals, and remove them."""
+        aggregate_path = os.path.join(self.path, _AGGREGATE_FILENAME)
+        with _locked(os.path.join(self.path, _AGGREGATE_LOCK_FILENAME)):
+            # Another process may have folded some of them since they were listed
+            snapshots = [snapshot for snapshot in map(_load, exited) if snapshot is not None]
+            if snapshots:
+                aggregate = _load(aggregate_path)
+                if aggregate is not None:
+                    snapshots.append(aggregate)
+                counters, histograms = _merge(snapshots)
+                _save(
+                    {
+                        "counters": [
+                            [name, labels, value]
+                            for name, by_labels in counters.items()
+                            for labels, value in by_labels.items()
+                        ],
+                        "histograms": [
+                            [name, labels, counts, total]
+                            for name, by_labels in histograms.items()
+                            for labels, (counts, total) in by_labels.items()
+                        ],
+                    },
+                    aggregate_path,
+                )
+            for snapshot_path in exited:
+                _remove(snapshot_path)
+
+    def _after_fork(self):
+        """Replace the lock, which another thread may have held at the fork, and restart."""
+        self._lock = Lock()
+        self._start_thread()
+
+    def _start_thread(self):
+        """Start the thread which saves the metrics."""
+        self._stopped.clear()
+        thread = Thread(target=self._run, name="falcon-epdb-metrics")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        """Save the metrics every flush interval, until stopped."""
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (IOError, OSError):
+                logger.exception("Failed to save the metrics to %s", self.path)
+
+
+class MetricsResource(object):  # pylint: disable=too-few-public-methods
+    """A Falcon resource rendering :class:`Metrics` for Prometheus to scrape.
+
+    :param metrics: The metrics to render
+    :type metrics: Metrics
+
+    Route it wherever your scraper expects to find it::
+
+        app.add_route("/metrics", MetricsResource(metrics))
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def on_get(self, req, resp):  # pylint: disable=unused-argument
+        """Respond with the metrics in the Prometheus text exposition format."""
+        set_text_body(resp, self.metrics.render())
+        resp.content_type = CONTENT_TYPE
+
+
+def _is_running(pid):
+    """Return whether a process with the pid exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno != errno.ESRCH
+    return True
+
+
+@contextmanager
+def _locked(path):
+    """Hold an exclusive lock on the file at the path, where file locks are supported."""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _load(path):
+    """Return the snapshot saved at the path, or None if it is missing or unreadable."""
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (IOError, OSError, ValueError):
+        # Removed, or written by something else, since it was listed
+        return None
+
+
+def _save(snapshot, path):
+    """Save a snapshot to the path."""
+    # Write-then-rename, so that readers never see a partial snapshot
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    with os.fdopen(fd, "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.rename(temp_path, path)
+
+
+def _remove(path):
+    """Remove a file, if it still exists."""
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
+
+
+def _merge(snapshots):
+    """Sum the snapshots, returning the counters and histograms keyed by name, then labels."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            by_labels = counters.setdefault(name, {})
+            labels = tuple(tuple(label) for label in labels)
+            by_labels[labels] = by_labels.get(labels, 0) + value
+        for name, labels, counts, total in snapshot["histograms"]:
+            by_labels = histograms.setdefault(name, {})
+            labels = tuple(tuple(label) for label in labels)
+            merged = by_labels.get(labels)
+            if merged is None:
+                by_labels[labels] = (list(counts), total)
+            else:
+                by_labels[labels] = ([a + b for a, b in zip(merged[0], counts)], merged[1] + total)
+    return counters, histograms
+
+
+def _histogram_samples(name, buckets, labels, counts, total):
+    """Return the lines of the exposition format for one histogram."""
+    cumulative = 0
+    for bound, count in zip(buckets + ("+Inf",), counts):
+        cumulative += count
+        yield _sample(name + "_bucket", labels + (("le", _format_value(bound)),), cumulative)
+    yield _sample(name + "_sum", labels, total)
+    yield _sample(name + "_count", labels, cumulative)
+
+
+def _sample(name, labels, value):
+    """Return a line of the exposition format."""
+    if not labels:
+        return "{} {}".format(name, _format_value(value))
+    return "{}{{{}}} {}".format(
+        name,
+        ",".join('{}="{}"'.format(key, _escape(label)) for key, label in labels),
+        _format_value(value),
+    )
+
+
+def _format_value(value):
+    """Return a number as it should appear in the exposition format."""
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(label):
+    """Escape a label value for the exposition format."""
+    return str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
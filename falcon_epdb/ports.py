@@ -0,0 +1,93 @@
+"""Allocation of `epdb`_ ports to the worker processes of a pre-fork server.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+import atexit
+import fcntl
+import os
+import tempfile
+from logging import getLogger
+from threading import Lock
+
+logger = getLogger(__name__)
+
+
+class PortPool(object):
+    """A set of ports from which each worker process claims one for its own use.
+
+    :param ports: The candidate ports
+    :param lock_dir: The directory in which to keep the per-port lock files
+    :type ports: iterable of ints
+    :type lock_dir: string
+
+    A port is claimed by taking an exclusive :func:`fcntl.flock` on a lock file named after it.
+    The operating system arbitrates between processes racing for the same port, and releases the
+    lock when the owning process exits, however it exits. Claims are made lazily, so a pool
+    created before a server forks its workers is safe to share between them; each worker claims
+    its own port the first time it needs one.
+    """
+
+    def __init__(self, ports, lock_dir=None):
+        self.ports = tuple(ports)
+        self.lock_dir = lock_dir or tempfile.gettempdir()
+        self._port = None
+        self._lock_file = None
+        self._pid = None
+        self._lock = Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def port(self):
+        """The port claimed by this process, if any.
+
+        :rtype: int or None
+        """
+        return self._port if self._pid == os.getpid() else None
+
+    def claim(self):
+        """Return the port claimed by this process, claiming one first if necessary.
+
+        :returns: The claimed port, or :obj:`None` if every port is held by another process
+        :rtype: int or None
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return self._port
+
+            if self._lock_file is not None:
+                # Inherited from our parent process. Closing our copy leaves its lock intact.
+                self._lock_file.close()
+                self._lock_file = self._port = self._pid = None
+
+            for port in self.ports:
+                lock_file = open(self._lock_path(port), "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    lock_file.close()
+                    continue
+
+                self._lock_file, self._port, self._pid = lock_file, port, os.getpid()
+                atexit.register(self.release)
+                logger.debug("Claimed port %s for process %s", port, self._pid)
+                return port
+
+            return None
+
+    def release(self):
+        """Release the port claimed by this process, if any."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = self._port = self._pid = None
+
+    def _after_fork(self):
+        """Replace the lock, which another thread may have held at the fork."""
+        self._lock = Lock()
+
+    def _lock_path(self, port):
+        return os.path.join(self.lock_dir, "falcon-epdb-{}.lock".format(port))
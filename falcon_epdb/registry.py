@@ -0,0 +1,187 @@
+"""A host-local registry of worker processes waiting for an `epdb`_ client, and a client for it.
+
+Each waiting session is recorded as a small JSON file in a shared directory. The
+``falcon-epdb`` console script lists those sessions and connects to one of them::
+
+    $ falcon-epdb list
+    $ falcon-epdb attach --pid 4242
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from logging import getLogger
+
+from falcon_epdb.control import ArmSwitch
+from falcon_epdb.lazy import import_epdb
+
+logger = getLogger(__name__)
+
+
+def _pid_alive(pid):
+    """Return whether a process with the given pid exists."""
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class SessionRegistry(object):
+    """Records which worker processes are waiting for an `epdb`_ client, and on which port.
+
+    :param path: The directory holding the registry entries
+    :type path: string
+
+    Pass an instance to the ``registry`` parameter of :class:`EPDBServe`. An entry is written
+    when a worker starts waiting for a client, and removed once a client attaches or the worker
+    stops waiting. Entries left behind by workers that died while waiting are removed the next
+    time the registry is read.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), "falcon-epdb")
+
+    def register(self, port, request=None):
+        """Record that this process is waiting for a client on the given port.
+
+        :param port: The port being listened on
+        :param request: A short description of the request that started the session
+        :type port: int
+        :type request: string or None
+        """
+        try:
+            os.makedirs(self.path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        entry = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "port": port,
+            "request": request,
+            "started": time.time(),
+        }
+        # Write-then-rename, so that readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as entry_file:
+            json.dump(entry, entry_file)
+        os.rename(temp_path, self._entry_path(os.getpid(), port))
+
+    def unregister(self, port):
+        """Remove this process's entry for the given port, if present.
+
+        :param port: The port that was being listened on
+        :type port: int
+        """
+        self._remove(self._entry_path(os.getpid(), port))
+
+    def sessions(self):
+        """Return the waiting sessions, oldest first, removing any whose process has died.
+
+        :rtype: list of dictionaries
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+
+        sessions = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            entry_path = os.path.join(self.path, name)
+            try:
+                with open(entry_path) as entry_file:
+                    entry = json.load(entry_file)
+            except (IOError, OSError, ValueError):
+                continue
+            if _pid_alive(entry["pid"]):
+                sessions.append(entry)
+            else:
+                logger.debug("Removing stale entry for process %s", entry["pid"])
+                self._remove(entry_path)
+        return sorted(sessions, key=lambda entry: entry["started"])
+
+    def _entry_path(self, pid, port):
+        return os.path.join(self.path, "{}-{}.json".format(pid, port))
+
+    @staticmethod
+    def _remove(entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+def _print_sessions(sessions):
+    print("{:>8} {:>6} {:>8}  {}".format("PID", "PORT", "WAITING", "REQUEST"))
+    now = time.time()
+    for entry in sessions:
+        print(
+            "{pid:>8} {port:>6} {waiting:>7.0f}s  {request}".format(
+                waiting=now - entry["started"], **entry
+            )
+        )
+
+
+def main(argv=None):
+    """List the waiting sessions on this host or connect to one of them, or arm or disarm epdb."""
+    parser = argparse.ArgumentParser(prog="falcon-epdb", description=main.__doc__)
+    parser.add_argument("--registry", help="the registry directory")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("list", help="list the waiting sessions")
+    attach = commands.add_parser("attach", help="connect to a waiting session")
+    attach.add_argument("--pid", type=int, help="the pid of the worker to connect to")
+    attach.add_argument("--port", type=int, help="the port of the session to connect to")
+    attach.add_argument("--host", default="localhost", help="the host to connect to")
+    arm = commands.add_parser("arm", help="arm epdb in every worker on this host")
+    arm.add_argument("--token", required=True, help="a value accepted as an X-EPDB header")
+    arm.add_argument("--ttl", type=float, default=600, help="the number of seconds to arm for")
+    arm.add_argument("--control", help="the control state file")
+    disarm = commands.add_parser("disarm", help="disarm epdb in every worker on this host")
+    disarm.add_argument("--control", help="the control state file")
+    args = parser.parse_args(argv)
+
+    if args.command == "arm":
+        ArmSwitch(args.control).arm(args.token, args.ttl)
+        return 0
+    if args.command == "disarm":
+        ArmSwitch(args.control).disarm()
+        return 0
+
+    sessions = SessionRegistry(args.registry).sessions()
+    if args.command != "attach":
+        _print_sessions(sessions)
+        return 0
+
+    candidates = [
+        entry
+        for entry in sessions
+        if args.pid in (None, entry["pid"]) and args.port in (None, entry["port"])
+    ]
+    if len(candidates) != 1:
+        print(
+            "{} matching sessions; choose one with --pid or --port".format(len(candidates)),
+            file=sys.stderr,
+        )
+        _print_sessions(candidates)
+        return 1
+
+    import_epdb().connect(host=args.host, port=candidates[0]["port"])
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
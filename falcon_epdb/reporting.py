@@ -0,0 +1,116 @@
+"""Aggregated reporting of rejected ``X-EPDB`` headers."""
+
+import atexit
+import os
+from collections import Counter
+from logging import getLogger
+from threading import Lock, Timer, current_thread
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+
+logger = getLogger(__name__)
+
+
+class FailureReporter(object):
+    """Counts rejected ``X-EPDB`` headers by reason and periodically logs a summary.
+
+    :param interval: The minimum number of seconds between summary lines
+    :type interval: float
+
+    Pass an instance to the ``failure_reporter`` parameter of :class:`EPDBServe`. Instead of
+    logging a traceback for every rejected header, the middleware records the reason here, and a
+    single ``WARNING`` line is logged with the counts per reason and a sample of the most recent
+    request. Errors that are not the result of a bad header are still logged in full.
+
+    The first failure is reported immediately. Failures within the following :obj:`interval` are
+    counted, and reported once the interval elapses, by a timer started for the purpose, or when
+    :meth:`flush` is called. Any failures still counted when the process exits are flushed then.
+    """
+
+    def __init__(self, interval=60.0):
+        self.interval = interval
+        self._counts = Counter()
+        self._sample = None
+        self._window_start = None
+        self._timer = None
+        self._lock = Lock()
+        atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._forget)
+
+    def record(self, reason, sample=None):
+        """Count a rejected header, logging a summary if the interval has elapsed.
+
+        :param reason: Why the header was rejected
+        :param sample: A short description of the offending request
+        :type reason: string
+        :type sample: string or None
+        """
+        now = monotonic()
+        with self._lock:
+            self._counts[reason] += 1
+            self._sample = sample
+            if self._window_start is not None and now - self._window_start < self.interval:
+                if self._timer is None:
+                    self._timer = Timer(
+                        self._window_start + self.interval - now, self._flush_window
+                    )
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            summary = self._take_summary(now)
+        self._emit(summary)
+
+    def flush(self):
+        """Log a summary of any failures counted since the last one."""
+        with self._lock:
+            summary = self._take_summary(monotonic())
+        self._emit(summary)
+
+    def _flush_window(self):
+        """Log a summary of the failures counted in the window that the timer was started for."""
+        with self._lock:
+            if self._timer is not current_thread():
+                return  # The window was already reported
+            summary = self._take_summary(monotonic())
+        self._emit(summary)
+
+    def _forget(self):
+        """Drop the failures inherited by a forked process, which its parent reports."""
+        # Another thread may have held the lock when the process forked
+        self._lock = Lock()
+        self._counts = Counter()
+        self._sample = None
+        self._timer = None
+
+    def _take_summary(self, now):
+        """Reset the counters, returning their previous values. Must be called with the lock."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        summary = (
+            now - self._window_start if self._window_start is not None else 0.0,
+            self._counts,
+            self._sample,
+        )
+        self._counts = Counter()
+        self._sample = None
+        self._window_start = now
+        return summary
+
+    @staticmethod
+    def _emit(summary):
+        elapsed, counts, sample = summary
+        if not counts:
+            return
+        logger.warning(
+            "Rejected %d X-EPDB header(s) in the last %.0fs: %s; most recent: %s",
+            sum(counts.values()),
+            elapsed,
+            ", ".join("{} (x{})".format(*item) for item in counts.most_common()),
+            sample,
+        )
@@ -0,0 +1,231 @@
+"""Armed rules which trigger `epdb`_ on requests that cannot carry an ``X-EPDB`` header.
+
+A rule names an HTTP method and a route template, in Falcon's ``/orders/{id}`` syntax, and
+optionally the values that fields of the route or query parameters must have::
+
+    rules = TriggerRules()
+    rules.arm("POST", "/orders/{id}", params={"status": "failed"}, count=1)
+
+The rules are compiled into an index of static paths, and a single regular expression per method
+for the templated ones, so that checking a request costs a dictionary lookup and at most one
+match however many rules are armed. While no rules are armed, the check is skipped entirely.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+import re
+from threading import Lock
+
+_FIELD = re.compile(r"{([^}:]+)(?::[^}]*)?}")
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _normalize_path(path):
+    """Strip any trailing slash, as Falcon's router does by default."""
+    return path.rstrip("/") or "/"
+
+
+class TriggerRule(object):  # pylint: disable=too-few-public-methods
+    """A rule which triggers `epdb`_ on matching requests, until it has been used up.
+
+    :param method: The HTTP method to match
+    :param route: The path, or the route template in Falcon's syntax, to match
+    :param params: The values, as strings, that route fields or query parameters must have
+    :param count: The number of requests to trigger on before the rule disarms itself, or
+        :obj:`None` to trigger on every matching request
+    :param payload: The content that would otherwise be under the ``epdb`` key of an ``X-EPDB``
+        header, which may request an action in place of an interactive session
+    :type method: string
+    :type route: string
+    :type params: dictionary or None
+    :type count: int or None
+    :type payload: dictionary or None
+    :raises: ValueError
+    """
+
+    def __init__(self, method, route, params=None, count=1, payload=None):
+        if count is not None and count < 1:
+            raise ValueError("count must be at least 1")
+        if payload is not None and not isinstance(payload, dict):
+            raise ValueError("payload must be a dictionary")
+
+        self.payload = {} if payload is None else payload
+        self.method = method.upper()
+        self.route = _normalize_path(route)
+        self.fields = _FIELD.findall(self.route)
+        for field in self.fields:
+            if not _IDENTIFIER.match(field):
+                raise ValueError("Invalid field name in route: {}".format(field))
+        self.params = dict((name, str(value)) for name, value in (params or {}).items())
+        self.remaining = count
+
+    def __repr__(self):
+        """Return a representation showing what the rule matches, and its remaining count."""
+        return "TriggerRule({!r}, {!r}, params={!r}, count={!r})".format(
+            self.method, self.route, self.params, self.remaining
+        )
+
+    def matches(self, req, fields):
+        """Return whether the request has the parameter values the rule requires.
+
+        :param req: The Falcon request object
+        :param fields: The values of the route template's fields in the request's path
+        :type req: Request
+        :type fields: dictionary
+        :rtype: bool
+        """
+        for name, value in self.params.items():
+            actual = fields[name] if name in fields else req.get_param(name)
+            if actual != value:
+                return False
+        return True
+
+    def pattern(self, prefix):
+        """Return a regular expression for the route, with a named group per field.
+
+        :param prefix: The prefix of the group names, which are numbered in field order
+        :type prefix: string
+        :rtype: string
+        """
+        parts = []
+        position = 0
+        for number, match in enumerate(_FIELD.finditer(self.route)):
+            start, end = match.span()
+            parts.append(re.escape(self.route[position:start]))
+            parts.append("(?P<{}{}>[^/]+)".format(prefix, number))
+            position = end
+        parts.append(re.escape(self.route[position:]))
+        return "".join(parts)
+
+
+class TriggerRules(object):
+    """A table of armed :class:`TriggerRule` entries.
+
+    Pass an instance to the ``rules`` parameter of :class:`EPDBServe`. Rules may be armed and
+    disarmed at any time, from any thread. A request matching a rule is treated as though it
+    had carried a valid ``X-EPDB`` header with the rule's payload. Rules are checked in the
+    order in which they were armed, and only for requests without an ``X-EPDB`` header.
+    """
+
+    def __init__(self):
+        self._rules = []
+        self._index = None
+        self._lock = Lock()
+
+    def __len__(self):
+        """Return the number of armed rules."""
+        return len(self._rules)
+
+    @property
+    def rules(self):
+        """The armed rules, in the order in which they are checked.
+
+        :rtype: list of :class:`TriggerRule`
+        """
+        return list(self._rules)
+
+    def arm(self, method, route, params=None, count=1, payload=None):
+        """Arm a new rule. The parameters are as for :class:`TriggerRule`.
+
+        :returns: The new rule, which may be passed to :meth:`disarm`
+        :rtype: TriggerRule
+        :raises: ValueError
+        """
+        rule = TriggerRule(method, route, params=params, count=count, payload=payload)
+        with self._lock:
+            self._rules.append(rule)
+            self._compile()
+        return rule
+
+    def disarm(self, rule):
+        """Disarm a rule, if it is still armed.
+
+        :param rule: A rule returned by :meth:`arm`
+        :type rule: TriggerRule
+        """
+        with self._lock:
+            if rule in self._rules:
+                self._rules.remove(rule)
+                self._compile()
+
+    def clear(self):
+        """Disarm every rule."""
+        with self._lock:
+            self._rules = []
+            self._compile()
+
+    def match(self, req):
+        """Return the payload of the first armed rule matching the request, using it up.
+
+        :param req: The Falcon request object
+        :type req: Request
+        :returns: The rule's payload, or :obj:`None` if no rule matches
+        :rtype: dictionary or None
+        """
+        index = self._index
+        if index is None:
+            return None
+
+        static, patterns = index
+        method = req.method
+        path = _normalize_path(req.path)
+        for rule in static.get((method, path), ()):
+            if rule.matches(req, {}) and self._consume(rule):
+                return rule.payload
+
+        compiled = patterns.get(method)
+        if compiled is None:
+            return None
+        regex, groups = compiled
+        match = regex.match(path)
+        if match is None:
+            return None
+        rules = groups[match.lastgroup]
+        values = dict(
+            (field, match.group("{}_{}".format(match.lastgroup, number)))
+            for number, field in enumerate(rules[0].fields)
+        )
+        for rule in rules:
+            if rule.matches(req, values) and self._consume(rule):
+                return rule.payload
+        return None
+
+    def _consume(self, rule):
+        """Count a use of the rule, disarming it once used up. Returns whether it could be used."""
+        with self._lock:
+            if rule not in self._rules:
+                # Used up, or disarmed, by a concurrent request
+                return False
+            if rule.remaining is not None:
+                rule.remaining -= 1
+                if not rule.remaining:
+                    self._rules.remove(rule)
+                    self._compile()
+        return True
+
+    def _compile(self):
+        """Rebuild the index of the armed rules. Must be called with the lock."""
+        if not self._rules:
+            self._index = None
+            return
+
+        static = {}
+        templates = {}
+        for rule in self._rules:
+            if rule.fields:
+                by_route = templates.setdefault(rule.method, {})
+                by_route.setdefault(rule.route, []).append(rule)
+            else:
+                static.setdefault((rule.method, rule.route), []).append(rule)
+
+        patterns = {}
+        for method, by_route in templates.items():
+            alternatives = []
+            groups = {}
+            for number, rules in enumerate(by_route.values()):
+                # The match's lastgroup is this outer group, as it closes after the fields
+                name = "route{}".format(number)
+                alternatives.append("(?P<{}>{})".format(name, rules[0].pattern(name + "_")))
+                groups[name] = rules
+            patterns[method] = (re.compile("^(?:{})$".format("|".join(alternatives))), groups)
+        self._index = (static, patterns)
@@ -0,0 +1,156 @@
+"""Admission control for `epdb`_ sessions in threaded and greenlet workers.
+
+`epdb`_ holds a single session per process, so a second flagged request that reached
+:func:`epdb.serve()` while another was being debugged would race it for the port, and block
+another worker thread. A :class:`SessionManager` admits one flagged request at a time into the
+debugger, process-wide, and decides what happens to the others.
+
+Waiting uses the :mod:`threading` primitives, so under gevent (with the standard library
+monkey-patched) only the waiting greenlet is blocked.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+from logging import getLogger
+from threading import Condition
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+logger = getLogger(__name__)
+
+#: What a :class:`SessionManager` may do with a flagged request while another holds the session
+BUSY_OUTCOMES = ("proceed", "queue", "reject")
+
+
+class _Session(object):  # pylint: disable=too-few-public-methods
+    """The state of the process's epdb session, shared by every :class:`SessionManager`."""
+
+    def __init__(self):
+        self.condition = Condition()
+        self.holder = None
+        self.queued = 0
+
+
+_session = _Session()
+
+
+class SessionManager(object):
+    """Admits one flagged request at a time into the `epdb`_ session of the process.
+
+    :param when_busy: What to do with a flagged request while another is being debugged:
+        ``"proceed"`` to let it continue untraced, ``"queue"`` to wait for the session, or
+        ``"reject"`` to fail it with a ``503`` response
+    :param max_queued: When queueing, the greatest number of requests that may wait at once
+    :param queue_timeout: When queueing, the number of seconds to wait for the session, or
+        :obj:`None` to wait indefinitely
+    :type when_busy: string
+    :type max_queued: int
+    :type queue_timeout: float or None
+    :raises: ValueError
+
+    Pass an instance to the ``sessions`` parameter of :class:`EPDBServe`. A request is admitted
+    before it waits for a client or enters the debugger, and holds the session until its
+    response is processed. Requests that are not admitted, including those that overflow the
+    queue or time out in it, carry the ``X-EPDB-Busy`` response header.
+
+    The session is shared by every instance in the process, as `epdb`_'s is, so that apps with
+    several middleware instances cannot debug concurrently either.
+    """
+
+    #: The response header marking flagged requests that were not admitted
+    busy_header = "X-EPDB-Busy"
+
+    def __init__(self, when_busy="proceed", max_queued=1, queue_timeout=30.0):
+        if when_busy not in BUSY_OUTCOMES:
+            raise ValueError(
+                "when_busy must be one of {}, not {!r}".format(", ".join(BUSY_OUTCOMES), when_busy)
+            )
+        if max_queued < 1:
+            raise ValueError("max_queued must be at least 1")
+        self.when_busy = when_busy
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+    @property
+    def busy(self):
+        """Whether a request currently holds the session.
+
+        :rtype: bool
+        """
+        return _session.holder is not None
+
+    @property
+    def queued(self):
+        """The number of requests waiting for the session.
+
+        :rtype: int
+        """
+        return _session.queued
+
+    def admit(self, request):
+        """Try to take the session for a request.
+
+        :param request: A description of the request, for the logs
+        :type request: string
+        :returns: A ticket to :meth:`SessionTicket.finish` once the request is done, or
+            :obj:`None` if it was not admitted
+        :rtype: SessionTicket or None
+        """
+        with _session.condition:
+            if _session.holder is None:
+                return _take(request)
+
+            if self.when_busy == "queue" and _session.queued < self.max_queued:
+                _session.queued += 1
+                try:
+                    if self._wait():
+                        return _take(request)
+                finally:
+                    _session.queued -= 1
+
+            logger.info(
+                "Not debugging %s: the epdb session is held by %s", request, _session.holder.request
+            )
+            return None
+
+    def _wait(self):
+        """Wait for the session to be free, returning whether it is. Called with the condition."""
+        deadline = None if self.queue_timeout is None else monotonic() + self.queue_timeout
+        while _session.holder is not None:
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            _session.condition.wait(remaining)
+        return True
+
+
+class SessionTicket(object):  # pylint: disable=too-few-public-methods
+    """A flagged request's hold on the `epdb`_ session, returned by :meth:`SessionManager.admit`.
+
+    :param request: A description of the request, for the logs
+    :type request: string
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def finish(self, resp=None):  # pylint: disable=unused-argument
+        """Release the session for the next flagged request. Safe to call repeatedly.
+
+        :param resp: The Falcon response object (unused)
+        :type resp: Response or None
+        """
+        with _session.condition:
+            if _session.holder is self:
+                _session.holder = None
+                _session.condition.notify_all()
+
+
+def _take(request):
+    """Give the session to a request. Called with the condition."""
+    ticket = SessionTicket(request)
+    _session.holder = ticket
+    return ticket
@@ -0,0 +1,153 @@
+"""Rate limiting of ``X-EPDB`` header processing."""
+
+from collections import OrderedDict
+from threading import Lock
+
+from falcon_epdb.cache import HeaderCache
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+
+class TokenBucket(object):
+    """A classic token bucket.
+
+    :param rate: The number of tokens added to the bucket per second
+    :param burst: The maximum number of tokens the bucket may hold
+    :type rate: float
+    :type burst: int
+
+    This is not thread-safe on its own; :class:`HeaderThrottle` serializes access to its buckets.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+
+    def consume(self, now=None):
+        """Take a token from the bucket, if one is available.
+
+        :param now: The current :func:`time.monotonic` value, if already known
+        :returns: Whether a token was taken
+        :rtype: bool
+        """
+        if not self.available(now):
+            return False
+        self.tokens -= 1
+        return True
+
+    def available(self, now=None):
+        """Return whether a token is available, without taking it.
+
+        :param now: The current :func:`time.monotonic` value, if already known
+        :rtype: bool
+        """
+        now = monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens >= 1
+
+
+class HeaderThrottle(object):
+    """Limits how often the configured backend is asked to process invalid ``X-EPDB`` headers.
+
+    :param rate: The number of rejected headers per second allowed across all clients
+    :param burst: The number of rejected headers allowed at once across all clients
+    :param client_rate: The number of rejected headers per second allowed for a single client
+    :param client_burst: The number of rejected headers allowed at once for a single client
+    :param max_clients: The number of per-client buckets to track before evicting the least
+        recently seen client
+    :param rejected_maxsize: The number of rejected header values to remember
+    :param rejected_ttl: The number of seconds a rejected header value is remembered for
+    :type rate: float
+    :type burst: int
+    :type client_rate: float
+    :type client_burst: int
+    :type max_clients: int
+    :type rejected_maxsize: int
+    :type rejected_ttl: float
+
+    Pass an instance to the ``throttle`` parameter of :class:`EPDBServe`. Every request carrying
+    the header is checked against the following, in order, before the backend sees it:
+
+    #. A bounded cache of digests of header values that the backend recently rejected. A repeated
+       bad header is dropped without being decoded again.
+    #. A per-client token bucket, keyed on the request's ``remote_addr``.
+    #. A global token bucket shared by all clients.
+
+    Only headers that the backend rejects take tokens from the buckets, so a client sending valid
+    headers is never throttled. Once a client (or all clients together) has used up its share of
+    rejections, any header it sends is dropped until the bucket refills. Dropped headers are
+    treated as though they were never sent.
+    """
+
+    def __init__(
+        self,
+        rate=1.0,
+        burst=10,
+        client_rate=0.2,
+        client_burst=5,
+        max_clients=1024,
+        rejected_maxsize=1024,
+        rejected_ttl=60.0,
+    ):
+        # pylint: disable=too-many-arguments
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.rejected = HeaderCache(maxsize=rejected_maxsize, ttl=rejected_ttl)
+        self._bucket = TokenBucket(rate, burst)
+        self._client_buckets = OrderedDict()
+        self._lock = Lock()
+
+    def admit(self, client, epdb_header):
+        """Decide whether a header should be passed on to the backend.
+
+        :param client: An identifier for the client, typically its IP address
+        :param epdb_header: The content of the ``X-EPDB`` header, if known
+        :type client: string
+        :type epdb_header: string or None
+        :returns: Whether the header may be processed
+        :rtype: bool
+        """
+        if epdb_header and self.rejected.get(epdb_header):
+            return False
+
+        now = monotonic()
+        with self._lock:
+            return self._client_bucket(client).available(now) and self._bucket.available(now)
+
+    def reject(self, epdb_header, client=None):
+        """Remember a header value that the backend failed to process, and charge for it.
+
+        :param epdb_header: The content of the ``X-EPDB`` header, if known
+        :param client: An identifier for the client that sent it, typically its IP address
+        :type epdb_header: string or None
+        :type client: string or None
+        """
+        if epdb_header:
+            self.rejected.set(epdb_header, True)
+
+        now = monotonic()
+        with self._lock:
+            if client is not None:
+                self._client_bucket(client).consume(now)
+            self._bucket.consume(now)
+
+    def _client_bucket(self, client):
+        """Return the client's bucket, marking it most recently seen. Called with the lock."""
+        bucket = self._client_buckets.pop(client, None)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+        self._client_buckets[client] = bucket
+        while len(self._client_buckets) > self.max_clients:
+            self._client_buckets.popitem(last=False)
+        return bucket
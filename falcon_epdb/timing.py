@@ -0,0 +1,115 @@
+"""Attribution of a flagged request's latency to the work done on behalf of the debugger.
+
+The time spent at the `epdb`_ prompt is measured by wrapping :meth:`epdb.Epdb.interaction`,
+which is where the debugger waits on its client, and accumulating the time per thread.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+from threading import Lock, local
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+
+_paused = local()
+_install_lock = Lock()
+
+# Set on the debugger class once its prompt is wrapped, whatever else wraps it since
+_TIMED = "falcon_epdb_timed"
+
+
+def paused_seconds():
+    """Return the total time the current thread has spent stopped at the debugger prompt.
+
+    :rtype: float
+    """
+    return getattr(_paused, "total", 0.0)
+
+
+def time_pauses(epdb):
+    """Start accumulating the time spent in the debugger's prompt. Safe to call repeatedly.
+
+    :param epdb: The `epdb`_ module
+    :type epdb: module
+    """
+    with _install_lock:
+        if getattr(epdb.Epdb, _TIMED, False):
+            return
+        interaction = epdb.Epdb.interaction
+
+        def timed_interaction(self, *args, **kwargs):
+            started = monotonic()
+            try:
+                return interaction(self, *args, **kwargs)
+            finally:
+                _paused.total = paused_seconds() + monotonic() - started
+
+        epdb.Epdb.interaction = timed_interaction
+        setattr(epdb.Epdb, _TIMED, True)
+
+
+class ServerTiming(object):
+    """Durations attributable to the debugger during a single flagged request.
+
+    The request's share of :func:`paused_seconds` is measured from when the instance is created,
+    or from the last call to :meth:`measure_pauses`.
+    """
+
+    #: The response header which identifies flagged requests
+    flag_header = "X-EPDB-Flagged"
+
+    def __init__(self):
+        self.decode = 0.0
+        self.wait = 0.0
+        self._paused_at_start = paused_seconds()
+
+    def measure_pauses(self):
+        """Measure :attr:`paused` from now, on the current thread.
+
+        The pauses are accumulated per thread, so this is called on the thread that serves the
+        debugger, if it is not the one which created the instance.
+        """
+        self._paused_at_start = paused_seconds()
+
+    @property
+    def paused(self):
+        """The time this request has spent stopped at the debugger prompt, in seconds."""
+        return paused_seconds() - self._paused_at_start
+
+    def add_wait(self, started, paused_at_start):
+        """Add the time elapsed since :obj:`started`, less any spent paused, to :attr:`wait`.
+
+        :param started: A value previously returned by :func:`time.monotonic`
+        :param paused_at_start: The value of :func:`paused_seconds` at the same time
+        :type started: float
+        :type paused_at_start: float
+        """
+        self.wait += monotonic() - started - (paused_seconds() - paused_at_start)
+
+    def header_value(self):
+        """Return the ``Server-Timing`` header value, with durations in milliseconds.
+
+        :rtype: string
+        """
+        return ", ".join(
+            "epdb-{};dur={:.3f}".format(name, seconds * 1000)
+            for name, seconds in (
+                ("decode", self.decode),
+                ("wait", self.wait),
+                ("paused", self.paused),
+            )
+        )
+
+    def finish(self, resp):
+        """Add the ``Server-Timing`` and flag headers to the response.
+
+        :param resp: The Falcon response object
+        :type resp: Response
+
+        Any ``Server-Timing`` metrics already on the response are kept.
+        """
+        resp.append_header("Server-Timing", self.header_value())
+        resp.set_header(self.flag_header, "1")
@@ -0,0 +1,201 @@
+"""Limits on how long an attached `epdb`_ session may hold up a worker.
+
+The limits are enforced by wrapping :meth:`epdb.Epdb.interaction`, which is where the debugger
+waits on its client. While the prompt is waiting, a timer is set for the nearest limit. If it
+fires, the client's connection is dropped, which unblocks the prompt, and the session is closed
+as though the client had used the ``close`` command: the original standard streams are restored,
+tracing stops, and the request carries on.
+
+.. _epdb: https://pypi.org/project/epdb/
+"""
+
+import os
+import signal
+from logging import getLogger
+from threading import Lock, Timer, local
+
+try:
+    from time import monotonic
+except ImportError:  # pragma: no cover
+    from time import time as monotonic
+
+logger = getLogger(__name__)
+
+_current = local()
+_install_lock = Lock()
+
+# Set on the epdb server when the watchdog first sees it, as epdb does not record it
+_ATTACHED_AT = "falcon_epdb_attached_at"
+
+# Set on the debugger class once its methods are wrapped, whatever else wraps them since
+_WATCHED = "falcon_epdb_watched"
+
+
+class SessionLimits(object):
+    """The limits on how long a flagged request may be held up by its `epdb`_ session.
+
+    :param session_timeout: The number of seconds after a client attaches at which the session
+        is closed, or :obj:`None` for no limit
+    :param pause_timeout: The total number of seconds the request may spend stopped at the
+        debugger prompt, or :obj:`None` for no limit
+    :type session_timeout: float or None
+    :type pause_timeout: float or None
+
+    The limits apply to the thread that calls :meth:`start`, until :meth:`finish` is called.
+    """
+
+    def __init__(self, session_timeout=None, pause_timeout=None):
+        self.session_timeout = session_timeout
+        self.pause_timeout = pause_timeout
+
+        #: The number of seconds the request has spent stopped at the prompt
+        self.paused = 0.0
+
+        #: Whether a limit has been hit
+        self.expired = False
+
+    def start(self):
+        """Apply the limits to the current thread."""
+        _current.limits = self
+
+    def finish(self, resp=None):  # pylint: disable=unused-argument
+        """Stop applying the limits to the current thread.
+
+        :param resp: The Falcon response object (unused)
+        :type resp: Response or None
+        """
+        if getattr(_current, "limits", None) is self:
+            del _current.limits
+
+    def remaining(self, server):
+        """Return the number of seconds until the nearest limit, or None if there is none.
+
+        :param server: The epdb server of the attached session
+        :type server: epdb.epdb_server.InvertedTelnetServer
+        :rtype: float or None
+        """
+        remaining = []
+        if self.pause_timeout is not None:
+            remaining.append(self.pause_timeout - self.paused)
+        if self.session_timeout is not None:
+            attached_at = getattr(server, _ATTACHED_AT, None)
+            if attached_at is None:
+                attached_at = monotonic()
+                setattr(server, _ATTACHED_AT, attached_at)
+            remaining.append(attached_at + self.session_timeout - monotonic())
+        return min(remaining) if remaining else None
+
+
+def current_limits():
+    """Return the limits applied to the current thread, if any.
+
+    :rtype: SessionLimits or None
+    """
+    return getattr(_current, "limits", None)
+
+
+def close_session(epdb, debugger=None):
+    """Close the attached session, restoring the standard streams, and stop tracing.
+
+    :param epdb: The `epdb`_ module
+    :param debugger: The debugger whose tracing to stop, if it is stopped at the prompt
+    :type epdb: module
+    :type debugger: epdb.Epdb or None
+    """
+    # pylint: disable=protected-access
+    server = epdb.Epdb._server
+    epdb.Epdb._server = None
+    if server is not None:
+        try:
+            server.close_request()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Failed to close the epdb session cleanly")
+    if debugger is not None:
+        debugger.forget()
+        debugger.set_continue()
+
+
+def watch_sessions(epdb):
+    """Start enforcing the :class:`SessionLimits` of each thread. Safe to call repeatedly.
+
+    :param epdb: The `epdb`_ module
+    :type epdb: module
+    """
+    with _install_lock:
+        debugger_class = epdb.Epdb
+        if getattr(debugger_class, _WATCHED, False):
+            return
+        interaction = debugger_class.interaction
+        onecmd = debugger_class.onecmd
+
+        def watched_interaction(self, frame, traceback):
+            limits = current_limits()
+            server = debugger_class._server  # pylint: disable=protected-access
+            if limits is None or server is None:
+                return interaction(self, frame, traceback)
+
+            remaining = limits.remaining(server)
+            if remaining is not None and remaining <= 0:
+                _expire(limits, server)
+                close_session(epdb, self)
+                return None
+
+            timer = None
+            if remaining is not None:
+                timer = Timer(remaining, _disconnect, (limits, server))
+                timer.daemon = True
+                timer.start()
+            started = monotonic()
+            try:
+                return interaction(self, frame, traceback)
+            except Exception:  # pylint: disable=broad-except
+                if not limits.expired:
+                    raise
+                # The dropped connection surfaced as an error, rather than end-of-file
+                close_session(epdb, self)
+                return None
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                limits.paused += monotonic() - started
+
+        def watched_onecmd(self, line):
+            limits = current_limits()
+            if limits is not None and limits.expired:
+                # Whatever the prompt read once the connection dropped, end the session
+                line = "close"
+            return onecmd(self, line)
+
+        debugger_class.interaction = watched_interaction
+        debugger_class.onecmd = watched_onecmd
+        setattr(debugger_class, _WATCHED, True)
+
+
+def _expire(limits, server):
+    """Record that a limit has been hit."""
+    if not limits.expired:
+        limits.expired = True
+        logger.warning("Closing the epdb session on port %s: time limit reached", _port(server))
+
+
+def _disconnect(limits, server):
+    """Hit a limit while the prompt is waiting, dropping the client's connection to unblock it.
+
+    The connection is relayed to the prompt by a child process, which is stopped.
+    """
+    _expire(limits, server)
+    pid = getattr(server, "serverPid", None)
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        logger.exception("Failed to disconnect the epdb client")
+
+
+def _port(server):
+    """Return the port the server was bound to, if known."""
+    try:
+        return server.server_address[1]
+    except (AttributeError, IndexError, TypeError):
+        return None
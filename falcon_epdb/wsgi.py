@@ -0,0 +1,240 @@
+"""Remote debugging support for any WSGI app, Falcon or not.
+
+:class:`WSGIEPDBServe` wraps the WSGI application itself, rather than joining a Falcon app's
+middleware, so a request without the ``X-EPDB`` header is handed to the application after a
+dictionary lookup, before Falcon (or any other framework) has built its request object.
+"""
+
+from functools import partial
+
+from falcon_epdb import _ACTION_CONTEXT_KEY, EPDBServe
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qs
+
+# The environ key of the header, and of the header sent with the ``HTTP-`` prefix
+_HEADER_KEY = "HTTP_X_EPDB"
+_PREFIXED_HEADER_KEY = "HTTP_HTTP_X_EPDB"
+
+
+class WSGIEPDBServe(EPDBServe):
+    """A WSGI middleware to enable remote debugging of any WSGI app via an `epdb`_ server.
+
+    :param app: The WSGI application to wrap
+    :param backend: An instance of the class that will validate and decode the ``X-EPDB`` header
+    :type app: callable
+    :type backend: EPDBBackend
+
+    Any other parameters are as for :class:`EPDBServe`, which this otherwise behaves like.
+
+    .. code-block:: python
+
+        application = WSGIEPDBServe(application, backend=FernetBackend(key=fernet_key))
+
+    The header is accepted with or without the ``HTTP-`` prefix. Unless :obj:`rules` or a
+    :obj:`control` switch are configured, requests without it cost two dictionary lookups.
+    Flagged requests are given a lightweight view of the WSGI environ, standing in for the
+    Falcon request. Their ``Server-Timing`` headers are added when the application starts its
+    response, and their session ends when the server closes the response body, once the
+    application has produced it. A request running an action is instead run to the end of its
+    body before the response is started, so that the action covers all of the application's
+    work and its report can be returned on the response.
+
+    .. _epdb: https://pypi.org/project/epdb/
+    """
+
+    def __init__(self, app, backend, **kwargs):
+        super(WSGIEPDBServe, self).__init__(backend, **kwargs)
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        """Handle a WSGI request, debugging it if it is flagged."""
+        if (
+            self.control is None
+            and self.rules is None
+            and self.backend.header_environ_key == _HEADER_KEY
+            and _HEADER_KEY not in environ
+            and _PREFIXED_HEADER_KEY not in environ
+        ):
+            return self.app(environ, start_response)
+
+        req, resp = EnvironRequest(environ), EnvironResponse()
+        self.process_request(req, resp)
+        if resp.complete:
+            self.process_response(req, resp, None, True)
+            body = resp.data or b""
+            headers = resp.merge_headers([("Content-Length", str(len(body)))])
+            start_response(resp.status or "200 OK", headers)
+            return [body]
+
+        if _ACTION_CONTEXT_KEY in req.context:
+            return self._call_to_completion(req, resp, environ, start_response)
+
+        def start_flagged_response(status, headers, exc_info=None):
+            self._finish_timing(req, resp)
+            return start_response(status, resp.merge_headers(headers), exc_info)
+
+        try:
+            result = self.app(environ, start_flagged_response)
+        except Exception:
+            self.process_response(req, resp, None, False)
+            raise
+        return _ClosingIterable(result, partial(self.process_response, req, resp, None))
+
+    def _reject_busy(self, req, resp):
+        """Answer the request with a ``503`` response, without calling the application."""
+        resp.status = "503 Service Unavailable"
+        resp.complete = True
+
+    def _call_to_completion(self, req, resp, environ, start_response):
+        """Run the application to the end of its body, so the action covers all of its work."""
+        body, started = [], []
+
+        def start_buffered_response(
+            status, headers, exc_info=None
+        ):  # pylint: disable=unused-argument
+            started.append((status, headers))
+            return body.append
+
+        try:
+            result = self.app(environ, start_buffered_response)
+            try:
+                body.extend(result)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except Exception:
+            self.process_response(req, resp, None, False)
+            raise
+        self.process_response(req, resp, None, True)
+
+        status, headers = started[-1]
+        if resp.data is not None:
+            # The action replaced the body
+            body = [resp.data]
+        start_response(status, resp.merge_headers(headers))
+        return body
+
+
+class EnvironRequest(object):
+    """A view of a WSGI environ with the parts of the Falcon request the middleware uses.
+
+    :param environ: The WSGI environ
+    :type environ: dictionary
+    """
+
+    def __init__(self, environ):
+        if _HEADER_KEY not in environ and _PREFIXED_HEADER_KEY in environ:
+            environ = dict(environ, **{_HEADER_KEY: environ[_PREFIXED_HEADER_KEY]})
+        self.env = environ
+        self.context = {}
+        self._params = None
+
+    @property
+    def method(self):
+        """The request method."""
+        return self.env.get("REQUEST_METHOD", "GET")
+
+    @property
+    def path(self):
+        """The request path."""
+        return self.env.get("PATH_INFO") or "/"
+
+    @property
+    def remote_addr(self):
+        """The address of the client."""
+        return self.env.get("REMOTE_ADDR")
+
+    def get_header(self, name, default=None):
+        """Return the value of a request header.
+
+        :param name: The header name, such as ``X-EPDB``
+        :param default: The value to return if the header is missing
+        :type name: string
+        :rtype: string or None
+        """
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        return self.env.get(key) or default
+
+    def get_param(self, name, default=None):
+        """Return the first value of a query string parameter.
+
+        :param name: The parameter name
+        :param default: The value to return if the parameter is missing
+        :type name: string
+        :rtype: string or None
+        """
+        if self._params is None:
+            self._params = parse_qs(self.env.get("QUERY_STRING", ""), keep_blank_values=True)
+        values = self._params.get(name)
+        return values[0] if values else default
+
+
+class EnvironResponse(object):  # pylint: disable=too-many-instance-attributes
+    """Collects what the middleware sets on the response, as it would on a Falcon response."""
+
+    def __init__(self):
+        self.status = None
+        self.complete = False
+        self.content_type = None
+        self.data = None
+        self.media = None
+        self.text = None
+        self._headers = []
+        self._replaced = set()
+
+    def set_header(self, name, value):
+        """Set a response header, replacing any set by the application."""
+        self._headers = [header for header in self._headers if header[0].lower() != name.lower()]
+        self._headers.append((name, value))
+        self._replaced.add(name.lower())
+
+    def append_header(self, name, value):
+        """Add a response header, alongside any set by the application."""
+        self._headers.append((name, value))
+
+    def merge_headers(self, headers):
+        """Return the application's response headers with those set here applied.
+
+        :param headers: The application's response headers
+        :type headers: list of tuples
+        :rtype: list of tuples
+        """
+        replaced = set(self._replaced)
+        if self.data is not None:
+            replaced.update(("content-type", "content-length"))
+        merged = [header for header in headers if header[0].lower() not in replaced]
+        if self.data is not None:
+            merged.append(("Content-Type", self.content_type or "application/octet-stream"))
+            merged.append(("Content-Length", str(len(self.data))))
+        return merged + self._headers
+
+
+class _ClosingIterable(object):
+    """An application's response body, which finishes the middleware's work when closed."""
+
+    def __init__(self, result, finish):
+        self._result = result
+        self._finish = finish
+        self._succeeded = True
+
+    def __iter__(self):
+        """Yield the application's response body."""
+        try:
+            for chunk in self._result:  # pylint: disable=use-yield-from
+                yield chunk
+        except Exception:
+            self._succeeded = False
+            raise
+
+    def close(self):
+        """Close the application's response, then finish the middleware's work on it."""
+        try:
+            if hasattr(self._result, "close"):
+                self._result.close()
+        finally:
+            self._finish(self._succeeded)
@@ -3,6 +3,9 @@
 
 import base64
 import json
+import sys
+
+import epdb
 import pytest
 import falcon
 from falcon.testing import TestClient, SimpleTestResource
@@ -19,11 +22,37 @@ try:
 except ImportError:
     pass
 
+if sys.version_info < (3, 5):
+    # The ASGI middleware requires async/await support
+    collect_ignore = ["test_asgi.py"]
+
 
 @pytest.fixture
 def mock_epdb_serve(mocker):
     """Mock the epdb.serve() method."""
-    return mocker.patch("falcon_epdb.epdb.serve")
+    return mocker.patch("epdb.serve")
+
+
+@pytest.fixture
+def epdb_hooks(mocker):
+    """Restore the epdb debugger methods the middleware wraps, and its record of them, after."""
+    mocker.patch.object(epdb.Epdb, "interaction", epdb.Epdb.interaction)
+    mocker.patch.object(epdb.Epdb, "onecmd", epdb.Epdb.onecmd)
+    mocker.patch.object(epdb.Epdb, "falcon_epdb_timed", False, create=True)
+    mocker.patch.object(epdb.Epdb, "falcon_epdb_watched", False, create=True)
+    return epdb.Epdb
+
+
+@pytest.fixture
+def make_client():
+    """Provide a factory for clients calling an app configured with the given middleware."""
+
+    def factory(middleware):
+        app = falcon.API(middleware=[middleware])
+        app.add_route("/", SimpleTestResource(json={}))
+        return TestClient(app)
+
+    return factory
 
 
 @pytest.fixture
@@ -120,3 +149,9 @@ def jwt_app(jwt_middleware):
 def jwt_client(jwt_app):
     """Provide a client to call the JWT backend app."""
     return TestClient(jwt_app)
+
+
+@pytest.fixture
+def actions_client(make_client, tmpdir):
+    """Provide a client to call an app whose action reports are written to a temporary directory."""
+    return make_client(EPDBServe(backend=Base64Backend(), output_dir=str(tmpdir)))
@@ -0,0 +1,369 @@
+"""Tests for the header-triggered actions"""
+
+import base64
+import inspect
+import json
+import os
+import re
+import pstats
+import zlib
+
+import sys
+import threading
+import time
+import tracemalloc
+
+import falcon
+import pytest
+import testfixtures
+from falcon import testing
+
+from falcon_epdb import (
+    Base64Backend,
+    EPDBServe,
+    MemoryAction,
+    ProfileAction,
+    SampleAction,
+    SnapshotAction,
+)
+from falcon_epdb.actions import collapse_stack
+
+
+def encode_header(content):
+    """Return an X-EPDB header value for the Base64 backend."""
+    return "Base64 {}".format(base64.b64encode(json.dumps(content).encode()).decode())
+
+
+def test_profile_report_in_body(actions_client, mock_epdb_serve):
+    """Test that the profile replaces the response body by default."""
+    header = encode_header({"epdb": {"profile": {"sort": "tottime", "limit": 5}}})
+
+    result = actions_client.simulate_get(headers={"X-EPDB": header})
+
+    assert result.status_code == 200
+    assert result.headers["content-type"] == "text/plain; charset=utf-8"
+    assert "function calls" in result.text
+    assert "Ordered by: internal time" in result.text
+    assert not mock_epdb_serve.called
+
+
+def test_profile_report_in_header(actions_client):
+    """Test that the profile can be returned, compressed, on a response header."""
+    header = encode_header({"epdb": {"profile": {"output": "header"}}})
+
+    result = actions_client.simulate_get(headers={"X-EPDB": header})
+
+    report = zlib.decompress(base64.b64decode(result.headers["X-EPDB-Profile"])).decode()
+    assert "function calls" in report
+    assert result.json == {}
+
+
+def test_profile_report_in_file(actions_client, tmpdir):
+    """Test that the raw stats can be written to a file in the output directory."""
+    header = encode_header({"epdb": {"profile": {"output": "file"}}})
+
+    result = actions_client.simulate_get(headers={"X-EPDB": header})
+
+    path = result.headers["X-EPDB-Profile"]
+    assert os.path.dirname(path) == str(tmpdir)
+    assert path.endswith(".pstats")
+    assert pstats.Stats(path).total_calls > 0
+    assert result.json == {}
+
+
+class SlowResource(object):
+    """A resource that spends long enough in a recognisable function to be sampled."""
+
+    def on_get(self, req, resp):  # pylint: disable=unused-argument
+        """Respond after sleeping."""
+        resp.media = {"slept": self.sleep_for_a_while()}
+
+    @staticmethod
+    def sleep_for_a_while():
+        """Sleep for a while."""
+        time.sleep(0.1)
+        return True
+
+
+def test_sample_report_is_collapsed_stacks():
+    """Test that the sampler reports the request thread's stacks in the collapsed format."""
+    app = falcon.API(middleware=[EPDBServe(backend=Base64Backend())])
+    app.add_route("/", SlowResource())
+    header = encode_header({"epdb": {"sample": {"rate": 1000}}})
+
+    result = testing.TestClient(app).simulate_get(headers={"X-EPDB": header})
+
+    lines = result.text.splitlines()
+    assert lines
+    stacks = {}
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        stacks[stack] = int(count)
+    sleeping = [stack for stack in stacks if "sleep_for_a_while" in stack.split(";")[-1]]
+    assert sleeping
+    assert sum(stacks[stack] for stack in sleeping) >= 10
+    assert all(";on_get (" in stack for stack in sleeping)
+    assert not any("falcon-epdb-sampler" in stack or "_run (" in stack for stack in stacks)
+
+
+def test_sampler_only_samples_request_thread():
+    """Test that the sampler ignores the other threads in the process."""
+    action = SampleAction({"rate": 1000}, None)
+    stop = threading.Event()
+
+    def busy_elsewhere():
+        stop.wait()
+
+    other = threading.Thread(target=busy_elsewhere)
+    other.start()
+    try:
+        action.start()
+        time.sleep(0.05)
+        action.stop()
+    finally:
+        stop.set()
+        other.join()
+
+    assert action.counts
+    assert not any("busy_elsewhere" in stack for stack in action.counts)
+    assert not action._sampler.is_alive()  # pylint: disable=protected-access
+
+
+@pytest.mark.parametrize("rate", (0, 1001, "fast"))
+def test_invalid_sample_rate(rate):
+    """Test that the sample rate is bounded."""
+    with pytest.raises(ValueError):
+        SampleAction({"rate": rate}, None)
+
+
+def test_collapse_stack():
+    """Test that the frames are ordered from the outermost to the innermost."""
+
+    def inner():
+        return collapse_stack(sys._getframe())  # pylint: disable=protected-access
+
+    def outer():
+        return inner()
+
+    frames = outer().split(";")
+
+    assert frames[-1].startswith("inner (")
+    assert frames[-2].startswith("outer (")
+    assert frames[-3].startswith("test_collapse_stack (")
+
+
+class AllocatingResource(object):  # pylint: disable=too-few-public-methods
+    """A resource that holds on to a recognisable allocation."""
+
+    retained = []
+
+    def on_get(self, req, resp):  # pylint: disable=unused-argument
+        """Respond after allocating."""
+        self.retained.append([object() for _ in range(5000)])
+        resp.media = {}
+
+
+def test_memory_report():
+    """Test that the memory report lists the sites that allocated during the request."""
+    app = falcon.API(middleware=[EPDBServe(backend=Base64Backend())])
+    app.add_route("/", AllocatingResource())
+    header = encode_header({"epdb": {"memory": {"limit": 5}}})
+
+    result = testing.TestClient(app).simulate_get(headers={"X-EPDB": header})
+
+    report = result.text
+    assert report.startswith("Traced memory: ")
+    assert "Top 5 allocation sites by size:" in report
+    assert "Top 5 allocation sites by count:" in report
+    by_size = report.split("by size:\n", 1)[1].split("\n\n", 1)[0].splitlines()
+    assert len(by_size) <= 5
+    assert "test_actions.py" in by_size[0]
+    assert int(re.search(r"count=\d+ \(\+(\d+)\)", by_size[0]).group(1)) >= 5000
+    assert "actions.py" not in report.replace("test_actions.py", "")
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_tracing_is_shared():
+    """Test that tracing continues until the last traced request finishes."""
+    first, second = MemoryAction({}, None), MemoryAction({}, None)
+
+    first.start()
+    second.start()
+    first.stop()
+    assert tracemalloc.is_tracing()
+    second.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_leaves_existing_tracing_running():
+    """Test that tracing which was started elsewhere is not stopped."""
+    tracemalloc.start()
+    try:
+        action = MemoryAction({}, None)
+        action.start()
+        action.stop()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize(
+    "options",
+    ({"group_by": "module"}, {"frames": 0}, {"limit": "all"}),
+    ids=("bad-group-by", "bad-frames", "bad-limit"),
+)
+def test_invalid_memory_options(options):
+    """Test that the memory options are validated."""
+    with pytest.raises(ValueError):
+        MemoryAction(options, None)
+
+
+class CheckoutResource(object):
+    """A resource whose locals are snapshotted."""
+
+    def on_get(self, req, resp):  # pylint: disable=unused-argument
+        """Respond with the total of a few orders."""
+        resp.media = {"total": sum(self.price(quantity) for quantity in (1, 2, 3))}
+
+    @staticmethod
+    def price(quantity):
+        """Price an order."""
+        order = {"quantity": quantity, "items": [{"sku": "x" * 500}], "owner": object()}
+        total = order["quantity"] * 10
+        return total
+
+
+def snapshot_location():
+    """Return the location of the line returning the price."""
+    lines, first = inspect.getsourcelines(CheckoutResource.price)
+    offset = next(number for number, line in enumerate(lines) if "return total" in line)
+    return "tests/test_actions.py:{}".format(first + offset)
+
+
+def test_snapshot_report(tmpdir):
+    """Test that the locals and stack are captured at the line without pausing the request."""
+    app = falcon.API(middleware=[EPDBServe(backend=Base64Backend(), output_dir=str(tmpdir))])
+    app.add_route("/", CheckoutResource())
+    options = {"location": snapshot_location(), "condition": "quantity > 1", "depth": 2}
+    header = encode_header({"epdb": {"snapshot": options}})
+
+    result = testing.TestClient(app).simulate_get(headers={"X-EPDB": header})
+
+    assert result.json == {"total": 60}
+    path = result.headers["X-EPDB-Snapshot"]
+    assert os.path.dirname(path) == str(tmpdir)
+    with open(path) as report_file:
+        report = json.load(report_file)
+    assert report["errors"] == 0
+    (snapshot,) = report["snapshots"]
+    assert snapshot["locals"]["quantity"] == 2
+    assert snapshot["locals"]["total"] == 20
+    assert snapshot["locals"]["order"]["items"] == ["{'sku': '" + "x" * 191 + "..."]
+    assert snapshot["locals"]["order"]["owner"].startswith("<object object at ")
+    assert [frame["function"] for frame in snapshot["stack"][:3]] == [
+        "price",
+        "<genexpr>",
+        "on_get",
+    ]
+
+
+def test_snapshot_limit_and_thread():
+    """Test that only the request's thread is captured, up to the limit."""
+    action = SnapshotAction({"location": snapshot_location(), "limit": 2}, None)
+    other = threading.Thread(target=CheckoutResource.price, args=(9,))
+
+    action.start()
+    try:
+        other.start()
+        other.join()
+        for quantity in (1, 2, 3):
+            CheckoutResource.price(quantity)
+    finally:
+        action.stop()
+
+    assert [snapshot["locals"]["quantity"] for snapshot in action.snapshots] == [1, 2]
+
+
+def test_snapshot_condition_errors_are_counted():
+    """Test that a failing condition is counted rather than raised into the request."""
+    action = SnapshotAction({"location": snapshot_location(), "condition": "1 / 0"}, None)
+
+    action.start()
+    try:
+        assert CheckoutResource.price(1) == 10
+    finally:
+        action.stop()
+
+    assert json.loads(action.render())["errors"] == 1
+
+
+@pytest.mark.parametrize(
+    "options",
+    (
+        {},
+        {"location": "tests/test_actions.py"},
+        {"location": "tests/test_actions.py:1"},
+        {"location": "nowhere.py:10"},
+        {"location": "tests/test_actions.py:10", "condition": "quantity >"},
+    ),
+    ids=("no-location", "no-line", "no-code", "no-file", "bad-condition"),
+)
+def test_invalid_snapshot_options(options):
+    """Test that the snapshot options are validated, and the line must be in loaded code."""
+    with pytest.raises(ValueError):
+        SnapshotAction(options, None)
+
+
+@pytest.mark.parametrize(
+    "options",
+    (
+        pytest.param("cumtime", id="not-a-dict"),
+        pytest.param({"sort": "bogus"}, id="bad-sort"),
+        pytest.param({"output": "stdout"}, id="bad-output"),
+        pytest.param({"limit": "all"}, id="bad-limit"),
+    ),
+)
+def test_invalid_action_options(actions_client, mock_epdb_serve, options):
+    """Test that an action with bad options is logged, and neither run nor served."""
+    header = encode_header({"epdb": {"profile": options}})
+
+    with testfixtures.LogCapture() as logs:
+        result = actions_client.simulate_get(headers={"X-EPDB": header})
+
+    assert result.status_code == 200
+    assert result.json == {}
+    assert not mock_epdb_serve.called
+    logs.check_present(
+        ("falcon_epdb", "ERROR", "Attempted, but failed, to start the profile action")
+    )
+
+
+def test_action_failing_to_finish_is_not_fatal(actions_client, mocker):
+    """Test that a failure to report is logged, and does not fail the request."""
+    mocker.patch.object(ProfileAction, "render", side_effect=RuntimeError("Oops"))
+    header = encode_header({"epdb": {"profile": {}}})
+
+    with testfixtures.LogCapture() as logs:
+        result = actions_client.simulate_get(headers={"X-EPDB": header})
+
+    assert result.status_code == 200
+    logs.check_present(("falcon_epdb", "ERROR", "Failed to finish the profile action"))
+
+
+def test_unknown_keys_still_serve(actions_client, mock_epdb_serve):
+    """Test that a payload without a known action starts an interactive session."""
+    actions_client.simulate_get(headers={"X-EPDB": encode_header({"epdb": {"other": {}}})})
+
+    assert mock_epdb_serve.called
+
+
+def test_response_without_action_is_untouched(mocker):
+    """Test that other requests' responses are unaffected while an action is running."""
+    middleware = EPDBServe(backend=Base64Backend())
+    middleware._pending_responses = 1  # pylint: disable=protected-access
+    req, resp = mocker.Mock(context={}), mocker.Mock()
+
+    middleware.process_response(req, resp, None)
+
+    assert not resp.method_calls
+    assert middleware._pending_responses == 1  # pylint: disable=protected-access
@@ -0,0 +1,231 @@
+"""Tests for the ASGI middleware functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import asyncio
+from unittest import mock
+
+import pytest
+import testfixtures
+
+from falcon_epdb import Base64Backend, SessionManager, TriggerRules, timing
+from falcon_epdb.asgi import AsyncEPDBServe
+
+
+class FakeRequest(object):
+    """The subset of a Falcon ASGI request used by the middleware."""
+
+    # pylint: disable=too-few-public-methods
+
+    method = "GET"
+    path = "/"
+    remote_addr = "127.0.0.1"
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+        self.context = {}
+
+    def get_header(self, name):
+        """Return the named header, if present."""
+        return self.headers.get(name)
+
+
+@pytest.fixture
+def mock_accept_client(mocker):
+    """Mock the blocking wait for a client connection."""
+    return mocker.patch("falcon_epdb.accept_client", return_value=True)
+
+
+@pytest.fixture
+def mock_is_attached(mocker):
+    """Pretend that no client is attached yet."""
+    return mocker.patch("falcon_epdb.asgi.is_attached", return_value=False)
+
+
+def process_request(middleware, headers=None):
+    """Run the middleware's coroutine to completion, returning the mock response."""
+    resp = mock.Mock()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(middleware.process_request_async(FakeRequest(headers), resp))
+    finally:
+        loop.close()
+    return resp
+
+
+def test_no_header_has_no_effect(mock_epdb_serve, mock_accept_client):
+    """Test that we do nothing if the header is not present."""
+    process_request(AsyncEPDBServe(backend=Base64Backend()))
+
+    assert not mock_accept_client.called
+    assert not mock_epdb_serve.called
+
+
+def test_valid_header_waits_off_loop_then_serves(
+    base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached
+):
+    """Test that we wait for a client in the executor, then start the trace."""
+    # pylint: disable=unused-argument
+    middleware = AsyncEPDBServe(backend=Base64Backend(), serve_options={"port": 9000})
+
+    resp = process_request(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+
+    mock_accept_client.assert_called_once_with(port=9000)
+    mock_epdb_serve.assert_called_once_with(port=9000)
+    assert not resp.set_header.called
+
+
+def test_no_client_attached(base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached):
+    """Test that we do not start the trace if no client attached."""
+    # pylint: disable=unused-argument
+    mock_accept_client.return_value = False
+
+    process_request(
+        AsyncEPDBServe(backend=Base64Backend()), {"X-EPDB": "Base64 {}".format(base64_header)}
+    )
+
+    assert not mock_epdb_serve.called
+
+
+def test_accept_exception_is_not_fatal(
+    base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached
+):
+    """Test that we do not fail the request if waiting for the client fails."""
+    # pylint: disable=unused-argument
+    mock_accept_client.side_effect = RuntimeError("Oops")
+
+    with testfixtures.LogCapture() as logs:
+        process_request(
+            AsyncEPDBServe(backend=Base64Backend()), {"X-EPDB": "Base64 {}".format(base64_header)}
+        )
+
+    assert not mock_epdb_serve.called
+    logs.check_present(
+        (
+            "falcon_epdb",
+            "ERROR",
+            "Attempted, but failed, to serve epdb: Unexpected error when starting epdb server",
+        )
+    )
+
+
+def test_invalid_header_is_not_fatal(mock_epdb_serve, mock_accept_client):
+    """Test that an invalid header is logged and ignored."""
+    with testfixtures.LogCapture() as logs:
+        process_request(AsyncEPDBServe(backend=Base64Backend()), {"X-EPDB": "Invalid"})
+
+    assert not mock_accept_client.called
+    assert not mock_epdb_serve.called
+    logs.check_present(
+        (
+            "falcon_epdb",
+            "ERROR",
+            "Attempted, but failed, to serve epdb: Invalid X-EPDB value; must have two tokens",
+        )
+    )
+
+
+def test_non_blocking_arms_and_continues(base64_header, mock_epdb_serve, mock_is_attached, mocker):
+    """Test that the non-blocking mode arms the background listener instead of waiting."""
+    # pylint: disable=unused-argument
+    middleware = AsyncEPDBServe(backend=Base64Backend(), blocking=False)
+    start = mocker.patch.object(middleware.listener, "start")
+
+    process_request(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert start.called
+    assert not mock_epdb_serve.called
+
+
+def test_port_pool_exhausted(base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached):
+    """Test that we neither wait nor serve if there is no port for this worker."""
+    # pylint: disable=unused-argument
+    middleware = AsyncEPDBServe(backend=Base64Backend(), ports=[9000])
+    middleware.port_pool.claim = lambda: None
+
+    with testfixtures.LogCapture():
+        process_request(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert not mock_accept_client.called
+    assert not mock_epdb_serve.called
+
+
+def test_rules_trigger_without_header(mock_epdb_serve, mock_accept_client, mock_is_attached):
+    """Test that a request matching an armed rule is served without the header."""
+    # pylint: disable=unused-argument
+    rules = TriggerRules()
+    rules.arm("GET", "/")
+
+    process_request(AsyncEPDBServe(backend=Base64Backend(), rules=rules))
+    process_request(AsyncEPDBServe(backend=Base64Backend(), rules=rules))
+
+    assert mock_accept_client.call_count == 1
+    assert mock_epdb_serve.call_count == 1
+
+
+def test_busy_session_is_not_waited_for(
+    base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached
+):
+    """Test that a request is neither waited for nor served while another holds the session."""
+    # pylint: disable=unused-argument
+    ticket = SessionManager().admit("GET /other")
+    try:
+        resp = process_request(
+            AsyncEPDBServe(backend=Base64Backend(), sessions=SessionManager()),
+            {"X-EPDB": "Base64 {}".format(base64_header)},
+        )
+    finally:
+        ticket.finish()
+
+    resp.set_header.assert_called_once_with("X-EPDB-Busy", "1")
+    assert not mock_accept_client.called
+    assert not mock_epdb_serve.called
+
+
+def test_busy_session_rejects_request(
+    base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached
+):
+    """Test that a request is failed with a 503 while another holds the session, if configured."""
+    # pylint: disable=unused-argument
+    falcon = pytest.importorskip("falcon")
+    ticket = SessionManager().admit("GET /other")
+    try:
+        with pytest.raises(falcon.HTTPServiceUnavailable) as excinfo:
+            process_request(
+                AsyncEPDBServe(
+                    backend=Base64Backend(), sessions=SessionManager(when_busy="reject")
+                ),
+                {"X-EPDB": "Base64 {}".format(base64_header)},
+            )
+    finally:
+        ticket.finish()
+
+    assert excinfo.value.headers["X-EPDB-Busy"] == "1"
+    assert not mock_accept_client.called
+    assert not mock_epdb_serve.called
+
+
+def test_server_timing_counts_request_pauses(
+    base64_header, mock_epdb_serve, mock_accept_client, mock_is_attached, epdb_hooks, mocker
+):
+    """Test that only the request's own pauses are reported, though decoded in the executor."""
+    # pylint: disable=unused-argument,protected-access,too-many-arguments
+    mocker.patch.object(timing._paused, "total", 5.0, create=True)
+
+    def serve(**kwargs):
+        timing._paused.total += 2.0
+
+    mock_epdb_serve.side_effect = serve
+    middleware = AsyncEPDBServe(backend=Base64Backend(), server_timing=True)
+    req = FakeRequest({"X-EPDB": "Base64 {}".format(base64_header)})
+    resp = mock.Mock()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(middleware.process_request_async(req, resp))
+        loop.run_until_complete(middleware.process_response_async(req, resp, None, True))
+    finally:
+        loop.close()
+
+    assert mock_epdb_serve.called
+    header_value = resp.append_header.call_args[0][1]
+    assert header_value.endswith(", epdb-paused;dur=2000.000")
@@ -0,0 +1,110 @@
+"""Tests for the non-blocking attach functionality"""
+# pylint: disable=protected-access,redefined-outer-name
+
+import epdb
+import pytest
+
+from falcon_epdb import Base64Backend, EPDBServe
+from falcon_epdb.attach import BackgroundListener
+
+
+@pytest.fixture
+def mock_server_class(mocker):
+    """Mock the epdb telnet server."""
+    return mocker.patch("epdb.epdb_server.InvertedTelnetServer")
+
+
+@pytest.fixture
+def detached(monkeypatch):
+    """Ensure that no epdb client appears to be attached, and clean up if one does."""
+    monkeypatch.setattr(epdb.Epdb, "_server", None)
+    monkeypatch.setattr(epdb.Epdb, "_port", None, raising=False)
+
+
+def test_listener_hands_connection_to_epdb(mock_server_class, detached):
+    """Test that an accepted connection is handed over to epdb."""
+    # pylint: disable=unused-argument
+    server = mock_server_class.return_value
+    server.closed = False
+    listener = BackgroundListener(timeout=5)
+
+    assert listener.start(port=9000)
+    listener._thread.join()
+
+    mock_server_class.assert_called_once_with(("", 9000))
+    server.socket.settimeout.assert_called_once_with(5)
+    assert epdb.Epdb._server is server
+    assert epdb.Epdb._port == 9000
+    assert not listener.listening
+
+
+def test_listener_gives_up_after_timeout(mock_server_class, detached):
+    """Test that the port is released if no client attaches."""
+    # pylint: disable=unused-argument
+    server = mock_server_class.return_value
+    server.closed = True
+    listener = BackgroundListener(timeout=5)
+
+    listener.start(port=9000)
+    listener._thread.join()
+
+    assert server.server_close.called
+    assert epdb.Epdb._server is None
+
+
+def test_listener_calls_on_finish(mock_server_class, detached):
+    """Test that the listener reports when it stops waiting."""
+    # pylint: disable=unused-argument
+    mock_server_class.return_value.closed = True
+    on_finish = []
+    listener = BackgroundListener()
+
+    listener.start(port=9000, on_finish=lambda: on_finish.append(True))
+    listener._thread.join()
+
+    assert on_finish == [True]
+
+
+def test_listener_only_starts_once(mock_server_class, mocker):
+    """Test that a second listener is not started while the first is waiting."""
+    listener = BackgroundListener()
+    mocker.patch.object(BackgroundListener, "listening", True)
+
+    assert not listener.start()
+    assert not mock_server_class.called
+
+
+def test_non_blocking_middleware_arms_and_continues(
+    make_client, base64_header, mock_epdb_serve, detached, mocker
+):
+    """Test that the first valid header starts listening without blocking the request."""
+    # pylint: disable=unused-argument
+    middleware = EPDBServe(backend=Base64Backend(), serve_options={"port": 9000}, blocking=False)
+    client = make_client(middleware)
+    start = mocker.patch.object(middleware.listener, "start")
+    headers = {"X-EPDB": "Base64 {}".format(base64_header)}
+
+    first = client.simulate_get(headers=headers)
+    mocker.patch.object(BackgroundListener, "listening", True)
+    second = client.simulate_get(headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert "X-EPDB-Port" not in first.headers
+    start.assert_called_once_with(port=9000, on_finish=None)
+    assert middleware.listener.timeout == 300
+    assert not mock_epdb_serve.called
+
+
+def test_non_blocking_middleware_serves_once_attached(
+    make_client, base64_header, mock_epdb_serve, monkeypatch, mocker
+):
+    """Test that a valid header drops into the session once a client has attached."""
+    middleware = EPDBServe(backend=Base64Backend(), serve_options={"port": 9000}, blocking=False)
+    client = make_client(middleware)
+    start = mocker.patch.object(middleware.listener, "start")
+    monkeypatch.setattr(epdb.Epdb, "_server", object())
+
+    client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert not start.called
+    mock_epdb_serve.assert_called_once_with(port=9000)
@@ -21,6 +21,8 @@ def test_base64_client_activates_epdb_port(base64_client, base64_header, mock_ep
             "Base64 {} extra", "Invalid X-EPDB value; must have two tokens", id="too-many-tokens"
         ),
         pytest.param("Base32 {}", "Invalid X-EPDB value; scheme must be Base64", id="need-base64"),
+        pytest.param("Base64 {}A", "Invalid X-EPDB value; malformed payload", id="not-base64"),
+        pytest.param("Base64 AAAA{}", "Invalid X-EPDB value; malformed payload", id="not-json"),
     ),
 )
 def test_base64_invalid_header_value(
@@ -0,0 +1,67 @@
+"""Tests for the HeaderCache functionality"""
+
+import pytest
+
+from falcon_epdb import HeaderCache
+
+
+def test_cache_returns_stored_value():
+    """Test that a stored value is returned for the same header."""
+    cache = HeaderCache()
+    cache.set("Fernet abc", {"one": 1})
+
+    assert cache.get("Fernet abc") == {"one": 1}
+    assert cache.get("Fernet xyz") is None
+
+
+def test_cache_evicts_least_recently_used():
+    """Test that the least recently used entry is evicted when the cache is full."""
+    cache = HeaderCache(maxsize=2)
+    cache.set("a", {"a": 1})
+    cache.set("b", {"b": 1})
+    cache.get("a")
+    cache.set("c", {"c": 1})
+
+    assert len(cache) == 2
+    assert cache.get("a") == {"a": 1}
+    assert cache.get("b") is None
+    assert cache.get("c") == {"c": 1}
+
+
+def test_cache_respects_its_own_ttl(mocker):
+    """Test that entries expire once the cache's ttl has elapsed."""
+    mock_time = mocker.patch("falcon_epdb.cache.time.time", return_value=1000.0)
+    cache = HeaderCache(ttl=10)
+    cache.set("a", {"a": 1})
+
+    mock_time.return_value = 1009.0
+    assert cache.get("a") == {"a": 1}
+
+    mock_time.return_value = 1010.0
+    assert cache.get("a") is None
+    assert not cache
+
+
+def test_cache_respects_token_expiry(mocker):
+    """Test that entries expire with their token, if that is sooner than the ttl."""
+    mock_time = mocker.patch("falcon_epdb.cache.time.time", return_value=1000.0)
+    cache = HeaderCache(ttl=10)
+    cache.set("a", {"a": 1}, expires=1005.0)
+
+    mock_time.return_value = 1005.0
+    assert cache.get("a") is None
+
+
+def test_cache_clear():
+    """Test that clearing the cache drops every entry."""
+    cache = HeaderCache()
+    cache.set("a", {"a": 1})
+    cache.clear()
+
+    assert cache.get("a") is None
+
+
+def test_cache_requires_positive_maxsize():
+    """Test that an unusable cache size is rejected."""
+    with pytest.raises(ValueError):
+        HeaderCache(maxsize=0)
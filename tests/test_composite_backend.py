@@ -0,0 +1,158 @@
+"""Tests for the CompositeBackend functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import pytest
+import testfixtures
+
+from falcon_epdb import (
+    Base64Backend,
+    CompositeBackend,
+    EPDBBackend,
+    EPDBException,
+    EPDBServe,
+    FernetBackend,
+    HeaderCache,
+    JWTBackend,
+)
+
+pytest.importorskip("cryptography")
+pytest.importorskip("jwt")
+
+
+class SchemelessBackend(Base64Backend):
+    """A backend without a scheme."""
+
+    scheme = None
+
+
+class PlainBackend(EPDBBackend):
+    """A backend implementing only decode_header_value, returning the header it was given."""
+
+    scheme = "Plain"
+
+    def decode_header_value(self, epdb_header):
+        """Return the header."""
+        return {"epdb": {"header": epdb_header}}
+
+
+@pytest.fixture
+def backend(fernet_key, jwt_key):
+    """Provide a backend accepting every built-in scheme."""
+    return CompositeBackend(
+        [Base64Backend(), FernetBackend(key=fernet_key, cache=HeaderCache()), JWTBackend(jwt_key)]
+    )
+
+
+@pytest.fixture
+def headers(base64_header, fernet_header, jwt_header):
+    """Provide a valid header value for each scheme."""
+    return {
+        "Base64": "Base64 {}".format(base64_header),
+        "Fernet": "Fernet {}".format(fernet_header),
+        "JWT": "JWT {}".format(jwt_header),
+    }
+
+
+def test_every_scheme_activates_epdb(make_client, backend, headers, mock_epdb_serve):
+    """Test that one middleware serves headers of every registered scheme."""
+    client = make_client(EPDBServe(backend=backend, serve_options={"port": 9000}))
+
+    for header in headers.values():
+        result = client.simulate_get(headers={"X-EPDB": header})
+        assert result.status_code == 200
+
+    assert mock_epdb_serve.call_count == 3
+    assert backend.failures == {}
+
+
+def test_header_is_split_once(backend, headers, mocker):
+    """Test that the payload goes straight to the backend for its scheme."""
+    fernet_backend = backend.backends["Fernet"]
+    decode_header_value = mocker.spy(fernet_backend, "decode_header_value")
+    decode_payload = mocker.spy(fernet_backend, "decode_payload")
+    req = mocker.Mock(get_header=mocker.Mock(return_value=headers["Fernet"]))
+
+    assert backend.get_header_data(req) == {}
+    assert backend.get_header_data(req) == {}
+
+    assert not decode_header_value.called
+    assert decode_payload.call_count == 1
+    assert backend.decode_header_value(headers["JWT"]) == {"epdb": {}}
+
+
+@pytest.mark.parametrize(
+    "header, error_msg, scheme",
+    (
+        pytest.param("Base64", "must have two tokens", "Base64", id="too-few-tokens"),
+        pytest.param("JWT " + "x" * 8192, "too long", "JWT", id="too-long"),
+        pytest.param("Base64x " + "x" * 8192, "too long", None, id="too-long-unknown-scheme"),
+        pytest.param("Grigio", "must have two tokens", None, id="unknown-scheme-no-payload"),
+        pytest.param("Grigio abc", "unknown scheme", None, id="unknown-scheme"),
+        pytest.param("Fernet abc", "invalid or expired token", "Fernet", id="bad-token"),
+        pytest.param("Base64 e30=", 'must contain key named "epdb"', "Base64", id="bad-content"),
+    ),
+)
+def test_rejected_headers_are_counted(make_client, backend, header, error_msg, scheme):
+    """Test that rejected headers are logged and counted by scheme."""
+    client = make_client(EPDBServe(backend=backend))
+
+    with testfixtures.LogCapture() as logs:
+        client.simulate_get(headers={"X-EPDB": header})
+
+    assert error_msg in logs.records[-1].getMessage()
+    assert backend.failures == {scheme: 1}
+
+
+def test_schemes_can_be_disabled(fernet_key, headers, mocker):
+    """Test that a disabled scheme is rejected until it is enabled."""
+    backend = CompositeBackend(
+        {"Base64": Base64Backend(), "Fernet": FernetBackend(fernet_key)}, disabled=["Base64"]
+    )
+    req = mocker.Mock(get_header=mocker.Mock(return_value=headers["Base64"]))
+
+    assert not backend.is_enabled("Base64")
+    with pytest.raises(EPDBException):
+        backend.get_header_data(req)
+
+    backend.enable("Base64")
+    assert backend.get_header_data(req) == {}
+
+    backend.disable("Fernet")
+    with pytest.raises(EPDBException):
+        backend.decode_header_value(headers["Fernet"])
+    with pytest.raises(KeyError):
+        backend.disable("JWT")
+    assert backend.failures == {"Base64": 1, "Fernet": 1}
+
+
+@pytest.mark.parametrize(
+    "backends, disabled",
+    (
+        pytest.param(lambda key: [Base64Backend(), Base64Backend()], (), id="duplicate-scheme"),
+        pytest.param(lambda key: [SchemelessBackend()], (), id="no-scheme"),
+        pytest.param(lambda key: [FernetBackend(key)], ("JWT",), id="unknown-disabled"),
+    ),
+)
+def test_invalid_registrations(fernet_key, backends, disabled):
+    """Test that each backend must be registered under a distinct, known scheme."""
+    with pytest.raises(ValueError):
+        CompositeBackend(backends(fernet_key), disabled=disabled)
+
+
+def test_expiry_comes_from_the_scheme_backend(fernet_key, headers, fernet, fernet_header):
+    """Test that the expiry of cached values is the one the scheme's backend reports."""
+    backend = CompositeBackend([FernetBackend(fernet_key, ttl=60), Base64Backend()])
+
+    expiry = backend.get_header_expiry(headers["Fernet"], {"epdb": {}})
+
+    assert expiry == fernet.extract_timestamp(fernet_header.encode()) + 60
+    assert backend.get_header_expiry(headers["Base64"], {"epdb": {}}) is None
+
+
+def test_default_decode_payload_rejoins_the_header(mocker):
+    """Test that a backend without its own decode_payload is given the whole header."""
+    backend = CompositeBackend([PlainBackend()])
+    req = mocker.Mock(get_header=mocker.Mock(return_value="Plain abc"))
+
+    assert backend.get_header_data(req) == {"header": "Plain abc"}
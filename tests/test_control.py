@@ -0,0 +1,136 @@
+"""Tests for the ArmSwitch functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import os
+import time
+
+import pytest
+import testfixtures
+
+from falcon_epdb import ArmSwitch, Base64Backend, EPDBServe
+from falcon_epdb.registry import main
+
+
+@pytest.fixture
+def switch(tmpdir):
+    """Provide a switch, with a state file in a temporary directory, stopped after the test."""
+    switch = ArmSwitch(str(tmpdir.join("control.json")), poll_interval=3600)
+    yield switch
+    switch.stop()
+
+
+@pytest.fixture
+def armed_token(base64_header):
+    """Provide an arm command token accepted by the Base64 backend."""
+    return "Base64 {}".format(base64_header)
+
+
+def test_disarmed_middleware_is_inert(make_client, switch, armed_token, mock_epdb_serve, mocker):
+    """Test that nothing is done with the header until the switch is armed."""
+    backend = Base64Backend()
+    client = make_client(EPDBServe(backend=backend, control=switch))
+    mock_get_header_data = mocker.spy(backend, "get_header_data")
+
+    client.simulate_get(headers={"X-EPDB": armed_token})
+    assert not mock_get_header_data.called
+    assert not mock_epdb_serve.called
+
+    switch.arm(armed_token, ttl=60)
+    switch.refresh()
+    client.simulate_get(headers={"X-EPDB": armed_token})
+    assert mock_epdb_serve.called
+
+    switch.disarm()
+    switch.disarm()
+    switch.refresh()
+    assert not switch.armed
+
+
+def test_arming_is_time_limited(switch, armed_token, mocker):
+    """Test that the switch disarms itself once the command's time limit has passed."""
+    switch.start(Base64Backend())
+    switch.arm(armed_token, ttl=60)
+
+    switch.refresh()
+    assert switch.armed
+    assert switch.armed_until == pytest.approx(time.time() + 60, abs=5)
+
+    mocker.patch("falcon_epdb.control.time.time", return_value=time.time() + 61)
+    switch.refresh()
+    assert not switch.armed
+    assert switch.armed_until is None
+
+
+def test_arming_is_limited_by_token_expiry(switch, armed_token, mocker):
+    """Test that a token's own expiry limits the arming."""
+    backend = Base64Backend()
+    mocker.patch.object(backend, "get_header_expiry", return_value=time.time() - 1)
+    switch.start(backend)
+
+    switch.arm(armed_token, ttl=60)
+    switch.refresh()
+
+    assert not switch.armed
+
+
+def test_invalid_arm_command(switch):
+    """Test that a command the backend does not accept is ignored."""
+    switch.start(Base64Backend())
+
+    with testfixtures.LogCapture() as logs:
+        switch.arm("Base64 not-a-token", ttl=60)
+        switch.refresh()
+        switch.refresh()
+
+    assert not switch.armed
+    logs.check(
+        (
+            "falcon_epdb.control",
+            "ERROR",
+            "Ignoring an invalid epdb arm command in {}".format(switch.path),
+        )
+    )
+
+
+def test_command_is_authenticated_once(switch, armed_token, mocker):
+    """Test that an unchanged command is not authenticated again on each check."""
+    backend = Base64Backend()
+    mock_decode = mocker.spy(backend, "decode_header_value")
+    switch.start(backend)
+
+    switch.arm(armed_token, ttl=60)
+    for _ in range(3):
+        switch.refresh()
+
+    assert switch.armed
+    assert mock_decode.call_count == 1
+
+
+def test_background_thread_picks_up_commands(tmpdir, armed_token):
+    """Test that the switch notices an arm command without being refreshed explicitly."""
+    switch = ArmSwitch(str(tmpdir.join("control.json")), poll_interval=0.01)
+    switch.start(Base64Backend())
+    try:
+        switch.arm(armed_token, ttl=60)
+        deadline = time.time() + 5
+        while not switch.armed and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        switch.stop()
+
+    assert switch.armed
+
+
+def test_console_script(tmpdir, armed_token):
+    """Test that the console script writes and removes the arm command."""
+    path = str(tmpdir.join("control.json"))
+
+    assert main(["arm", "--control", path, "--token", armed_token, "--ttl", "30"]) == 0
+    switch = ArmSwitch(path)
+    switch.start(Base64Backend())
+    switch.stop()
+    assert switch.armed
+
+    assert main(["disarm", "--control", path]) == 0
+    assert not os.path.exists(path)
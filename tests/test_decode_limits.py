@@ -0,0 +1,130 @@
+"""Tests for the limits and JSON hook shared by the backends' decoding"""
+
+import base64
+import json
+
+import pytest
+import testfixtures
+
+from falcon_epdb import (
+    Base64Backend,
+    EPDBException,
+    EPDBServe,
+    FernetBackend,
+    HeaderCache,
+    JWTBackend,
+)
+
+
+def base64_value(content):
+    """Return a Base64 header value carrying the JSON text."""
+    return "Base64 {}".format(base64.b64encode(content.encode()).decode())
+
+
+def nested(depth):
+    """Return JSON text for a header payload nesting objects to the given depth."""
+    return '{"epdb": ' * depth + "{}" + "}" * depth
+
+
+def test_long_header_is_rejected_before_decoding(make_client, mock_epdb_serve, mocker):
+    """Test that a header over the length limit is neither decoded nor cached."""
+    backend = Base64Backend()
+    backend.cache = HeaderCache()
+    decode_payload = mocker.spy(backend, "decode_payload")
+    client = make_client(EPDBServe(backend=backend))
+    header = base64_value(json.dumps({"epdb": {}, "junk": "x" * 8192}))
+
+    with testfixtures.LogCapture() as logs:
+        result = client.simulate_get(headers={"X-EPDB": header})
+
+    assert result.status_code == 200
+    assert not mock_epdb_serve.called
+    assert not decode_payload.called
+    logs.check_present(
+        (
+            "falcon_epdb",
+            "ERROR",
+            "Attempted, but failed, to serve epdb: Invalid X-EPDB value; too long",
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "content, error_msg",
+    (
+        pytest.param(json.dumps({"epdb": {}, "junk": "x" * 4096}), "payload too large", id="size"),
+        pytest.param(nested(17), "payload nested too deeply", id="depth"),
+        pytest.param('{"epdb": {}', "malformed payload", id="malformed"),
+    ),
+)
+def test_payloads_beyond_the_limits_are_rejected(content, error_msg):
+    """Test that payloads beyond the limits are rejected before being parsed."""
+    backend = Base64Backend()
+
+    with pytest.raises(EPDBException) as excinfo:
+        backend.decode_header_value(base64_value(content))
+
+    assert error_msg in str(excinfo.value)
+
+
+def test_limits_can_be_changed():
+    """Test that the limits are attributes which may be raised, or removed."""
+    backend = Base64Backend()
+    backend.max_depth = None
+    backend.max_header_length = None
+    backend.max_payload_size = None
+
+    with pytest.raises(RuntimeError):  # Python's recursion limit
+        backend.decode_header_value(base64_value(nested(100000)))
+
+    backend.max_depth = 20
+    assert backend.decode_header_value(base64_value(nested(19)))["epdb"]
+
+
+def test_brackets_in_strings_are_not_nesting():
+    """Test that brackets within JSON strings do not count towards the depth."""
+    backend = Base64Backend()
+    content = json.dumps({"epdb": {"note": "[{" * 100, "quoted": '"}}\\"[['}})
+
+    assert backend.decode_header_value(base64_value(content))["epdb"]["note"] == "[{" * 100
+
+
+def test_json_decoder_can_be_replaced(base64_header, mocker):
+    """Test that the payload is parsed by the backend's json_loads."""
+    backend = Base64Backend()
+    backend.json_loads = mocker.Mock(return_value={"epdb": {"decoder": "fast"}})
+
+    assert backend.decode_header_value("Base64 {}".format(base64_header)) == {
+        "epdb": {"decoder": "fast"}
+    }
+    backend.json_loads.assert_called_once_with('{"epdb": {}}')
+
+
+def test_fernet_payloads_are_limited(fernet_key):
+    """Test that the decrypted payload of a Fernet token is checked against the limits."""
+    fernet = pytest.importorskip("cryptography.fernet").Fernet(fernet_key)
+    backend = FernetBackend(fernet_key)
+    token = fernet.encrypt(nested(17).encode()).decode()
+
+    with pytest.raises(EPDBException) as excinfo:
+        backend.decode_header_value("Fernet {}".format(token))
+
+    assert "nested too deeply" in str(excinfo.value)
+
+
+def test_jwt_claims_are_limited_before_verification(jwt_key, mocker):
+    """Test that JWT claims beyond the limits are rejected without verifying the token."""
+    jwt = pytest.importorskip("jwt")
+    backend = JWTBackend(jwt_key)
+    decode = mocker.spy(jwt, "decode")
+    large = jwt.encode({"epdb": {}, "junk": "x" * 4096}, jwt_key)
+    deep = jwt.encode(json.loads(nested(17)), jwt_key)
+
+    for token, error_msg in ((large, "payload too large"), (deep, "nested too deeply")):
+        if isinstance(token, bytes):
+            token = token.decode()
+        with pytest.raises(EPDBException) as excinfo:
+            backend.decode_header_value("JWT {}".format(token))
+        assert error_msg in str(excinfo.value)
+
+    assert not decode.called
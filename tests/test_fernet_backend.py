@@ -1,15 +1,19 @@
 """Tests for the FernetBackend functionality"""
 
+import json
+import sys
+import time
+
 import pytest
 import testfixtures
 
-from falcon_epdb import FernetBackend
-
+from falcon_epdb import EPDBException, EPDBServe, FernetBackend, HeaderCache
 
 try:
     # Only run if cryptography is installed
     # pylint: disable=unused-import
     import cryptography  # NoQA
+    from cryptography.fernet import Fernet
 
     def test_fernet_client_activates_epdb_port(fernet_client, fernet_header, mock_epdb_serve):
         """Test that we start the server when an appropriate header is received."""
@@ -22,7 +26,7 @@ try:
     def test_fernet_raises_import_error_if_not_installed(monkeypatch):
         """Expect an import error if we attempt to use this backend without cryptography."""
         with monkeypatch.context() as context:
-            context.delattr("falcon_epdb.fernet")
+            context.setitem(sys.modules, "cryptography.fernet", None)
             with pytest.raises(ImportError):
                 FernetBackend("some key")
 
@@ -64,6 +68,148 @@ try:
             )
         )
 
+    def test_fernet_invalid_header_bad_signature(fernet_client, mock_epdb_serve):
+        """Test that a token encrypted with a different key is rejected."""
+        other_header = Fernet(Fernet.generate_key()).encrypt(b'{"epdb": {}}').decode()
+
+        with testfixtures.LogCapture() as logs:
+            result = fernet_client.simulate_get(
+                headers={"X-EPDB": "Fernet {}".format(other_header)}
+            )
+
+        assert result.status_code == 200
+        assert not mock_epdb_serve.called
+        logs.check_present(
+            (
+                "falcon_epdb",
+                "ERROR",
+                "Attempted, but failed, to serve epdb: Invalid X-EPDB value;"
+                " invalid or expired token",
+            )
+        )
+
+    def test_fernet_invalid_header_not_json(fernet, fernet_client, mock_epdb_serve):
+        """Test that a correctly encrypted payload that is not JSON is rejected."""
+        header = fernet.encrypt(b"not json").decode()
+
+        with testfixtures.LogCapture() as logs:
+            fernet_client.simulate_get(headers={"X-EPDB": "Fernet {}".format(header)})
+
+        assert not mock_epdb_serve.called
+        logs.check_present(
+            (
+                "falcon_epdb",
+                "ERROR",
+                "Attempted, but failed, to serve epdb: Invalid X-EPDB value; malformed payload",
+            )
+        )
+
+    def test_fernet_rejects_expired_token(fernet, fernet_key, make_client, mock_epdb_serve):
+        """Test that a token older than the configured ttl is not accepted."""
+        client = make_client(EPDBServe(backend=FernetBackend(key=fernet_key, ttl=60)))
+        header = fernet.encrypt_at_time(json.dumps({"epdb": {}}).encode(), int(time.time()) - 61)
+
+        with testfixtures.LogCapture():
+            result = client.simulate_get(headers={"X-EPDB": "Fernet {}".format(header.decode())})
+
+        assert result.status_code == 200
+        assert not mock_epdb_serve.called
+
+    def test_fernet_cache_skips_decryption(
+        fernet_key, fernet_header, make_client, mock_epdb_serve, mocker
+    ):
+        """Test that a recently accepted header is not decrypted again."""
+        backend = FernetBackend(key=fernet_key, ttl=60, cache=HeaderCache())
+        client = make_client(EPDBServe(backend=backend))
+        decode_header_value = mocker.spy(backend, "decode_header_value")
+
+        headers = {"X-EPDB": "Fernet {}".format(fernet_header)}
+        client.simulate_get(headers=headers)
+        client.simulate_get(headers=headers)
+
+        assert mock_epdb_serve.call_count == 2
+        assert decode_header_value.call_count == 1
+        assert len(backend.cache) == 1
+
+    def test_fernet_cache_entry_expires_with_token(fernet, fernet_key, fernet_header):
+        """Test that cached entries do not outlive the token's ttl."""
+        backend = FernetBackend(key=fernet_key, ttl=60)
+        payload = fernet_header.encode()
+
+        expiry = backend.get_header_expiry("Fernet {}".format(fernet_header), {"epdb": {}})
+
+        assert expiry == fernet.extract_timestamp(payload) + 60
+        assert FernetBackend(key=fernet_key).get_header_expiry(fernet_header, {}) is None
+
+    def test_fernet_accepts_any_listed_key(fernet, fernet_key, fernet_header):
+        """Test that tokens encrypted with any of the keys are accepted, within the ttl."""
+        new_key = Fernet.generate_key()
+        backend = FernetBackend(key=[new_key, fernet_key], ttl=60)
+        new_header = Fernet(new_key).encrypt(json.dumps({"epdb": {}}).encode()).decode()
+        stale_header = fernet.encrypt_at_time(b'{"epdb": {}}', int(time.time()) - 61).decode()
+        stranger = Fernet(Fernet.generate_key()).encrypt(b'{"epdb": {}}').decode()
+
+        for header in (new_header, fernet_header):
+            assert backend.decode_header_value("Fernet {}".format(header)) == {"epdb": {}}
+        for header in (stale_header, stranger):
+            with pytest.raises(EPDBException):
+                backend.decode_header_value("Fernet {}".format(header))
+        expiry = backend.get_header_expiry("Fernet {}".format(fernet_header), {"epdb": {}})
+        assert expiry == fernet.extract_timestamp(fernet_header.encode()) + 60
+
+    def test_fernet_set_keys_swaps_keys(fernet_key, fernet_header, mocker):
+        """Test that replacing the keys stops the old ones being accepted, even from the cache."""
+        backend = FernetBackend(key=fernet_key, cache=HeaderCache())
+        req = mocker.Mock(get_header=mocker.Mock(return_value="Fernet {}".format(fernet_header)))
+        assert backend.get_header_data(req) == {}
+
+        backend.set_keys([Fernet.generate_key()])
+
+        assert len(backend.cache) == 0
+        with pytest.raises(EPDBException):
+            backend.get_header_data(req)
+        with pytest.raises(ValueError):
+            backend.set_keys([])
+        with pytest.raises(ValueError):
+            FernetBackend()
+
+    def test_fernet_reloads_key_file(tmpdir, fernet_key, fernet_header):
+        """Test that the keys are reloaded from a file, and a broken file keeps the current keys."""
+        new_key = Fernet.generate_key()
+        new_header = "Fernet {}".format(Fernet(new_key).encrypt(b'{"epdb": {}}').decode())
+        path = tmpdir.join("fernet-keys")
+        path.write_binary(b"# Newest first\n" + fernet_key + b"\n")
+        backend = FernetBackend(key_source=str(path), reload_interval=3600)
+        try:
+            path.write_binary(new_key + b"\n\n" + fernet_key + b"\n")
+            with testfixtures.LogCapture() as logs:
+                backend.refresh()
+                backend.refresh()
+            logs.check(("falcon_epdb", "INFO", "Loaded 2 fernet keys"))
+            assert backend.decode_header_value(new_header) == {"epdb": {}}
+            assert backend.decode_header_value("Fernet {}".format(fernet_header)) == {"epdb": {}}
+
+            path.write_binary(b"not-a-key\n")
+            with testfixtures.LogCapture():
+                backend.refresh()
+            assert backend.decode_header_value(new_header) == {"epdb": {}}
+        finally:
+            backend.stop()
+
+    def test_fernet_reloads_keys_from_callback(fernet_key, fernet_header):
+        """Test that the keys may be supplied by a callable."""
+        keys = [Fernet.generate_key()]
+        backend = FernetBackend(key_source=lambda: keys, reload_interval=3600)
+        try:
+            with pytest.raises(EPDBException):
+                backend.decode_header_value("Fernet {}".format(fernet_header))
+
+            keys.append(fernet_key)
+            backend.refresh()
+
+            assert backend.decode_header_value("Fernet {}".format(fernet_header)) == {"epdb": {}}
+        finally:
+            backend.stop()
 
 except ImportError:
     pass
@@ -0,0 +1,267 @@
+"""Tests for the JWKSBackend functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import base64
+import json
+
+import pytest
+import testfixtures
+
+from falcon_epdb import EPDBException, EPDBServe, HeaderCache, JWKSBackend, KeySet
+
+jwt = pytest.importorskip("jwt")
+pytest.importorskip("cryptography")
+
+# pylint: disable=wrong-import-position,wrong-import-order
+from cryptography.hazmat.backends import default_backend  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, rsa  # noqa: E402
+
+PAYLOAD = {"epdb": {}}
+
+
+def encode_int(value):
+    """Encode an integer as unpadded base64url, as in a JWK."""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def rsa_jwk(private_key, kid):
+    """Return the JWK of an RSA key's public half."""
+    numbers = private_key.public_key().public_numbers()
+    return {"kty": "RSA", "kid": kid, "n": encode_int(numbers.n), "e": encode_int(numbers.e)}
+
+
+def ec_jwk(private_key, kid):
+    """Return the JWK of a P-256 key's public half."""
+    numbers = private_key.public_key().public_numbers()
+    return {
+        "kty": "EC",
+        "crv": "P-256",
+        "kid": kid,
+        "x": encode_int(numbers.x),
+        "y": encode_int(numbers.y),
+    }
+
+
+def sign(payload, key, algorithm, kid=None):
+    """Return an X-EPDB header value for a token signed with the key."""
+    headers = {"kid": kid} if kid is not None else None
+    token = jwt.encode(payload, key, algorithm=algorithm, headers=headers)
+    if isinstance(token, bytes):
+        token = token.decode()
+    return "JWT {}".format(token)
+
+
+@pytest.fixture(scope="module")
+def rsa_key():
+    """Provide an RSA private key."""
+    return rsa.generate_private_key(65537, 2048, default_backend())
+
+
+@pytest.fixture(scope="module")
+def ec_key():
+    """Provide a P-256 private key."""
+    return ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+
+@pytest.fixture
+def keyset(rsa_key, ec_key):
+    """Provide a key set with an RSA and an EC key."""
+    return {"keys": [rsa_jwk(rsa_key, "rsa-1"), ec_jwk(ec_key, "ec-1")]}
+
+
+def test_asymmetric_tokens_are_verified(make_client, keyset, rsa_key, ec_key, mock_epdb_serve):
+    """Test that tokens signed by any key in the set start the server."""
+    client = make_client(EPDBServe(backend=JWKSBackend(keyset), serve_options={"port": 9000}))
+
+    for header in (
+        sign(PAYLOAD, rsa_key, "RS256", "rsa-1"),
+        sign(PAYLOAD, ec_key, "ES256", "ec-1"),
+    ):
+        result = client.simulate_get(headers={"X-EPDB": header})
+        assert result.status_code == 200
+
+    assert mock_epdb_serve.call_count == 2
+
+
+def test_keys_are_parsed_once(keyset, rsa_key, mocker):
+    """Test that verifying a token does not parse the key again."""
+    backend = JWKSBackend(keyset)
+    mock_parse_jwk = mocker.patch("falcon_epdb.keysets.parse_jwk")
+
+    for _ in range(3):
+        assert backend.decode_header_value(sign(PAYLOAD, rsa_key, "RS256", "rsa-1")) == PAYLOAD
+
+    assert not mock_parse_jwk.called
+
+
+@pytest.mark.parametrize(
+    "token, message",
+    (
+        pytest.param(
+            lambda rsa_key, ec_key: sign(PAYLOAD, rsa_key, "RS256", "rsa-2"),
+            "unknown key",
+            id="unknown-kid",
+        ),
+        pytest.param(
+            lambda rsa_key, ec_key: sign(PAYLOAD, rsa_key, "RS256"), "unknown key", id="no-kid"
+        ),
+        pytest.param(
+            lambda rsa_key, ec_key: sign(PAYLOAD, ec_key, "ES256", "rsa-1"),
+            "algorithm not allowed",
+            id="wrong-key-type",
+        ),
+        pytest.param(
+            lambda rsa_key, ec_key: sign(PAYLOAD, "secret", "HS256", "rsa-1"),
+            "algorithm not allowed",
+            id="symmetric",
+        ),
+        pytest.param(
+            lambda rsa_key, ec_key: sign(PAYLOAD, rsa_key, "PS256", "rsa-1"),
+            "algorithm not allowed",
+            id="restricted",
+        ),
+        pytest.param(lambda rsa_key, ec_key: "JWT not-a-token", "invalid token", id="malformed"),
+    ),
+)
+def test_invalid_tokens_are_rejected(keyset, rsa_key, ec_key, token, message):
+    """Test that tokens not signed by a suitable key in the set are rejected."""
+    backend = JWKSBackend(keyset, algorithms=["RS256", "ES256"])
+
+    with pytest.raises(EPDBException) as excinfo:
+        backend.decode_header_value(token(rsa_key, ec_key))
+
+    assert message in str(excinfo.value)
+
+
+def test_forged_signature_is_rejected(keyset, ec_key):
+    """Test that a token signed by another key with a known kid is rejected."""
+    forger = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    backend = JWKSBackend(keyset)
+
+    assert backend.decode_header_value(sign(PAYLOAD, ec_key, "ES256", "ec-1")) == PAYLOAD
+    with pytest.raises(EPDBException):
+        backend.decode_header_value(sign(PAYLOAD, forger, "ES256", "ec-1"))
+
+
+def test_single_key_needs_no_kid(rsa_key):
+    """Test that a set of one key verifies tokens without a kid, and honours the key's alg."""
+    jwk = dict(rsa_jwk(rsa_key, "rsa-1"), alg="RS512")
+    backend = JWKSBackend({"keys": [jwk]})
+
+    assert backend.decode_header_value(sign(PAYLOAD, rsa_key, "RS512")) == PAYLOAD
+    with pytest.raises(EPDBException):
+        backend.decode_header_value(sign(PAYLOAD, rsa_key, "RS256"))
+
+
+def test_unusable_keys_are_skipped(rsa_key, ec_key):
+    """Test that keys which are not public signing keys are skipped, with a warning."""
+    keys = [
+        dict(rsa_jwk(rsa_key, "private"), d="secret"),
+        dict(ec_jwk(ec_key, "encryption"), use="enc"),
+        {"kty": "oct", "kid": "symmetric", "k": "c2VjcmV0"},
+        rsa_jwk(rsa_key, "rsa-1"),
+    ]
+
+    with testfixtures.LogCapture() as logs:
+        keyset = KeySet({"keys": keys})
+
+    assert len(keyset) == 1
+    assert keyset.get("rsa-1") is not None
+    assert len(logs.records) == 3
+    with pytest.raises(ValueError):
+        KeySet({"keys": keys[:3]})
+
+
+def test_keyset_file_is_reloaded(tmpdir, rsa_key, ec_key):
+    """Test that a changed key set file is picked up, and a broken one does not drop the keys."""
+    path = tmpdir.join("jwks.json")
+    path.write(json.dumps({"keys": [rsa_jwk(rsa_key, "rsa-1")]}))
+    keyset = KeySet(str(path), reload_interval=3600)
+    backend = JWKSBackend(keyset)
+    try:
+        path.write(json.dumps({"keys": [ec_jwk(ec_key, "ec-2"), rsa_jwk(rsa_key, "rsa-1")]}))
+        keyset.refresh()
+        assert backend.decode_header_value(sign(PAYLOAD, ec_key, "ES256", "ec-2")) == PAYLOAD
+
+        path.write("{")
+        with testfixtures.LogCapture():
+            keyset.refresh()
+        assert backend.decode_header_value(sign(PAYLOAD, ec_key, "ES256", "ec-2")) == PAYLOAD
+    finally:
+        keyset.stop()
+
+
+def test_empty_keyset_file_rejects_tokens(tmpdir, rsa_key):
+    """Test that a reloaded key set without usable keys is applied, rather than ignored."""
+    path = tmpdir.join("jwks.json")
+    path.write(json.dumps({"keys": [rsa_jwk(rsa_key, "rsa-1")]}))
+    keyset = KeySet(str(path), reload_interval=3600)
+    backend = JWKSBackend(keyset)
+    try:
+        path.write(json.dumps({"keys": []}))
+        with testfixtures.LogCapture() as logs:
+            keyset.refresh()
+        with pytest.raises(EPDBException) as excinfo:
+            backend.decode_header_value(sign(PAYLOAD, rsa_key, "RS256", "rsa-1"))
+
+        path.write(json.dumps({"keys": [rsa_jwk(rsa_key, "rsa-1")], "revision": 2}))
+        keyset.refresh()
+        assert backend.decode_header_value(sign(PAYLOAD, rsa_key, "RS256", "rsa-1")) == PAYLOAD
+    finally:
+        keyset.stop()
+
+    assert "unknown key" in str(excinfo.value)
+    logs.check(
+        (
+            "falcon_epdb.keysets",
+            "WARNING",
+            "The key set in {} has no usable keys; rejecting every token".format(path),
+        )
+    )
+
+
+def test_keyset_reload_drops_cached_headers(tmpdir, rsa_key, ec_key, mocker):
+    """Test that a token signed by a key removed from the set is no longer served from cache."""
+    path = tmpdir.join("jwks.json")
+    path.write(json.dumps({"keys": [rsa_jwk(rsa_key, "rsa-1"), ec_jwk(ec_key, "ec-1")]}))
+    keyset = KeySet(str(path), reload_interval=3600)
+    backend = JWKSBackend(keyset, cache=HeaderCache())
+    req = mocker.Mock(get_header=mocker.Mock(return_value=sign(PAYLOAD, ec_key, "ES256", "ec-1")))
+    try:
+        assert backend.get_header_data(req) == {}
+
+        path.write(json.dumps({"keys": [rsa_jwk(rsa_key, "rsa-1")]}))
+        keyset.refresh()
+        with pytest.raises(EPDBException) as excinfo:
+            backend.get_header_data(req)
+    finally:
+        keyset.stop()
+
+    assert "unknown key" in str(excinfo.value)
+
+
+@pytest.mark.skipif(
+    "EdDSA" not in getattr(jwt.algorithms, "get_default_algorithms", dict)(),
+    reason="EdDSA needs PyJWT 2.0+",
+)
+def test_eddsa_tokens_are_verified():
+    """Test that tokens signed with an Ed25519 key are verified."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = ed25519.Ed25519PrivateKey.generate()
+    public_bytes = private_key.public_key().public_bytes(
+        serialization.Encoding.Raw, serialization.PublicFormat.Raw
+    )
+    jwk = {
+        "kty": "OKP",
+        "crv": "Ed25519",
+        "kid": "ed-1",
+        "x": base64.urlsafe_b64encode(public_bytes).decode().rstrip("="),
+    }
+    backend = JWKSBackend({"keys": [jwk]})
+
+    assert backend.decode_header_value(sign(PAYLOAD, private_key, "EdDSA", "ed-1")) == PAYLOAD
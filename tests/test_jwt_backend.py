@@ -1,9 +1,11 @@
 """Tests for the JWTBackend functionality"""
 
+import sys
+
 import pytest
 import testfixtures
 
-from falcon_epdb import JWTBackend
+from falcon_epdb import EPDBServe, HeaderCache, JWTBackend
 
 
 try:
@@ -23,7 +25,7 @@ try:
         """Expect an import error if we attempt to use this backend without jwt."""
 
         with monkeypatch.context() as context:
-            context.delattr("falcon_epdb.jwt")
+            context.setitem(sys.modules, "jwt", None)
             with pytest.raises(ImportError):
                 JWTBackend("some key")
 
@@ -61,6 +63,46 @@ try:
             )
         )
 
+    def test_jwt_invalid_header_bad_signature(jwt_client, mock_epdb_serve):
+        """Test that a token signed with a different key is rejected."""
+        other_header = jwt.encode({"epdb": {}}, "some other key").decode()
+
+        with testfixtures.LogCapture() as logs:
+            result = jwt_client.simulate_get(headers={"X-EPDB": "JWT {}".format(other_header)})
+
+        assert result.status_code == 200
+        assert not mock_epdb_serve.called
+        logs.check_present(
+            (
+                "falcon_epdb",
+                "ERROR",
+                "Attempted, but failed, to serve epdb: Invalid X-EPDB value;"
+                " invalid token: Signature verification failed",
+            )
+        )
+
+    def test_jwt_cache_skips_verification(
+        jwt_key, jwt_header, make_client, mock_epdb_serve, mocker
+    ):
+        """Test that a recently accepted header is not verified again."""
+        backend = JWTBackend(key=jwt_key, cache=HeaderCache())
+        client = make_client(EPDBServe(backend=backend))
+        decode_header_value = mocker.spy(backend, "decode_header_value")
+
+        headers = {"X-EPDB": "JWT {}".format(jwt_header)}
+        client.simulate_get(headers=headers)
+        client.simulate_get(headers=headers)
+
+        assert mock_epdb_serve.call_count == 2
+        assert decode_header_value.call_count == 1
+
+    def test_jwt_cache_entry_expires_with_token(jwt_key):
+        """Test that cached entries do not outlive the token's exp claim."""
+        backend = JWTBackend(key=jwt_key)
+
+        assert backend.get_header_expiry("JWT ...", {"epdb": {}, "exp": 1234}) == 1234
+        assert backend.get_header_expiry("JWT ...", {"epdb": {}}) is None
+
 
 except ImportError:
     pass
@@ -0,0 +1,218 @@
+"""Tests for the Metrics functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import os
+import subprocess
+import sys
+import threading
+
+import falcon
+import pytest
+from falcon import testing
+
+from falcon_epdb import Base64Backend, EPDBServe, Metrics, MetricsResource, SessionRegistry
+
+
+def _samples(text):
+    """Return the samples of an exposition, keyed by everything before the value."""
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_counters():
+    """Test that counters are summed by name and labels."""
+    metrics = Metrics()
+    metrics.inc("falcon_epdb_headers_total")
+    metrics.inc("falcon_epdb_headers_total", 2)
+    metrics.inc("falcon_epdb_header_failures_total", reason="throttled")
+    metrics.inc("falcon_epdb_header_failures_total", reason='with "quotes"\n')
+
+    text = metrics.render()
+
+    assert "# TYPE falcon_epdb_headers_total counter\nfalcon_epdb_headers_total 3\n" in text
+    assert 'falcon_epdb_header_failures_total{reason="throttled"} 1\n' in text
+    assert 'falcon_epdb_header_failures_total{reason="with \\"quotes\\"\\n"} 1\n' in text
+
+
+def test_histograms():
+    """Test that histograms report cumulative buckets, a sum and a count."""
+    metrics = Metrics()
+    for value in (0.00001, 0.0001, 0.003, 5):
+        metrics.observe("falcon_epdb_decode_seconds", value, backend="Base64Backend")
+
+    samples = _samples(metrics.render())
+
+    prefix = 'falcon_epdb_decode_seconds_bucket{backend="Base64Backend",le='
+    assert samples[prefix + '"5e-05"}'] == 1
+    assert samples[prefix + '"0.0001"}'] == 2
+    assert samples[prefix + '"0.0025"}'] == 2
+    assert samples[prefix + '"0.005"}'] == 3
+    assert samples[prefix + '"0.1"}'] == 3
+    assert samples[prefix + '"+Inf"}'] == 4
+    assert samples['falcon_epdb_decode_seconds_count{backend="Base64Backend"}'] == 4
+    assert abs(samples['falcon_epdb_decode_seconds_sum{backend="Base64Backend"}'] - 5.00311) < 1e-9
+
+
+def test_attachment_events():
+    """Test that only changes in whether a client is attached are counted."""
+    metrics = Metrics()
+    for attached in (False, True, True, False, True):
+        metrics.record_attachment(attached)
+
+    samples = _samples(metrics.render())
+
+    assert samples['falcon_epdb_session_events_total{event="attach"}'] == 2
+    assert samples['falcon_epdb_session_events_total{event="detach"}'] == 1
+
+
+def _save_as(metrics, pid, mocker):
+    """Save the metrics as though from the process with the pid."""
+    mocker.patch("falcon_epdb.metrics.os.getpid", return_value=pid)
+    try:
+        metrics.flush()
+    finally:
+        mocker.stopall()
+
+
+@pytest.fixture
+def exited_pid():
+    """Provide the pid of a process that has exited."""
+    # pylint: disable=consider-using-with
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_multiprocess_aggregation(tmpdir, mocker):
+    """Test that the metrics of every process sharing the path are summed."""
+    path = str(tmpdir.join("metrics"))
+    other = Metrics(path=path, flush_interval=3600)
+    other.inc("falcon_epdb_headers_total", 2)
+    other.observe("falcon_epdb_blocked_seconds", 20.0, stage="wait")
+    _save_as(other, os.getppid(), mocker)
+    other.stop()
+
+    metrics = Metrics(path=path, flush_interval=3600)
+    metrics.inc("falcon_epdb_headers_total")
+    metrics.observe("falcon_epdb_blocked_seconds", 0.5, stage="wait")
+    with open(os.path.join(path, "notes.json"), "w") as invalid_file:
+        invalid_file.write("not json")
+
+    samples = _samples(metrics.render())
+    metrics.stop()
+
+    assert samples["falcon_epdb_headers_total"] == 3
+    assert samples['falcon_epdb_blocked_seconds_bucket{stage="wait",le="1.0"}'] == 1
+    assert samples['falcon_epdb_blocked_seconds_bucket{stage="wait",le="30.0"}'] == 2
+    assert samples['falcon_epdb_blocked_seconds_sum{stage="wait"}'] == 20.5
+    assert sorted(os.listdir(path)) == sorted(
+        ["{}.json".format(os.getppid()), "{}.json".format(os.getpid()), "notes.json"]
+    )
+
+
+def test_exited_processes_are_folded(tmpdir, mocker, exited_pid):
+    """Test that the metrics of a process that has exited are kept in the totals, once."""
+    path = str(tmpdir)
+    other = Metrics(path=path, flush_interval=3600)
+    other.inc("falcon_epdb_headers_total", 2)
+    other.observe("falcon_epdb_blocked_seconds", 20.0, stage="wait")
+    _save_as(other, exited_pid, mocker)
+    other.stop()
+
+    metrics = Metrics(path=path, flush_interval=3600)
+    metrics.inc("falcon_epdb_headers_total")
+    first = _samples(metrics.render())
+    # Another process, which happened to be given the same pid, has exited since
+    other.inc("falcon_epdb_headers_total", 4)
+    _save_as(other, exited_pid, mocker)
+    metrics.render()
+    second = _samples(metrics.render())
+    metrics.stop()
+
+    assert first["falcon_epdb_headers_total"] == 3
+    assert first['falcon_epdb_blocked_seconds_sum{stage="wait"}'] == 20.0
+    assert second["falcon_epdb_headers_total"] == 9
+    assert second['falcon_epdb_blocked_seconds_count{stage="wait"}'] == 2
+    assert sorted(os.listdir(path)) == sorted(
+        [".aggregate.lock", "aggregate.json", "{}.json".format(os.getpid())]
+    )
+
+
+def test_recording_does_not_save(tmpdir, mocker):
+    """Test that recording a value never writes to the shared path."""
+    metrics = Metrics(path=str(tmpdir), flush_interval=3600)
+    mock_flush = mocker.patch.object(metrics, "flush")
+
+    metrics.inc("falcon_epdb_headers_total")
+    metrics.observe("falcon_epdb_decode_seconds", 0.001, backend="Base64Backend")
+    metrics.stop()
+
+    assert not mock_flush.called
+    assert not os.listdir(str(tmpdir))
+
+
+def test_metrics_are_saved_in_the_background(tmpdir, mocker):
+    """Test that a background thread saves the metrics every flush interval, until stopped."""
+    saved = threading.Event()
+    metrics = Metrics(path=str(tmpdir), flush_interval=0.01)
+    mocker.patch.object(metrics, "flush", side_effect=saved.set)
+
+    try:
+        assert saved.wait(5)
+    finally:
+        metrics.stop()
+
+
+def test_middleware_metrics(make_client, base64_header, mock_epdb_serve):
+    """Test that the middleware records its work."""
+    metrics = Metrics()
+    client = make_client(EPDBServe(backend=Base64Backend(), metrics=metrics))
+
+    client.simulate_get()
+    client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+    client.simulate_get(headers={"X-EPDB": "Invalid"})
+    client.simulate_options(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    samples = _samples(metrics.render())
+    assert mock_epdb_serve.call_count == 1
+    assert samples["falcon_epdb_headers_total"] == 3
+    assert samples['falcon_epdb_header_failures_total{reason="rejected"}'] == 1
+    assert samples['falcon_epdb_header_failures_total{reason="exempt"}'] == 1
+    assert samples['falcon_epdb_decode_seconds_count{backend="Base64Backend"}'] == 2
+    assert samples['falcon_epdb_session_events_total{event="serve"}'] == 1
+    assert samples['falcon_epdb_blocked_seconds_count{stage="serve"}'] == 1
+
+
+def test_middleware_metrics_when_waiting(make_client, base64_header, mocker, tmpdir):
+    """Test that time spent waiting for a client, and clients that never attach, are recorded."""
+    mocker.patch("falcon_epdb.accept_client", return_value=False)
+    metrics = Metrics()
+    middleware = EPDBServe(
+        backend=Base64Backend(), registry=SessionRegistry(str(tmpdir)), metrics=metrics
+    )
+
+    make_client(middleware).simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    samples = _samples(metrics.render())
+    assert samples['falcon_epdb_blocked_seconds_count{stage="wait"}'] == 1
+    assert samples['falcon_epdb_session_events_total{event="wait_timeout"}'] == 1
+    assert 'falcon_epdb_session_events_total{event="serve"}' not in samples
+
+
+def test_metrics_resource():
+    """Test that the resource renders the metrics for Prometheus."""
+    metrics = Metrics()
+    metrics.inc("falcon_epdb_headers_total")
+    app = falcon.API()
+    app.add_route("/metrics", MetricsResource(metrics))
+
+    result = testing.TestClient(app).simulate_get("/metrics")
+
+    assert result.headers["content-type"] == "text/plain; version=0.0.4; charset=utf-8"
+    assert result.text == metrics.render()
+    assert "falcon_epdb_headers_total 1\n" in result.text
@@ -3,8 +3,12 @@
 import base64
 import json
 
+import falcon
 import pytest
 import testfixtures
+from falcon import testing
+
+from falcon_epdb import Base64Backend, EPDBServe, HeaderCache
 
 
 def test_options_call(base64_client, base64_header, mock_epdb_serve):
@@ -106,3 +110,54 @@ def test_invalid_header_value_content(base64_client, mock_epdb_serve, header_dat
     logs.check_present(
         ("falcon_epdb", "ERROR", "Attempted, but failed, to serve epdb: {}".format(error_msg))
     )
+
+
+def test_empty_header_has_no_effect(base64_client, mock_epdb_serve):
+    """Test that we do nothing if the header is present but empty."""
+    result = base64_client.simulate_get(headers={"X-EPDB": ""})
+
+    assert result.status_code == 200
+    assert not mock_epdb_serve.called
+
+
+def test_no_header_skips_backend(base64_client, base64_middleware, mock_epdb_serve, mocker):
+    """Test that requests without the header never reach the backend."""
+    get_header_data = mocker.patch.object(base64_middleware.backend, "get_header_data")
+
+    result = base64_client.simulate_get()
+
+    assert result.status_code == 200
+    assert not get_header_data.called
+    assert not mock_epdb_serve.called
+
+
+def test_backend_can_disable_fast_path(mock_epdb_serve):
+    """Test that a backend looking elsewhere for its payload is still consulted."""
+
+    class QueryBackend(Base64Backend):
+        """Look for the payload in the query string."""
+
+        header_environ_key = None
+
+        def get_header_data(self, req):
+            return self.validate_header_content({"epdb": {}}) if req.get_param("epdb") else None
+
+    app = falcon.API(middleware=[EPDBServe(backend=QueryBackend())])
+    app.add_route("/", testing.SimpleTestResource(json={}))
+
+    result = testing.TestClient(app).simulate_get(query_string="epdb=1")
+
+    assert result.status_code == 200
+    assert mock_epdb_serve.called
+
+
+def test_backend_cache_is_used(base64_client, base64_middleware, base64_header, mock_epdb_serve):
+    """Test that a backend with a cache stores and reuses the validated payload."""
+    base64_middleware.backend.cache = HeaderCache()
+    headers = {"X-EPDB": "Base64 {}".format(base64_header)}
+
+    base64_client.simulate_get(headers=headers)
+    base64_client.simulate_get(headers=headers)
+
+    assert mock_epdb_serve.call_count == 2
+    assert base64_middleware.backend.cache.get(headers["X-EPDB"]) == {}
@@ -0,0 +1,142 @@
+"""Regression benchmarks for the middleware hot path"""
+
+import subprocess
+import sys
+import timeit
+
+import falcon
+import pytest
+from falcon.testing import create_environ
+
+import falcon_epdb
+from benchmarks import suite
+from falcon_epdb import ArmSwitch, Base64Backend, EPDBServe, TriggerRules
+from falcon_epdb.wsgi import WSGIEPDBServe
+
+
+# How many times slower than an equivalent no-op the cheap paths may be. They measure at well
+# under half this, while building a request view or consulting the backend costs several times it.
+_MAX_OVERHEAD = 10
+
+
+def _best_time_per_call(func, number=100000, repeat=5):
+    """Return the best observed time, in seconds, of a single call to func.
+
+    Any active trace function (eg. coverage) is suspended while timing, as it would otherwise
+    dominate the measurement.
+    """
+    tracer = sys.gettrace()
+    sys.settrace(None)
+    try:
+        return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    finally:
+        sys.settrace(tracer)
+
+
+class NoopMiddleware(object):
+    """A Falcon middleware that does nothing, against which the middleware is measured."""
+
+    def process_request(self, req, resp):
+        """Do nothing."""
+
+    def process_response(self, req, resp, resource, req_succeeded=True):
+        """Do nothing."""
+
+
+def _relative_overhead(middleware, req):
+    """Return how many times slower than a no-op middleware the middleware handles the request."""
+
+    def handle(handler):
+        handler.process_request(req, None)
+        handler.process_response(req, None, None)
+
+    noop = NoopMiddleware()
+    baseline = _best_time_per_call(lambda: handle(noop))
+    return _best_time_per_call(lambda: handle(middleware)) / baseline
+
+
+def test_no_header_overhead_is_near_a_noop():
+    """Test that the middleware costs little more than a no-op for requests without the header."""
+    middleware = EPDBServe(backend=Base64Backend(), serve_options={"port": 9000})
+    req = falcon.Request(create_environ())
+
+    assert _relative_overhead(middleware, req) < _MAX_OVERHEAD
+
+
+def test_unarmed_rules_overhead_is_near_a_noop():
+    """Test that configuring rules, none of which are armed, keeps the no-header path cheap."""
+    middleware = EPDBServe(backend=Base64Backend(), rules=TriggerRules())
+    req = falcon.Request(create_environ())
+
+    assert _relative_overhead(middleware, req) < _MAX_OVERHEAD
+
+
+def test_disarmed_overhead_is_near_a_noop(tmpdir):
+    """Test that a disarmed middleware costs little more than a no-op for every request."""
+    control = ArmSwitch(str(tmpdir.join("control.json")), poll_interval=3600)
+    middleware = EPDBServe(backend=Base64Backend(), control=control)
+    req = falcon.Request(create_environ(headers={"X-EPDB": "Base64 e30="}))
+
+    try:
+        assert _relative_overhead(middleware, req) < _MAX_OVERHEAD
+    finally:
+        control.stop()
+
+
+def test_wsgi_no_header_overhead_is_near_a_noop():
+    """Test that the WSGI wrapper costs little more than a pass-through for requests without it."""
+
+    def app(environ, start_response):  # pylint: disable=unused-argument
+        return None
+
+    def passthrough(environ, start_response):
+        return app(environ, start_response)
+
+    middleware = WSGIEPDBServe(app, Base64Backend())
+    environ = create_environ()
+
+    baseline = _best_time_per_call(lambda: passthrough(environ, None))
+    overhead = _best_time_per_call(lambda: middleware(environ, None)) / baseline
+    assert overhead < _MAX_OVERHEAD
+
+
+def test_benchmark_suite_runs():
+    """Smoke test the bundled benchmark suite so that it does not silently rot."""
+    results = suite.run(number=1)
+
+    assert "wsgi/bare/no-header" in results
+    assert "client/base64/valid" in results
+    assert all(result["ns_per_op"] > 0 for result in results.values())
+
+
+def _imported_modules(module):
+    """Import a module in a fresh interpreter, returning the names of every module it imported."""
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    return set(
+        line.rsplit("|", 1)[1].strip()
+        for line in output.splitlines()
+        if line.startswith("import time:") and "self [us]" not in line
+    )
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python 3.7")
+def test_import_is_cheap():
+    """Test that importing the package defers its heavy dependencies and optional modules."""
+    imported = _imported_modules("falcon_epdb")
+
+    for heavy in ("epdb", "cryptography", "jwt"):
+        assert not [name for name in imported if name.split(".")[0] == heavy]
+    for module in set(falcon_epdb._LAZY_EXPORTS.values()):  # pylint: disable=protected-access
+        assert module not in imported
+
+
+def test_lazy_exports_are_importable():
+    """Test that the lazily exported classes are imported on first access."""
+    for name in falcon_epdb.__all__:
+        assert getattr(falcon_epdb, name).__name__ == name
+    with pytest.raises(AttributeError):
+        falcon_epdb.Missing  # pylint: disable=no-member,pointless-statement
@@ -0,0 +1,108 @@
+"""Tests for the PortPool functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import os
+
+import pytest
+import testfixtures
+
+from falcon_epdb import Base64Backend, EPDBServe, PortPool
+
+
+@pytest.fixture
+def make_pool(tmpdir):
+    """Provide a factory for pools sharing a lock directory."""
+    pools = []
+
+    def factory(ports):
+        pool = PortPool(ports, lock_dir=str(tmpdir))
+        pools.append(pool)
+        return pool
+
+    yield factory
+
+    for pool in pools:
+        pool.release()
+
+
+def test_pools_claim_distinct_ports(make_pool):
+    """Test that competing claimants each get their own port."""
+    first, second, third = make_pool(range(9000, 9002)), make_pool([9000, 9001]), make_pool([9000])
+
+    assert first.claim() == 9000
+    assert first.claim() == 9000
+    assert second.claim() == 9001
+    assert third.claim() is None
+    assert third.port is None
+
+
+def test_released_port_can_be_claimed(make_pool):
+    """Test that a released port becomes available to another claimant."""
+    first, second = make_pool([9000]), make_pool([9000])
+    first.claim()
+    first.release()
+
+    assert first.port is None
+    assert second.claim() == 9000
+
+
+def test_forked_process_claims_its_own_port(make_pool, mocker):
+    """Test that a claim inherited from a parent process is not reused by the child."""
+    pool = make_pool([9000, 9001])
+    pool.claim()
+    # Share the lock, as a parent process would after forking
+    parent_fd = os.dup(pool._lock_file.fileno())  # pylint: disable=protected-access
+    mocker.patch("falcon_epdb.ports.os.getpid", return_value=os.getpid() + 1)
+
+    try:
+        assert pool.port is None
+        pool.release()  # Not ours to release
+        assert pool.claim() == 9001
+    finally:
+        os.close(parent_fd)
+
+
+def test_forked_process_does_not_wait_on_parent_lock(make_pool, mocker):
+    """Test that a lock held by another thread when the process forked does not block a claim."""
+    pool = make_pool([9000])
+    mocker.patch("falcon_epdb.ports.os.getpid", return_value=os.getpid() + 1)
+
+    with pool._lock:  # pylint: disable=protected-access
+        pool._after_fork()  # pylint: disable=protected-access
+        assert not pool._lock.locked()  # pylint: disable=protected-access
+        assert pool.claim() == 9000
+
+
+def test_middleware_reports_claimed_port(make_client, base64_header, mock_epdb_serve, make_pool):
+    """Test that the worker's port is served and reported on the response."""
+    make_pool([9000]).claim()
+    client = make_client(EPDBServe(backend=Base64Backend(), ports=make_pool([9000, 9001])))
+
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert result.headers["X-EPDB-Port"] == "9001"
+    mock_epdb_serve.assert_called_once_with(port=9001)
+
+
+def test_middleware_accepts_port_range():
+    """Test that a plain range of ports is wrapped in a pool."""
+    middleware = EPDBServe(backend=Base64Backend(), ports=range(9000, 9004))
+
+    assert middleware.port_pool.ports == (9000, 9001, 9002, 9003)
+
+
+def test_middleware_with_exhausted_pool(make_client, base64_header, mock_epdb_serve, make_pool):
+    """Test that we do not serve if every port is taken."""
+    make_pool([9000]).claim()
+    client = make_client(EPDBServe(backend=Base64Backend(), ports=make_pool([9000])))
+
+    with testfixtures.LogCapture() as logs:
+        result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert result.status_code == 200
+    assert "X-EPDB-Port" not in result.headers
+    assert not mock_epdb_serve.called
+    logs.check_present(
+        ("falcon_epdb", "ERROR", "Attempted, but failed, to serve epdb: No free port in the pool")
+    )
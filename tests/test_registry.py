@@ -0,0 +1,134 @@
+"""Tests for the SessionRegistry functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import os
+
+import pytest
+
+from falcon_epdb import Base64Backend, EPDBServe, SessionRegistry
+from falcon_epdb.registry import main
+
+
+@pytest.fixture
+def registry(tmpdir):
+    """Provide a registry in a temporary directory."""
+    return SessionRegistry(str(tmpdir.join("sessions")))
+
+
+def test_register_and_unregister(registry):
+    """Test that a registered session is listed until it is unregistered."""
+    registry.register(9000, request="GET /orders")
+
+    sessions = registry.sessions()
+    assert len(sessions) == 1
+    assert sessions[0]["pid"] == os.getpid()
+    assert sessions[0]["port"] == 9000
+    assert sessions[0]["request"] == "GET /orders"
+
+    registry.unregister(9000)
+    registry.unregister(9000)
+    assert registry.sessions() == []
+
+
+def test_sessions_with_missing_directory(registry):
+    """Test that an unused registry has no sessions."""
+    assert registry.sessions() == []
+
+
+def test_stale_and_invalid_entries_are_ignored(registry, mocker):
+    """Test that entries for dead processes are removed, and unreadable ones are skipped."""
+    registry.register(9000)
+    with open(os.path.join(registry.path, "garbage.json"), "w") as entry_file:
+        entry_file.write("{")
+    with open(os.path.join(registry.path, "notes.txt"), "w") as entry_file:
+        entry_file.write("ignored")
+    mocker.patch("falcon_epdb.registry.os.kill", side_effect=OSError(3, "No such process"))
+
+    assert registry.sessions() == []
+    assert sorted(os.listdir(registry.path)) == ["garbage.json", "notes.txt"]
+
+
+def test_entries_for_other_users_processes_are_kept(registry, mocker):
+    """Test that a process we may not signal is still considered alive."""
+    registry.register(9000)
+    mocker.patch("falcon_epdb.registry.os.kill", side_effect=OSError(1, "Not permitted"))
+
+    assert len(registry.sessions()) == 1
+
+
+def test_cli_list(registry, capsys):
+    """Test that the console script lists the waiting sessions."""
+    registry.register(9000, request="GET /orders")
+
+    assert main(["--registry", registry.path, "list"]) == 0
+
+    output = capsys.readouterr().out
+    assert "{:>8}   9000".format(os.getpid()) in output
+    assert "GET /orders" in output
+
+
+def test_cli_attach(registry, mocker):
+    """Test that the console script connects to the chosen session."""
+    connect = mocker.patch("epdb.connect")
+    registry.register(9000)
+    registry.register(9001)
+
+    assert main(["--registry", registry.path, "attach"]) == 1
+    assert not connect.called
+
+    assert main(["--registry", registry.path, "attach", "--port", "9001"]) == 0
+    connect.assert_called_once_with(host="localhost", port=9001)
+
+
+def test_blocking_middleware_registers_while_waiting(
+    registry, make_client, base64_header, mock_epdb_serve, mocker
+):
+    """Test that the worker is registered only while it waits for a client."""
+    sessions = []
+
+    def accept_client(port):
+        sessions.extend(registry.sessions())
+        return port == 9000
+
+    mocker.patch("falcon_epdb.accept_client", side_effect=accept_client)
+    mocker.patch("falcon_epdb.is_attached", return_value=False)
+    middleware = EPDBServe(backend=Base64Backend(), serve_options={"port": 9000}, registry=registry)
+
+    make_client(middleware).simulate_get(
+        "/orders", headers={"X-EPDB": "Base64 {}".format(base64_header)}
+    )
+
+    assert [(entry["port"], entry["request"]) for entry in sessions] == [(9000, "GET /orders")]
+    assert registry.sessions() == []
+    mock_epdb_serve.assert_called_once_with(port=9000)
+
+
+def test_non_blocking_middleware_registers_while_armed(
+    registry, make_client, base64_header, mock_epdb_serve, mocker
+):
+    """Test that the worker is registered until the background listener finishes."""
+    mocker.patch("falcon_epdb.is_attached", return_value=False)
+    middleware = EPDBServe(
+        backend=Base64Backend(), serve_options={"port": 9000}, registry=registry, blocking=False
+    )
+    start = mocker.patch.object(middleware.listener, "start")
+
+    make_client(middleware).simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert [entry["port"] for entry in registry.sessions()] == [9000]
+    start.call_args[1]["on_finish"]()
+    assert registry.sessions() == []
+    assert not mock_epdb_serve.called
+
+
+def test_failed_arm_unregisters(registry, make_client, base64_header, mock_epdb_serve, mocker):
+    """Test that the entry is removed if the listener could not be started."""
+    # pylint: disable=unused-argument
+    mocker.patch("falcon_epdb.is_attached", return_value=False)
+    middleware = EPDBServe(backend=Base64Backend(), registry=registry, blocking=False)
+    mocker.patch.object(middleware.listener, "start", side_effect=OSError("Address in use"))
+
+    make_client(middleware).simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert registry.sessions() == []
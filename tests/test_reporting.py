@@ -0,0 +1,131 @@
+"""Tests for the FailureReporter functionality"""
+
+import logging
+import threading
+
+import testfixtures
+
+from falcon_epdb import Base64Backend, EPDBServe, FailureReporter
+
+
+def test_reporter_aggregates_failures(mocker):
+    """Test that failures within the interval are summarized in a single line."""
+    mock_monotonic = mocker.patch("falcon_epdb.reporting.monotonic", return_value=100.0)
+    reporter = FailureReporter(interval=60)
+
+    with testfixtures.LogCapture() as logs:
+        reporter.record("must have two tokens", sample="first")
+        mock_monotonic.return_value = 110.0
+        reporter.record("must have two tokens", sample="second")
+        reporter.record("scheme must be Base64", sample="third")
+        mock_monotonic.return_value = 160.0
+        reporter.record("must have two tokens", sample="fourth")
+
+    logs.check(
+        (
+            "falcon_epdb.reporting",
+            "WARNING",
+            "Rejected 1 X-EPDB header(s) in the last 0s: must have two tokens (x1);"
+            " most recent: first",
+        ),
+        (
+            "falcon_epdb.reporting",
+            "WARNING",
+            "Rejected 3 X-EPDB header(s) in the last 60s: must have two tokens (x2),"
+            " scheme must be Base64 (x1); most recent: fourth",
+        ),
+    )
+
+
+def test_reporter_flush(mocker):
+    """Test that flushing logs any pending failures, and nothing if there are none."""
+    mock_monotonic = mocker.patch("falcon_epdb.reporting.monotonic", return_value=100.0)
+    reporter = FailureReporter(interval=60)
+
+    with testfixtures.LogCapture() as logs:
+        reporter.record("must have two tokens")
+        mock_monotonic.return_value = 105.0
+        reporter.record("must have two tokens")
+        reporter.flush()
+        reporter.flush()
+
+    assert len(logs.records) == 2
+    assert logs.records[-1].getMessage().startswith("Rejected 1 X-EPDB header(s) in the last 5s")
+
+
+def test_forked_reporter_starts_afresh(mocker):
+    """Test that a forked process neither reports its parent's failures nor waits on its lock."""
+    mocker.patch("falcon_epdb.reporting.monotonic", return_value=100.0)
+    reporter = FailureReporter(interval=60)
+
+    with testfixtures.LogCapture() as logs:
+        reporter.record("must have two tokens", sample="parent")
+        # Pretend that another thread held the lock when the process forked
+        with reporter._lock:  # pylint: disable=protected-access
+            reporter._forget()  # pylint: disable=protected-access
+            assert not reporter._lock.locked()  # pylint: disable=protected-access
+            reporter.record("scheme must be Base64", sample="child")
+        reporter.flush()
+
+    assert len(logs.records) == 2
+    assert logs.records[-1].getMessage() == (
+        "Rejected 1 X-EPDB header(s) in the last 0s: scheme must be Base64 (x1); most recent: child"
+    )
+
+
+def test_middleware_reports_rejected_headers_without_traceback(make_client, mock_epdb_serve):
+    """Test that rejected headers are counted rather than logged with a traceback."""
+    reporter = FailureReporter()
+    client = make_client(EPDBServe(backend=Base64Backend(), failure_reporter=reporter))
+
+    with testfixtures.LogCapture(level=logging.WARNING) as logs:
+        client.simulate_get(headers={"X-EPDB": "Invalid"})
+        client.simulate_get(headers={"X-EPDB": "Base64 !junk!"})
+        assert len(logs.records) == 1
+        reporter.flush()
+
+    assert not mock_epdb_serve.called
+    assert logs.records[0].getMessage() == (
+        "Rejected 1 X-EPDB header(s) in the last 0s:"
+        " Invalid X-EPDB value; must have two tokens (x1); most recent: GET / from 127.0.0.1"
+    )
+    assert "malformed payload (x1)" in logs.records[1].getMessage()
+    assert all(record.exc_info is None for record in logs.records)
+
+
+def test_middleware_still_logs_unexpected_errors(make_client, mocker):
+    """Test that errors which are not due to a bad header are logged in full."""
+    middleware = EPDBServe(backend=Base64Backend(), failure_reporter=FailureReporter())
+    client = make_client(middleware)
+    mocker.patch.object(middleware.backend, "get_header_data", side_effect=RuntimeError("Oops"))
+
+    with testfixtures.LogCapture() as logs:
+        client.simulate_get(headers={"X-EPDB": "Invalid"})
+
+    assert logs.records[0].levelname == "ERROR"
+    assert logs.records[0].exc_info is not None
+
+
+def test_reporter_flushes_window_when_it_elapses(mocker):
+    """Test that failures counted within the interval are reported without a later failure."""
+    reporter = FailureReporter(interval=0.05)
+    flushed = threading.Event()
+    mocker.patch.object(reporter, "_emit", side_effect=lambda summary: flushed.set())
+
+    reporter.record("must have two tokens")
+    flushed.clear()
+    reporter.record("scheme must be Base64")
+
+    assert flushed.wait(5)
+    summary = reporter._emit.call_args[0][0]  # pylint: disable=protected-access,no-member
+    assert dict(summary[1]) == {"scheme must be Base64": 1}
+    assert reporter._timer is None  # pylint: disable=protected-access
+
+
+def test_reporter_flushes_at_exit(mocker):
+    """Test that any counted failures are flushed when the process exits."""
+    register = mocker.patch("atexit.register")
+
+    reporter = FailureReporter()
+
+    register.assert_called_once_with(reporter.flush)
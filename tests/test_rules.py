@@ -0,0 +1,121 @@
+"""Tests for the TriggerRules functionality"""
+
+import falcon
+import pytest
+from falcon.testing import create_environ
+
+from falcon_epdb import Base64Backend, EPDBServe, TriggerRules
+
+
+def make_request(method="GET", path="/", query_string=""):
+    """Return a Falcon request for the method, path and query string."""
+    return falcon.Request(create_environ(path=path, query_string=query_string, method=method))
+
+
+@pytest.fixture
+def rules():
+    """Provide an empty rule table."""
+    return TriggerRules()
+
+
+def test_static_route(rules):
+    """Test that a rule for a plain path matches that path and method only."""
+    rules.arm("get", "/health/", count=None)
+
+    assert rules.match(make_request("GET", "/health")) == {}
+    assert rules.match(make_request("GET", "/health/")) == {}
+    assert rules.match(make_request("POST", "/health")) is None
+    assert rules.match(make_request("GET", "/health/check")) is None
+
+
+def test_route_template_and_params(rules):
+    """Test that route fields and query parameters must have the rule's values."""
+    rule = rules.arm(
+        "POST", "/orders/{id}", params={"status": "failed"}, payload={"profile": {}}, count=2
+    )
+    rules.arm("POST", "/orders/{order_id}/items/{item:int}", params={"item": 3})
+
+    assert rules.match(make_request("POST", "/orders/42", "status=ok")) is None
+    assert rules.match(make_request("POST", "/orders/42/extra", "status=failed")) is None
+    assert rules.match(make_request("POST", "/orders/42", "status=failed")) == {"profile": {}}
+    assert rule.remaining == 1
+    assert rules.match(make_request("POST", "/orders/42/items/4")) is None
+    assert rules.match(make_request("POST", "/orders/42/items/3")) == {}
+
+
+def test_rules_are_used_up(rules):
+    """Test that a rule disarms itself after its count, and the index is dropped with the last."""
+    rules.arm("POST", "/orders/{id}", params={"id": "7"}, count=2)
+
+    results = [rules.match(make_request("POST", "/orders/7")) for _ in range(3)]
+
+    assert results == [{}, {}, None]
+    assert len(rules) == 0
+    assert rules._index is None  # pylint: disable=protected-access
+
+
+def test_rules_are_checked_in_order(rules):
+    """Test that the first matching rule armed is the one used."""
+    rules.arm("GET", "/orders/{id}", params={"id": "1"}, payload={"first": {}})
+    rules.arm("GET", "/orders/{id}", payload={"second": {}})
+    rules.arm("GET", "/orders/{id}", payload={"third": {}})
+
+    assert rules.match(make_request("GET", "/orders/2")) == {"second": {}}
+    assert rules.match(make_request("GET", "/orders/1")) == {"first": {}}
+    assert [rule.payload for rule in rules.rules] == [{"third": {}}]
+
+
+def test_disarm_and_clear(rules):
+    """Test that disarmed rules no longer match."""
+    first = rules.arm("GET", "/a/{x}")
+    rules.arm("GET", "/b")
+
+    rules.disarm(first)
+    rules.disarm(first)
+    assert rules.match(make_request("GET", "/a/1")) is None
+    assert len(rules) == 1
+
+    rules.clear()
+    assert rules.match(make_request("GET", "/b")) is None
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    (
+        pytest.param({"count": 0}, id="count"),
+        pytest.param({"payload": "profile"}, id="payload"),
+        pytest.param({"route": "/orders/{1st}"}, id="field-name"),
+    ),
+)
+def test_invalid_rules(rules, kwargs):
+    """Test that invalid rules are refused."""
+    arguments = dict({"method": "GET", "route": "/orders/{id}"}, **kwargs)
+
+    with pytest.raises(ValueError):
+        rules.arm(**arguments)
+
+    assert len(rules) == 0
+
+
+def test_middleware_triggers_on_rules(make_client, rules, mock_epdb_serve):
+    """Test that a request without the header is served when it matches an armed rule."""
+    client = make_client(EPDBServe(backend=Base64Backend(), rules=rules))
+    rules.arm("POST", "/hooks/{provider}", params={"provider": "stripe", "status": "failed"})
+
+    client.simulate_post("/hooks/stripe", query_string="status=succeeded")
+    assert not mock_epdb_serve.called
+
+    client.simulate_post("/hooks/stripe", query_string="status=failed")
+    client.simulate_post("/hooks/stripe", query_string="status=failed")
+    assert mock_epdb_serve.call_count == 1
+
+
+def test_middleware_rule_requests_an_action(make_client, rules, mock_epdb_serve):
+    """Test that a rule's payload may request an action rather than a session."""
+    client = make_client(EPDBServe(backend=Base64Backend(), rules=rules))
+    rules.arm("GET", "/", payload={"profile": {"limit": 5}})
+
+    result = client.simulate_get("/")
+
+    assert not mock_epdb_serve.called
+    assert "function calls" in result.text
@@ -0,0 +1,137 @@
+"""Tests for the SessionManager functionality"""
+
+import threading
+import time
+
+import pytest
+
+from falcon_epdb import Base64Backend, EPDBServe, SessionManager
+
+
+@pytest.fixture
+def held():
+    """Hold the session for the duration of the test, as another flagged request would."""
+    ticket = SessionManager().admit("GET /other")
+    assert ticket is not None
+    yield ticket
+    ticket.finish()
+
+
+def test_one_session_at_a_time():
+    """Test that the session is held until released, across managers."""
+    first, second = SessionManager(), SessionManager()
+
+    ticket = first.admit("GET /a")
+    assert first.busy and second.busy
+    assert second.admit("GET /b") is None
+
+    ticket.finish()
+    ticket.finish()
+    assert not second.busy
+    second.admit("GET /b").finish()
+
+
+def test_queued_request_is_admitted_once_released(held):
+    """Test that a queued request takes the session as soon as it is released."""
+    sessions = SessionManager(when_busy="queue", queue_timeout=5)
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(sessions.admit("GET /queued")))
+
+    waiter.start()
+    deadline = time.time() + 5
+    while not sessions.queued and time.time() < deadline:
+        time.sleep(0.01)
+    held.finish()
+    waiter.join(5)
+
+    assert [ticket.request for ticket in admitted] == ["GET /queued"]
+    admitted[0].finish()
+
+
+def test_queue_is_bounded(held):  # pylint: disable=unused-argument
+    """Test that requests beyond the queue's bound, or its timeout, are not admitted."""
+    sessions = SessionManager(when_busy="queue", max_queued=1, queue_timeout=0.05)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(sessions.admit("GET /queued")))
+
+    waiter.start()
+    deadline = time.time() + 5
+    while not sessions.queued and time.time() < deadline:
+        time.sleep(0.001)
+    results.append(sessions.admit("GET /overflow"))
+    waiter.join(5)
+
+    assert results == [None, None]
+
+
+@pytest.mark.parametrize(
+    "kwargs", ({"when_busy": "block"}, {"max_queued": 0}), ids=("bad-outcome", "bad-bound")
+)
+def test_invalid_options(kwargs):
+    """Test that the options are validated."""
+    with pytest.raises(ValueError):
+        SessionManager(**kwargs)
+
+
+def test_busy_request_proceeds_untraced(make_client, base64_header, mock_epdb_serve, held):
+    """Test that a flagged request is marked and continues while another is being debugged."""
+    # pylint: disable=unused-argument
+    client = make_client(EPDBServe(backend=Base64Backend(), sessions=SessionManager()))
+
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert result.status_code == 200
+    assert result.json == {}
+    assert result.headers["X-EPDB-Busy"] == "1"
+    assert not mock_epdb_serve.called
+
+
+def test_busy_request_is_rejected(make_client, base64_header, mock_epdb_serve, held):
+    """Test that a flagged request fails fast while another is being debugged, if configured."""
+    # pylint: disable=unused-argument
+    sessions = SessionManager(when_busy="reject")
+    middleware = EPDBServe(backend=Base64Backend(), sessions=sessions, server_timing=True)
+    client = make_client(middleware)
+
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert result.status_code == 503
+    assert result.json != {}  # The resource was not called
+    assert result.headers["X-EPDB-Busy"] == "1"
+    assert not mock_epdb_serve.called
+    assert middleware._pending_responses == 0  # pylint: disable=protected-access
+
+
+def test_session_is_held_until_response(make_client, base64_header, mock_epdb_serve):
+    """Test that an admitted request holds the session until its response is processed."""
+    sessions = SessionManager()
+    busy = []
+    mock_epdb_serve.side_effect = lambda **kwargs: busy.append(sessions.busy)
+    client = make_client(EPDBServe(backend=Base64Backend(), sessions=sessions))
+
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert "X-EPDB-Busy" not in result.headers
+    assert busy == [True]
+    assert not sessions.busy
+
+
+def test_session_is_released_when_no_client_attaches(make_client, base64_header, mocker):
+    """Test that a request which gave up waiting for a client releases the session at once."""
+    sessions = SessionManager()
+    busy = []
+    mocker.patch("falcon_epdb.is_attached", return_value=False)
+    mocker.patch(
+        "falcon_epdb.accept_client", side_effect=lambda **kwargs: busy.append(sessions.busy)
+    )
+    middleware = EPDBServe(
+        backend=Base64Backend(), serve_options={"port": 9000}, accept_timeout=1, sessions=sessions
+    )
+    mock_serve_epdb = mocker.patch.object(middleware, "_serve_epdb")
+
+    make_client(middleware).simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert busy == [True]
+    assert not mock_serve_epdb.called
+    assert not sessions.busy
+    assert middleware._pending_responses == 0  # pylint: disable=protected-access
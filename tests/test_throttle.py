@@ -0,0 +1,119 @@
+"""Tests for the HeaderThrottle functionality"""
+
+import testfixtures
+
+from falcon_epdb import Base64Backend, EPDBServe, HeaderThrottle
+from falcon_epdb.throttle import TokenBucket
+
+
+def test_token_bucket_refills(mocker):
+    """Test that the bucket allows a burst, then refills at the configured rate."""
+    mock_monotonic = mocker.patch("falcon_epdb.throttle.monotonic", return_value=100.0)
+    bucket = TokenBucket(rate=1.0, burst=2)
+
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+
+    mock_monotonic.return_value = 101.0
+    assert bucket.consume()
+    assert not bucket.consume()
+
+
+def test_throttle_limits_each_client(mocker):
+    """Test that one client exhausting its bucket does not affect another."""
+    mocker.patch("falcon_epdb.throttle.monotonic", return_value=100.0)
+    throttle = HeaderThrottle(client_rate=0, client_burst=1)
+
+    assert throttle.admit("10.0.0.1", "Base64 a")
+    throttle.reject("Base64 a", "10.0.0.1")
+    assert not throttle.admit("10.0.0.1", "Base64 b")
+    assert throttle.admit("10.0.0.2", "Base64 b")
+
+
+def test_throttle_limits_all_clients(mocker):
+    """Test that the global bucket applies across clients."""
+    mocker.patch("falcon_epdb.throttle.monotonic", return_value=100.0)
+    throttle = HeaderThrottle(rate=0, burst=2)
+
+    throttle.reject("Base64 a", "10.0.0.1")
+    assert throttle.admit("10.0.0.2", "Base64 b")
+    throttle.reject("Base64 b", "10.0.0.2")
+    assert not throttle.admit("10.0.0.3", "Base64 c")
+
+
+def test_throttle_admits_headers_without_charging(mocker):
+    """Test that admitting a header takes no tokens; only rejections do."""
+    mocker.patch("falcon_epdb.throttle.monotonic", return_value=100.0)
+    throttle = HeaderThrottle(rate=0, burst=1, client_rate=0, client_burst=1)
+
+    for _ in range(10):
+        assert throttle.admit("10.0.0.1", "Base64 a")
+
+
+def test_throttle_bounds_tracked_clients():
+    """Test that the least recently seen clients are forgotten."""
+    throttle = HeaderThrottle(max_clients=2)
+
+    for client in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+        throttle.admit(client, None)
+
+    assert list(throttle._client_buckets) == [  # pylint: disable=protected-access
+        "10.0.0.2",
+        "10.0.0.3",
+    ]
+
+
+def test_throttle_drops_rejected_headers():
+    """Test that a header the backend rejected is dropped."""
+    throttle = HeaderThrottle()
+    throttle.reject("Base64 junk")
+    throttle.reject(None)
+
+    assert not throttle.admit("10.0.0.1", "Base64 junk")
+    assert throttle.admit("10.0.0.1", "Base64 fine")
+
+
+def test_middleware_does_not_decode_rejected_header_again(make_client, mock_epdb_serve, mocker):
+    """Test that a repeated bad header never reaches the backend a second time."""
+    backend = Base64Backend()
+    client = make_client(EPDBServe(backend=backend, throttle=HeaderThrottle()))
+    decode_header_value = mocker.spy(backend, "decode_header_value")
+
+    with testfixtures.LogCapture():
+        client.simulate_get(headers={"X-EPDB": "Base64 !junk!"})
+        client.simulate_get(headers={"X-EPDB": "Base64 !junk!"})
+        client.simulate_get(headers={"X-EPDB": "Invalid"})
+        client.simulate_get(headers={"X-EPDB": "Invalid"})
+
+    assert decode_header_value.call_count == 2
+    assert not mock_epdb_serve.called
+
+
+def test_middleware_never_throttles_valid_header(make_client, base64_header, mock_epdb_serve):
+    """Test that a valid header repeated beyond the burst is served every time."""
+    client = make_client(EPDBServe(backend=Base64Backend(), throttle=HeaderThrottle()))
+    headers = {"X-EPDB": "Base64 {}".format(base64_header)}
+
+    for _ in range(10):
+        assert client.simulate_get(headers=headers).status_code == 200
+
+    assert mock_epdb_serve.call_count == 10
+
+
+def test_middleware_drops_header_once_rejections_exhaust_bucket(
+    make_client, base64_header, mock_epdb_serve, mocker
+):
+    """Test that a client sending bad headers is throttled, even once it sends a valid one."""
+    mocker.patch("falcon_epdb.throttle.monotonic", return_value=100.0)
+    backend = Base64Backend()
+    client = make_client(EPDBServe(backend=backend, throttle=HeaderThrottle()))
+    decode_header_value = mocker.spy(backend, "decode_header_value")
+
+    with testfixtures.LogCapture():
+        for index in range(8):
+            client.simulate_get(headers={"X-EPDB": "Base64 !junk{}!".format(index)})
+    client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert decode_header_value.call_count == 5
+    assert not mock_epdb_serve.called
@@ -0,0 +1,164 @@
+"""Tests for the Server-Timing functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import re
+import time
+
+import epdb
+import pytest
+
+from falcon_epdb import Base64Backend, EPDBServe, HeaderThrottle
+from falcon_epdb.timing import ServerTiming, paused_seconds, time_pauses
+from falcon_epdb.watchdog import watch_sessions
+
+SERVER_TIMING = re.compile(
+    r"^epdb-decode;dur=(?P<decode>[\d.]+), epdb-wait;dur=(?P<wait>[\d.]+),"
+    r" epdb-paused;dur=(?P<paused>[\d.]+)$"
+)
+
+
+@pytest.fixture
+def timing_client(make_client):
+    """Provide a client to call an app with Server-Timing enabled."""
+    return make_client(EPDBServe(backend=Base64Backend(), server_timing=True))
+
+
+def test_flagged_request_is_timed(timing_client, base64_header, mock_epdb_serve, epdb_hooks):
+    """Test that a flagged request is tagged, and its latency attributed, on the response."""
+    # pylint: disable=unused-argument
+    result = timing_client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert mock_epdb_serve.called
+    assert result.headers["X-EPDB-Flagged"] == "1"
+    match = SERVER_TIMING.match(result.headers["Server-Timing"])
+    assert match
+    assert float(match.group("decode")) > 0
+    assert float(match.group("paused")) == 0
+
+
+def test_rejected_request_is_untouched(timing_client):
+    """Test that a request with an invalid header is neither tagged nor timed."""
+    result = timing_client.simulate_get(headers={"X-EPDB": "Invalid"})
+
+    assert "X-EPDB-Flagged" not in result.headers
+    assert "Server-Timing" not in result.headers
+
+
+def test_throttled_request_is_untouched(make_client, base64_header):
+    """Test that a request whose header is dropped by the throttle is neither tagged nor timed."""
+    throttle = HeaderThrottle()
+    throttle.reject("Base64 {}".format(base64_header))
+    client = make_client(EPDBServe(backend=Base64Backend(), server_timing=True, throttle=throttle))
+
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert "X-EPDB-Flagged" not in result.headers
+    assert "Server-Timing" not in result.headers
+
+
+def test_unflagged_request_is_untouched(timing_client):
+    """Test that a request without the header is neither tagged nor timed."""
+    result = timing_client.simulate_get()
+
+    assert "X-EPDB-Flagged" not in result.headers
+    assert "Server-Timing" not in result.headers
+
+
+def test_server_timing_is_opt_in(base64_client, base64_header, mock_epdb_serve):
+    """Test that flagged requests are not tagged unless enabled."""
+    # pylint: disable=unused-argument
+    result = base64_client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert "X-EPDB-Flagged" not in result.headers
+    assert "Server-Timing" not in result.headers
+
+
+def test_time_pauses(mocker, epdb_hooks):
+    """Test that time spent in the debugger prompt is accumulated, however often it is wrapped."""
+    mock_monotonic = mocker.patch("falcon_epdb.timing.monotonic", return_value=10.0)
+    calls = []
+
+    def interaction(self, frame, traceback):
+        calls.append((self, frame, traceback))
+        mock_monotonic.return_value = 12.5
+
+    epdb_hooks.interaction = interaction
+    debugger = mocker.Mock(spec=epdb.Epdb)
+    before = paused_seconds()
+
+    time_pauses(epdb)
+    time_pauses(epdb)
+    epdb.Epdb.interaction(debugger, None, None)
+
+    assert paused_seconds() - before == 2.5
+    assert calls == [(debugger, None, None)]
+
+
+def test_wait_excludes_pauses(mocker):
+    """Test that time paused at the prompt while blocked is not counted as waiting."""
+    mock_monotonic = mocker.patch("falcon_epdb.timing.monotonic", return_value=100.0)
+    mock_paused = mocker.patch("falcon_epdb.timing.paused_seconds", return_value=1.0)
+    timing = ServerTiming()
+
+    mock_monotonic.return_value = 105.0
+    mock_paused.return_value = 3.0
+    timing.add_wait(100.0, 1.0)
+
+    assert timing.wait == 3.0
+    assert timing.paused == 2.0
+    assert timing.header_value() == (
+        "epdb-decode;dur=0.000, epdb-wait;dur=3000.000, epdb-paused;dur=2000.000"
+    )
+
+
+def test_existing_server_timing_is_kept(mocker):
+    """Test that other Server-Timing metrics on the response are not replaced."""
+    resp = mocker.Mock()
+
+    ServerTiming().finish(resp)
+
+    resp.append_header.assert_called_once_with("Server-Timing", mocker.ANY)
+    resp.set_header.assert_called_once_with("X-EPDB-Flagged", "1")
+
+
+def test_time_pauses_alongside_limits(mocker, epdb_hooks):
+    """Test that the pause timing and the session limits each wrap the prompt only once."""
+    mock_monotonic = mocker.patch("falcon_epdb.timing.monotonic", return_value=10.0)
+    calls = []
+
+    def interaction(self, frame, traceback):
+        calls.append((self, frame, traceback))
+        mock_monotonic.return_value += 2.5
+
+    epdb_hooks.interaction = interaction
+    debugger = mocker.Mock(spec=epdb.Epdb)
+    before = paused_seconds()
+
+    for _ in range(3):
+        time_pauses(epdb)
+        watch_sessions(epdb)
+    epdb.Epdb.interaction(debugger, None, None)
+
+    assert paused_seconds() - before == 2.5
+    assert calls == [(debugger, None, None)]
+
+
+def test_flagged_requests_are_timed_with_limits(
+    make_client, base64_header, mock_epdb_serve, epdb_hooks
+):
+    """Test that each request's pauses are counted once when session limits also apply."""
+    epdb_hooks.interaction = lambda self, frame, traceback: time.sleep(0.05)
+    mock_epdb_serve.side_effect = lambda **kwargs: epdb.Epdb.interaction(None, None, None)
+    client = make_client(
+        EPDBServe(backend=Base64Backend(), server_timing=True, session_timeout=600)
+    )
+
+    paused = []
+    for _ in range(3):
+        result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+        paused.append(float(SERVER_TIMING.match(result.headers["Server-Timing"]).group("paused")))
+        wrapped = epdb.Epdb.interaction
+
+    assert epdb.Epdb.interaction is wrapped
+    assert all(50 <= duration < 100 for duration in paused)
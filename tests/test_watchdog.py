@@ -0,0 +1,206 @@
+"""Tests for the accept timeout and session limits"""
+
+# pylint: disable=protected-access,redefined-outer-name
+
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import testfixtures
+
+from falcon_epdb import Base64Backend, EPDBServe
+from falcon_epdb.watchdog import SessionLimits, current_limits, watch_sessions
+
+
+class FakeServer(object):  # pylint: disable=too-few-public-methods
+    """Stands in for epdb's telnet server, with a real child process relaying the connection."""
+
+    server_address = ("", 9000)
+
+    def __init__(self):
+        # Stopped by close_request(), as the watchdog does in place of epdb's server
+        self.relay = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-c", "import time; time.sleep(60)"]
+        )
+        self.serverPid = self.relay.pid  # pylint: disable=invalid-name
+        self.closed = False
+
+    def close_request(self):
+        """Close the session."""
+        self.closed = True
+        self.relay.kill()
+        self.relay.wait()
+
+
+class FakeEpdb(object):
+    """Stands in for the epdb debugger, whose prompt waits until the connection drops."""
+
+    _server = None
+
+    def __init__(self, error=None):
+        self.error = error
+        self.commands = []
+        self.calls = []
+
+    def interaction(self, frame, traceback):  # pylint: disable=unused-argument
+        """Wait at the prompt until the relay stops, then read end-of-file."""
+        self._server.relay.wait()
+        if self.error is not None:
+            raise self.error
+        self.onecmd("EOF")
+
+    def onecmd(self, line):
+        """Run a command."""
+        self.commands.append(line)
+        if line == "close":
+            self._server.close_request()
+            type(self)._server = None
+
+    def forget(self):
+        """Record that the stack was forgotten."""
+        self.calls.append("forget")
+
+    def set_continue(self):
+        """Record that tracing was stopped."""
+        self.calls.append("set_continue")
+
+
+@pytest.fixture
+def fake_epdb(mocker):
+    """Provide a stand-in for the epdb module, with a session attached."""
+    debugger_class = type("Epdb", (FakeEpdb,), {"_server": FakeServer()})
+    yield mocker.Mock(Epdb=debugger_class)
+    if debugger_class._server is not None:
+        debugger_class._server.close_request()
+
+
+@pytest.fixture
+def limits():
+    """Provide limits on the current thread, removed after the test."""
+    limits = SessionLimits(pause_timeout=0.1)
+    limits.start()
+    yield limits
+    limits.finish()
+
+
+def test_pause_timeout_closes_session(fake_epdb, limits):
+    """Test that a prompt left waiting is disconnected, and the session closed, at the limit."""
+    server = fake_epdb.Epdb._server
+    debugger = fake_epdb.Epdb()
+    watch_sessions(fake_epdb)
+    watch_sessions(fake_epdb)
+
+    started = time.time()
+    with testfixtures.LogCapture() as logs:
+        debugger.interaction(None, None)
+
+    assert time.time() - started >= 0.1
+    assert limits.expired
+    assert limits.paused >= 0.1
+    assert debugger.commands == ["close"]
+    assert server.closed
+    assert server.relay.returncode == -signal.SIGTERM
+    assert fake_epdb.Epdb._server is None
+    logs.check(
+        (
+            "falcon_epdb.watchdog",
+            "WARNING",
+            "Closing the epdb session on port 9000: time limit reached",
+        )
+    )
+
+
+def test_disconnection_error_closes_session(fake_epdb, limits):
+    """Test that an error reading from the dropped connection still ends the session cleanly."""
+    server = fake_epdb.Epdb._server
+    debugger = fake_epdb.Epdb(error=IOError("Input/output error"))
+    watch_sessions(fake_epdb)
+
+    debugger.interaction(None, None)
+
+    assert limits.expired
+    assert server.closed
+    assert debugger.calls == ["forget", "set_continue"]
+
+
+def test_session_timeout_applies_across_pauses(fake_epdb, mocker):
+    """Test that a session past its limit is closed without prompting again."""
+    mock_monotonic = mocker.patch("falcon_epdb.watchdog.monotonic", return_value=100.0)
+    server = fake_epdb.Epdb._server
+    limits = SessionLimits(session_timeout=30)
+
+    assert limits.remaining(server) == 30
+    mock_monotonic.return_value = 120.0
+    assert limits.remaining(server) == 10
+    assert SessionLimits(session_timeout=30).remaining(server) == 10
+
+    mock_monotonic.return_value = 130.0
+    debugger = fake_epdb.Epdb()
+    watch_sessions(fake_epdb)
+    limits.start()
+    try:
+        debugger.interaction(None, None)
+    finally:
+        limits.finish()
+
+    assert limits.expired
+    assert server.closed
+    assert debugger.commands == []
+    assert debugger.calls == ["forget", "set_continue"]
+
+
+def test_unlimited_threads_are_untouched(fake_epdb):
+    """Test that the prompt is left alone on threads without limits."""
+    debugger = fake_epdb.Epdb(error=ValueError("Oops"))
+    fake_epdb.Epdb._server.relay.kill()
+    watch_sessions(fake_epdb)
+
+    with pytest.raises(ValueError):
+        debugger.interaction(None, None)
+    debugger.onecmd("next")
+
+    assert debugger.commands == ["next"]
+    assert SessionLimits().remaining(fake_epdb.Epdb._server) is None
+
+
+def test_accept_timeout_lets_request_continue(make_client, base64_header, mock_epdb_serve):
+    """Test that a blocking request waiting for a client gives up at the accept timeout."""
+    listener = socket.socket()
+    listener.bind(("", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    client = make_client(
+        EPDBServe(backend=Base64Backend(), serve_options={"port": port}, accept_timeout=0.05)
+    )
+
+    started = time.time()
+    result = client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert time.time() - started < 5
+    assert result.status_code == 200
+    assert not mock_epdb_serve.called
+
+
+def test_middleware_applies_limits_to_request(
+    make_client, base64_header, mock_epdb_serve, epdb_hooks
+):
+    """Test that the limits apply to the flagged request's thread until its response."""
+    applied = []
+    mock_epdb_serve.side_effect = lambda **kwargs: applied.append(current_limits())
+    client = make_client(
+        EPDBServe(
+            backend=Base64Backend(),
+            serve_options={"port": 9000},
+            session_timeout=600,
+            pause_timeout=60,
+        )
+    )
+
+    client.simulate_get(headers={"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert [(limits.session_timeout, limits.pause_timeout) for limits in applied] == [(600, 60)]
+    assert current_limits() is None
+    assert epdb_hooks.falcon_epdb_watched
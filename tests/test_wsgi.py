@@ -0,0 +1,221 @@
+"""Tests for the WSGIEPDBServe functionality"""
+
+# pylint: disable=redefined-outer-name
+
+import base64
+import json
+import zlib
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from falcon_epdb import Base64Backend, SessionManager, TriggerRules
+from falcon_epdb.wsgi import EnvironRequest, WSGIEPDBServe
+
+
+def encode_header(content):
+    """Return an X-EPDB header value for the Base64 backend."""
+    return "Base64 {}".format(base64.b64encode(json.dumps(content).encode()).decode())
+
+
+class App(object):
+    """A plain WSGI application, recording its calls."""
+
+    def __init__(self, lazy=False, error=None):
+        self.lazy = lazy
+        self.error = error
+        self.calls = []
+
+    def __call__(self, environ, start_response):
+        """Respond with a JSON body."""
+        self.calls.append((environ, start_response))
+        if self.error is not None:
+            raise self.error
+        if self.lazy:
+            return self.lazy_body(start_response)
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+        return [b"{}"]
+
+    def lazy_body(self, start_response):
+        """Start the response only once the body is iterated, doing the work as it goes."""
+        start_response("200 OK", [("Content-Type", "application/json")])
+        yield b"{"
+        self.render_order()
+        yield b"}"
+
+    @staticmethod
+    def render_order():
+        """Do some work while producing the body."""
+        return sorted(range(100), key=str)
+
+
+def call(middleware, headers=None, **environ):
+    """Call the middleware, returning the status, headers and body of the response."""
+    for name, value in (headers or {}).items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    setup_testing_defaults(environ)
+    started = []
+
+    def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+        started.append((status, dict(headers)))
+
+    result = middleware(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    status, headers = started[-1]
+    return status, headers, body
+
+
+@pytest.fixture
+def app():
+    """Provide the wrapped application."""
+    return App()
+
+
+@pytest.fixture
+def middleware(app):
+    """Provide the middleware wrapping the application."""
+    return WSGIEPDBServe(app, Base64Backend(), serve_options={"port": 9000})
+
+
+def test_request_without_header_is_passed_through(middleware, app, mock_epdb_serve, mocker):
+    """Test that the application gets the untouched request without the middleware's work."""
+    process_request = mocker.spy(middleware, "process_request")
+    environ = {}
+    setup_testing_defaults(environ)
+
+    def start_response(status, headers, exc_info=None):  # pylint: disable=unused-argument
+        return None
+
+    assert middleware(environ, start_response) == [b"{}"]
+
+    assert app.calls == [(environ, start_response)]
+    assert not process_request.called
+    assert not mock_epdb_serve.called
+
+
+@pytest.mark.parametrize("name", ("X-EPDB", "HTTP-X-EPDB"))
+def test_flagged_request_activates_epdb(middleware, app, base64_header, mock_epdb_serve, name):
+    """Test that the header, with or without the HTTP- prefix, starts the server."""
+    status, headers, body = call(middleware, {name: "Base64 {}".format(base64_header)})
+
+    assert status == "200 OK"
+    assert "X-EPDB-Port" not in headers
+    assert body == b"{}"
+    assert len(app.calls) == 1
+    mock_epdb_serve.assert_called_once_with(port=9000)
+
+
+def test_rejected_header_is_passed_through(middleware, app, mock_epdb_serve):
+    """Test that a request with an invalid header is handled as normal."""
+    status, _, body = call(middleware, {"X-EPDB": "Base64 junk"})
+
+    assert (status, body) == ("200 OK", b"{}")
+    assert len(app.calls) == 1
+    assert not mock_epdb_serve.called
+
+
+@pytest.mark.parametrize("lazy", (False, True), ids=("eager", "lazy"))
+def test_action_report_replaces_body(mock_epdb_serve, tmpdir, lazy):
+    """Test that an action's report replaces the application's response body."""
+    middleware = WSGIEPDBServe(App(lazy=lazy), Base64Backend(), output_dir=str(tmpdir))
+
+    status, headers, body = call(middleware, {"X-EPDB": encode_header({"epdb": {"profile": {}}})})
+
+    assert status == "200 OK"
+    assert headers["Content-Type"] == "text/plain; charset=utf-8"
+    assert headers["Content-Length"] == str(len(body))
+    assert b"function calls" in body
+    assert not mock_epdb_serve.called
+    assert middleware._pending_responses == 0  # pylint: disable=protected-access
+
+
+def test_action_covers_lazy_body(mock_epdb_serve, tmpdir):
+    """Test that an action finishes only once a generator application has produced its body."""
+    # pylint: disable=unused-argument
+    middleware = WSGIEPDBServe(App(lazy=True), Base64Backend(), output_dir=str(tmpdir))
+    header = encode_header({"epdb": {"profile": {"output": "header"}}})
+
+    _, headers, body = call(middleware, {"X-EPDB": header})
+
+    assert body == b"{}"
+    report = zlib.decompress(base64.b64decode(headers["X-EPDB-Profile"])).decode()
+    assert "render_order" in report
+
+
+def test_session_is_held_until_body_is_closed(base64_header, mock_epdb_serve):
+    """Test that a flagged request holds the session until the server closes its body."""
+    sessions = SessionManager()
+    busy = []
+    app = App(lazy=True)
+    app.render_order = lambda: busy.append(sessions.busy)
+    middleware = WSGIEPDBServe(app, Base64Backend(), sessions=sessions, server_timing=True)
+
+    _, headers, body = call(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert body == b"{}"
+    assert busy == [True]
+    assert not sessions.busy
+    assert headers["X-EPDB-Flagged"] == "1"
+    assert mock_epdb_serve.called
+
+
+def test_busy_request_is_rejected(app, base64_header, mock_epdb_serve):
+    """Test that a rejected request is answered without calling the application."""
+    sessions = SessionManager(when_busy="reject")
+    middleware = WSGIEPDBServe(app, Base64Backend(), sessions=sessions)
+    ticket = sessions.admit("GET /other")
+    try:
+        status, headers, body = call(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+    finally:
+        ticket.finish()
+
+    assert status == "503 Service Unavailable"
+    assert headers["X-EPDB-Busy"] == "1"
+    assert headers["Content-Length"] == "0"
+    assert body == b""
+    assert not app.calls
+    assert not mock_epdb_serve.called
+
+
+def test_failing_application_releases_session(base64_header, mock_epdb_serve):
+    """Test that the response is processed even if the application raises."""
+    sessions = SessionManager()
+    middleware = WSGIEPDBServe(App(error=ValueError("Oops")), Base64Backend(), sessions=sessions)
+
+    with pytest.raises(ValueError):
+        call(middleware, {"X-EPDB": "Base64 {}".format(base64_header)})
+
+    assert mock_epdb_serve.called
+    assert not sessions.busy
+
+
+def test_rules_see_the_request(app, mock_epdb_serve):
+    """Test that trigger rules match requests without the header, by method, path and params."""
+    rules = TriggerRules()
+    rules.arm("POST", "/orders", params={"sku": "42"})
+    middleware = WSGIEPDBServe(app, Base64Backend(), rules=rules)
+
+    call(middleware, REQUEST_METHOD="POST", PATH_INFO="/orders", QUERY_STRING="sku=41")
+    assert not mock_epdb_serve.called
+
+    call(middleware, REQUEST_METHOD="POST", PATH_INFO="/orders", QUERY_STRING="sku=42&x=")
+    assert mock_epdb_serve.called
+
+
+def test_environ_request():
+    """Test that the view of the environ answers as a Falcon request would."""
+    req = EnvironRequest(
+        {"HTTP_HTTP_X_EPDB": "Base64 e30=", "CONTENT_TYPE": "text/plain", "QUERY_STRING": "a=1&a=2"}
+    )
+
+    assert req.env["HTTP_X_EPDB"] == "Base64 e30="
+    assert req.get_header("X-EPDB") == "Base64 e30="
+    assert req.get_header("Content-Type") == "text/plain"
+    assert req.get_header("X-Missing", "default") == "default"
+    assert req.get_param("a") == "1"
+    assert req.get_param("b") is None
+    assert (req.method, req.path, req.remote_addr) == ("GET", "/", None)